@@ -13,17 +13,60 @@ from fastapi import (
   Security
 ) 
 import os
+import math
+import asyncio
+import time
+import secrets
+import hashlib
 from schemas import TokenData
-from redis import Redis
-from cache.session import get_redis_cache
-from cache.functions import get_token
+from redis.asyncio import Redis
+from cache.session import get_aio_redis_cache
+from cache.aio_functions import get_token
+from cache.denylist import token_denylist
+from auth.pool import BoundedPool, PoolFullError
+from auth.keys import KeySet
+from cache.local import LocalCache
+from log_utils.timing import stage, timed
+from log_utils.logger import get_logger
+from starlette.concurrency import run_in_threadpool
+import redis
 
 
 OAUTH2_SECRET_KEY = os.getenv('OAUTH2_SECRET_KEY')
-OAUTH2_ALGORITHM = os.getenv('OAUTH2_ALGORITHM')
+OAUTH2_ALGORITHM = os.getenv('OAUTH2_ALGORITHM', 'HS256')
+OAUTH2_KEYS_DIR = os.getenv('OAUTH2_KEYS_DIR', '')
+OAUTH2_ACTIVE_KID = os.getenv('OAUTH2_ACTIVE_KID', '')
+OAUTH2_LEGACY_HS256_UNTIL = float(os.getenv('OAUTH2_LEGACY_HS256_UNTIL') or 0)
+HASH_POOL_KIND = os.getenv('HASH_POOL_KIND', 'thread')
+HASH_POOL_WORKERS = int(os.getenv('HASH_POOL_WORKERS', os.cpu_count() or 1))
+HASH_POOL_QUEUE_SIZE = int(os.getenv('HASH_POOL_QUEUE_SIZE', 64))
+TOKEN_CACHE_MAX_SIZE = int(os.getenv('TOKEN_CACHE_MAX_SIZE', 10000))
+TOKEN_CACHE_TTL = float(os.getenv('TOKEN_CACHE_TTL', 300))
+BCRYPT_ROUNDS = os.getenv('BCRYPT_ROUNDS')
+BCRYPT_TARGET_MS = float(os.getenv('BCRYPT_TARGET_MS', 0))
+BCRYPT_MIN_ROUNDS = int(os.getenv('BCRYPT_MIN_ROUNDS', 10))
+BCRYPT_MAX_ROUNDS = int(os.getenv('BCRYPT_MAX_ROUNDS', 16))
+BCRYPT_RECALIBRATE = os.getenv('BCRYPT_RECALIBRATE', 'false').lower() in ('1', 'true', 'yes')
+
+# `database` sends plain passwords for the database service to hash, `api` hashes them here
+PASSWORD_HASH_MODE = os.getenv('PASSWORD_HASH_MODE', 'database')
+
+BCRYPT_ROUNDS_KEY = 'auth:bcrypt_rounds'
+
+logger = get_logger('auth.log')
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# cost of new hashes, None keeps the passlib default and never asks for a rehash
+bcrypt_rounds = None
+
+signing_keys = KeySet(OAUTH2_ALGORITHM, OAUTH2_SECRET_KEY, OAUTH2_KEYS_DIR, OAUTH2_ACTIVE_KID, OAUTH2_LEGACY_HS256_UNTIL or None)
+
+hash_pool = BoundedPool(HASH_POOL_KIND, HASH_POOL_WORKERS, HASH_POOL_QUEUE_SIZE)
+
+# verified tokens keyed by sha256 digest, holding (TokenData, TokenUser, iat)
+token_cache = LocalCache(TOKEN_CACHE_MAX_SIZE, TOKEN_CACHE_TTL, 'jwt')
+
 oauth2_scheme = OAuth2PasswordBearer(
     tokenUrl="/auth/login",
     scopes={"USER": "normal user", "ADMIN": "administrator user"},
@@ -34,13 +77,186 @@ def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 
+def hash_password(plain_password, rounds= None):
+    # rounds are passed explicitly, process pool workers do not see the calibrated context
+
+    if rounds:
+        return pwd_context.handler('bcrypt').using(rounds= rounds).hash(plain_password)
+
+    return pwd_context.hash(plain_password)
+
+
+def hash_many(plain_passwords, rounds= None):
+
+    return [hash_password(plain_password, rounds) for plain_password in plain_passwords]
+
+
+def password_needs_update(hashed_password) -> bool:
+
+    return bcrypt_rounds is not None and pwd_context.needs_update(hashed_password)
+
+
+def set_bcrypt_rounds(rounds: int):
+    """New hashes use `rounds` and cheaper hashes need an update. Costlier
+    ones are kept, so workers that disagree on the cost never rehash the
+    same password back and forth"""
+
+    global bcrypt_rounds
+    pwd_context.update(bcrypt__default_rounds= rounds, bcrypt__min_rounds= rounds)
+    bcrypt_rounds = rounds
+
+
+def measure_bcrypt(rounds: int, samples: int = 3) -> float:
+
+    handler = pwd_context.handler('bcrypt').using(rounds= rounds)
+    best = None
+    for _ in range(samples):
+        start = time.perf_counter()
+        handler.hash(secrets.token_hex(8))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def calibrate_bcrypt_rounds(target_ms: float, min_rounds: int, max_rounds: int) -> int:
+    """Highest cost whose hash fits in `target_ms`, every extra round doubles the time"""
+
+    elapsed = measure_bcrypt(min_rounds)
+    extra = math.floor(math.log2(target_ms / 1000 / elapsed)) if elapsed * 1000 < target_ms else 0
+    return max(min_rounds, min(max_rounds, min_rounds + extra))
+
+
+async def configure_bcrypt(cache_db: Redis):
+    """Sets the bcrypt cost at startup, from BCRYPT_ROUNDS or calibrated
+    against BCRYPT_TARGET_MS. The first worker to calibrate stores the cost
+    in redis without expiry and every later worker uses it; it is measured
+    again only when a worker starts with BCRYPT_RECALIBRATE"""
+
+    if BCRYPT_ROUNDS:
+        set_bcrypt_rounds(int(BCRYPT_ROUNDS))
+
+    elif BCRYPT_TARGET_MS > 0:
+        rounds = None
+        try:
+            rounds = None if BCRYPT_RECALIBRATE else await cache_db.get(BCRYPT_ROUNDS_KEY)
+
+        except redis.RedisError as e:
+            logger.error('[bcrypt] Failed to read the shared rounds [error: %s]', e)
+
+        if rounds is None:
+            rounds = await run_in_threadpool(calibrate_bcrypt_rounds, BCRYPT_TARGET_MS, BCRYPT_MIN_ROUNDS, BCRYPT_MAX_ROUNDS)
+            try:
+                if not await cache_db.set(BCRYPT_ROUNDS_KEY, rounds, nx= not BCRYPT_RECALIBRATE):
+                    rounds = await cache_db.get(BCRYPT_ROUNDS_KEY) or rounds
+
+            except redis.RedisError as e:
+                logger.error('[bcrypt] Failed to share the calibrated rounds [error: %s]', e)
+
+        set_bcrypt_rounds(int(rounds))
+
+    else:
+        return
+
+    logger.info('[bcrypt] Hashing with %s rounds [target_ms: %s]', bcrypt_rounds, BCRYPT_TARGET_MS or None)
+
+
+def _hash_pool_busy():
+
+    return HTTPException(
+        status_code= status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail= {'code': 2004, 'message': 'Server is busy, try again later'},
+        headers= {'Retry-After': '1'}
+    )
+
+
+@timed('bcrypt.verify')
+async def verify_password_async(plain_password, hashed_password):
+
+    try:
+        return await hash_pool.run(verify_password, plain_password, hashed_password)
+
+    except PoolFullError:
+        raise _hash_pool_busy()
+
+
+@timed('bcrypt.hash')
+async def hash_password_async(plain_password):
+
+    try:
+        return await hash_pool.run(hash_password, plain_password, bcrypt_rounds)
+
+    except PoolFullError:
+        raise _hash_pool_busy()
+
+
+@timed('bcrypt.verify')
+def verify_password_pooled(plain_password, hashed_password):
+
+    try:
+        return hash_pool.run_sync(verify_password, plain_password, hashed_password)
+
+    except PoolFullError:
+        raise _hash_pool_busy()
+
+
+@timed('bcrypt.hash')
+def hash_password_pooled(plain_password):
+
+    try:
+        return hash_pool.run_sync(hash_password, plain_password, bcrypt_rounds)
+
+    except PoolFullError:
+        raise _hash_pool_busy()
+
+
+@timed('bcrypt.hash_many')
+async def hash_passwords_async(plain_passwords: list) -> list:
+    """Hashes a batch split in one chunk per pool worker, so it takes
+    `workers` slots of the pool whatever its size"""
+
+    if not plain_passwords:
+        return []
+
+    size = -(-len(plain_passwords) // hash_pool.workers)
+    futures = []
+    try:
+        for start in range(0, len(plain_passwords), size):
+            futures.append(hash_pool.submit(hash_many, plain_passwords[start:start + size], bcrypt_rounds))
+
+    except PoolFullError:
+        for future in futures:
+            future.cancel()
+        raise _hash_pool_busy()
+
+    chunks = await asyncio.gather(*(asyncio.wrap_future(future) for future in futures))
+    return [hashed for chunk in chunks for hashed in chunk]
+
+
+def password_fields(plain_password) -> dict:
+    """`password` (and `hashed`) fields of a write request in the configured hash mode"""
+
+    if PASSWORD_HASH_MODE == 'api':
+        return {'password': hash_password_pooled(plain_password), 'hashed': True}
+
+    return {'password': plain_password}
+
+
+async def passwords_fields(plain_passwords: list) -> list:
+
+    if PASSWORD_HASH_MODE == 'api':
+        return [{'password': hashed, 'hashed': True} for hashed in await hash_passwords_async(plain_passwords)]
+
+    return [{'password': plain_password} for plain_password in plain_passwords]
+
+
 def create_access_token(data: dict):
     to_encode = data.copy()
-    encoded_jwt = jwt.encode(to_encode, OAUTH2_SECRET_KEY, algorithm=OAUTH2_ALGORITHM)
+    encoded_jwt = signing_keys.encode(to_encode)
     return encoded_jwt
 
 
-async def get_current_user(security_scopes: SecurityScopes, token: Annotated[str, Depends(oauth2_scheme)], cache_db: Redis= Depends(get_redis_cache) ):
+async def get_current_user(security_scopes: SecurityScopes, token: Annotated[str, Depends(oauth2_scheme)], cache_db: Redis= Depends(get_aio_redis_cache) ):
     
     if security_scopes.scopes:
         authenticate_value = f'Bearer scope="{security_scopes.scope_str}"'
@@ -54,30 +270,46 @@ async def get_current_user(security_scopes: SecurityScopes, token: Annotated[str
         headers={"WWW-Authenticate": authenticate_value},
     )
 
-    try:
-        payload = jwt.decode(token, OAUTH2_SECRET_KEY, algorithms=[OAUTH2_ALGORITHM])
-        user_id: int = payload.get("user_id")
-        
-        token = get_token(user_id, cache_db)
+    digest = hashlib.sha256(token.encode()).digest()
+    cached = token_cache.get(digest)
 
-        if token is None:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Token is expired",
-                headers={"WWW-Authenticate": authenticate_value},
-            )
+    if cached is None:
+        try:
+            with stage('jwt_decode'):
+                payload = signing_keys.decode(token)
+
+            user_id: int = payload.get("user_id")
+            scopes = payload.get("scopes", [])
+            role = payload.get("role", None)
+            username = payload.get("username", None)
+
+            issued_at = payload.get("iat", None)
+
+            token_data = TokenData(user_id= user_id, role= role, username= username, scopes= scopes)
 
-        scopes = payload.get("scopes", [])
-        role = payload.get("role", None)
+        except (JWTError, ValidationError):
+            raise credentials_exception
 
-        username = payload.get("username", None)
-        token_data = TokenData(user_id= user_id, role= role, username= username, scopes= scopes)
-            
-    except (JWTError, ValidationError):
-        raise credentials_exception
+        cached = (token_data, TokenUser(user_id=user_id, role=role, username= username), issued_at)
+        token_cache.set(digest, cached, ttl= payload['exp'] - time.time() if 'exp' in payload else None)
 
-    except HTTPException as e:
-        raise e
+    token_data, current_user, issued_at = cached
+
+    if issued_at is not None and token_denylist.fresh:
+        revoked = token_denylist.revoked(token_data.user_id, issued_at)
+
+    else:
+        # issued before tokens carried `iat`, or the denylist isn't loaded: only
+        # the stored token tells if it was revoked
+        revoked = await get_token(token_data.user_id, cache_db) is None
+
+    if revoked:
+        token_cache.delete(digest)
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token is expired",
+            headers={"WWW-Authenticate": authenticate_value},
+        )
 
     for scope in security_scopes.scopes:
         if scope not in token_data.scopes:
@@ -87,7 +319,7 @@ async def get_current_user(security_scopes: SecurityScopes, token: Annotated[str
                 headers={"WWW-Authenticate": authenticate_value},
             )
         
-    return TokenUser(user_id=user_id, role=role, username= username)
+    return current_user
 
 
 async def get_normal_user(current_user: Annotated[TokenUser, Security(get_current_user, scopes=["USER"])]):
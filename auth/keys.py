@@ -0,0 +1,98 @@
+from jose import jwk, jwt, JWTError
+from jose.constants import ALGORITHMS
+import hashlib
+import json
+import os
+
+
+# tokens signed before the switch to an asymmetric algorithm carry no kid
+LEGACY_ALGORITHM = ALGORITHMS.HS256
+
+
+class KeySet:
+    """Signing and verification keys, parsed once into jose key objects
+    instead of on every encode and decode.
+
+    HS* algorithms sign with the shared secret and publish nothing. RS* and
+    ES* load every `<kid>.pem` of `keys_dir`. Private keys sign and verify,
+    public keys only verify, which keeps a retired key's tokens valid until
+    they expire. Every key is published in the JWKS and the `active_kid`
+    key (by default the last private kid in sort order) signs with its kid
+    in the token header.
+
+    After the switch to RS*/ES* a token without kid is verified with the
+    shared secret only when `legacy_until` (unix time) is set and the token
+    expires by then, anyone holding the secret could mint one otherwise"""
+
+    def __init__(self, algorithm: str, secret: str, keys_dir: str, active_kid: str, legacy_until: float = None):
+        self.algorithm = algorithm
+        self.symmetric = algorithm in ALGORITHMS.HMAC
+        self.active_kid = None
+        self.legacy_until = None if self.symmetric else legacy_until
+        self._keys = {}
+        self._signing_key = None
+        if not secret or not (self.symmetric or legacy_until):
+            self._secret_key = None
+        else:
+            self._secret_key = jwk.construct(secret, self.algorithm if self.symmetric else LEGACY_ALGORITHM)
+
+        if not self.symmetric:
+            loaded = self._load(keys_dir)
+            self.active_kid = active_kid or max((kid for kid, key in loaded.items() if not key.is_public()), default=None)
+
+            self._signing_key = loaded.get(self.active_kid)
+            if self._signing_key is None or self._signing_key.is_public():
+                raise RuntimeError(f'OAUTH2_ALGORITHM {algorithm} needs the private key of kid {self.active_kid!r} in OAUTH2_KEYS_DIR')
+
+            # the ecdsa backend only verifies with a public key object
+            self._keys = {kid: key.public_key() for kid, key in loaded.items()}
+
+        self.jwks = json.dumps({'keys': [
+            {**key.to_dict(), 'kid': kid, 'use': 'sig'} for kid, key in sorted(self._keys.items())
+        ]}, separators=(',', ':')).encode()
+        self.etag = '"%s"' % hashlib.sha256(self.jwks).hexdigest()[:32]
+
+    def _load(self, keys_dir: str) -> dict:
+
+        keys = {}
+        for name in sorted(os.listdir(keys_dir)) if keys_dir else []:
+            if name.endswith('.pem'):
+                with open(os.path.join(keys_dir, name)) as pem:
+                    keys[name[:-len('.pem')]] = jwk.construct(pem.read(), self.algorithm)
+
+        return keys
+
+    def encode(self, claims: dict) -> str:
+
+        if self.symmetric:
+            return jwt.encode(claims, self._secret_key, algorithm=self.algorithm)
+
+        return jwt.encode(claims, self._signing_key, algorithm=self.algorithm, headers={'kid': self.active_kid})
+
+    def decode(self, token: str) -> dict:
+        """Verifies `token` with the key its kid names, only with that key's
+        algorithm so a public key is never taken for an hmac secret"""
+
+        kid = jwt.get_unverified_header(token).get('kid')
+        if kid is None:
+            if self._secret_key is None:
+                raise JWTError('Token has no kid')
+
+            claims = jwt.decode(token, self._secret_key, algorithms=[self.algorithm if self.symmetric else LEGACY_ALGORITHM])
+            if self.legacy_until is not None and not claims.get('exp', float('inf')) <= self.legacy_until:
+                raise JWTError('Token without kid outlives the legacy cutoff')
+            return claims
+
+        key = self._keys.get(kid)
+        if key is None:
+            raise JWTError('Unknown kid')
+        return jwt.decode(token, key, algorithms=[self.algorithm])
+
+    def stats(self):
+        return {
+            'algorithm': self.algorithm,
+            'active_kid': self.active_kid,
+            'kids': sorted(self._keys),
+            'legacy_secret': self._secret_key is not None and not self.symmetric,
+            'legacy_until': self.legacy_until
+        }
@@ -0,0 +1,87 @@
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+import threading
+import asyncio
+
+
+class PoolFullError(Exception):
+    pass
+
+
+class BoundedPool:
+    """Thread or process pool that rejects work instead of queueing it
+    without limit, so a burst of CPU-heavy jobs can not pile up behind
+    the workers"""
+
+    def __init__(self, kind: str, workers: int, queue_size: int):
+
+        if kind not in ('thread', 'process'):
+            raise ValueError(f'Unknown pool kind: {kind}')
+
+        self.kind = kind
+        self.workers = workers
+        self.queue_size = queue_size
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._counter_lock = threading.Lock()
+        self._pending = 0
+        self._rejected = 0
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    if self.kind == 'process':
+                        self._executor = ProcessPoolExecutor(max_workers= self.workers)
+
+                    else:
+                        self._executor = ThreadPoolExecutor(max_workers= self.workers, thread_name_prefix='hash-pool')
+
+        return self._executor
+
+    def _release(self, _):
+        with self._counter_lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def submit(self, fn, *args) -> Future:
+
+        if not self._slots.acquire(blocking=False):
+            with self._counter_lock:
+                self._rejected += 1
+            raise PoolFullError(f'{self.kind} pool is full')
+
+        with self._counter_lock:
+            self._pending += 1
+        try:
+            future = self.executor.submit(fn, *args)
+
+        except Exception:
+            self._release(None)
+            raise
+
+        future.add_done_callback(self._release)
+        return future
+
+    async def run(self, fn, *args):
+
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def run_sync(self, fn, *args):
+
+        return self.submit(fn, *args).result()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self):
+        return {
+            'kind': self.kind,
+            'workers': self.workers,
+            'queue_size': self.queue_size,
+            'pending': self._pending,
+            'rejected': self._rejected
+        }
@@ -0,0 +1,67 @@
+"""Compares two result files of `benchmarks.load` run by run.
+
+    python -m benchmarks.compare benchmarks/results/base.json benchmarks/results/new.json --threshold 10
+
+Exits with status 1 when any throughput drops, or p99 grows, by more than
+`--threshold` percent.
+"""
+import argparse
+import json
+import sys
+
+
+def _key(run: dict) -> tuple:
+    return run['scenario'], run['workers'], run['concurrency']
+
+
+def _change(old, new):
+    if not old or new is None:
+        return None
+    return round((new - old) / old * 100, 1)
+
+
+def compare(base: dict, head: dict, threshold: float) -> bool:
+
+    base_runs = {_key(run): run for run in base['runs']}
+    regressed = False
+
+    print(f"{'scenario':<8} {'workers':>7} {'conc':>5} {'rps':>10} {'Δrps%':>7} {'p50ms':>9} {'Δp50%':>7} {'p99ms':>9} {'Δp99%':>7}")
+    for run in head['runs']:
+        old = base_runs.get(_key(run))
+        if old is None:
+            continue
+
+        rps = _change(old['throughput_rps'], run['throughput_rps'])
+        p50 = _change(old['p50_ms'], run['p50_ms'])
+        p99 = _change(old['p99_ms'], run['p99_ms'])
+
+        flag = ''
+        if (rps is not None and rps < -threshold) or (p99 is not None and p99 > threshold):
+            regressed = True
+            flag = '  <-- regression'
+
+        print(f"{run['scenario']:<8} {run['workers']:>7} {run['concurrency']:>5} {run['throughput_rps']:>10} {str(rps):>7} "
+              f"{str(run['p50_ms']):>9} {str(p50):>7} {str(run['p99_ms']):>9} {str(p99):>7}{flag}")
+
+    return regressed
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='compare two load benchmark results')
+    parser.add_argument('base')
+    parser.add_argument('head')
+    parser.add_argument('--threshold', type=float, default=10, help='allowed regression in percent')
+    args = parser.parse_args()
+
+    with open(args.base) as file:
+        base = json.load(file)
+    with open(args.head) as file:
+        head = json.load(file)
+
+    print(f"base {base.get('commit')}  ->  head {head.get('commit')}")
+    sys.exit(1 if compare(base, head, args.threshold) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+"""In-process stand-ins for the database service and redis.
+
+`FakeDataBase` implements every rpc of database.proto over an in-memory
+user table, with a configurable per call latency (mean and jitter, drawn
+from a seeded generator) and a share of calls failed with a grpc status.
+
+Standalone usage:
+
+    python -m benchmarks.fake_database --port 3333 --latency-ms 2 --error-rate 0.01
+"""
+from concurrent import futures
+from passlib.context import CryptContext
+import grpc_utils.database_pb2_grpc as pb2_grpc
+import grpc_utils.database_pb2 as pb2
+import threading
+import argparse
+import random
+import time
+import grpc
+
+
+USER_PASSWORD = 'benchpass'
+ADMIN_PASSWORD = 'adminpass'
+
+
+def username(index: int) -> str:
+    return f'bench_user_{index}'
+
+
+class FakeDataBase(pb2_grpc.DataBaseServicer):
+
+    def __init__(self, users: int = 1000, latency_ms: float = 0, jitter_ms: float = 0,
+                 error_rate: float = 0, error_status: str = 'UNAVAILABLE', bcrypt_rounds: int = 12, seed: int = 0):
+
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.error_status = getattr(grpc.StatusCode, error_status)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.users = {}
+        self.next_id = 1
+
+        # every seeded user shares one hash, hashing thousands of them would dominate the setup
+        self.context = CryptContext(schemes=['bcrypt'], bcrypt__rounds=bcrypt_rounds)
+        self._add('admin', self.context.hash(ADMIN_PASSWORD), pb2.ADMIN)
+        password = self.context.hash(USER_PASSWORD)
+        for index in range(users):
+            self._add(username(index), password, pb2.USER)
+
+    def _add(self, name, password, role, phone_number='+98-9151234567', email=None):
+        self.users[name] = pb2.UserInfo(
+            user_id= self.next_id, username= name, name= name, password= password,
+            role= role, phone_number= phone_number, email= email
+        )
+        self.next_id += 1
+
+    def _delay(self, context):
+
+        with self.lock:
+            delay = max(0, self.random.gauss(self.latency, self.jitter)) if self.jitter else self.latency
+            failed = self.error_rate and self.random.random() < self.error_rate
+
+        if delay:
+            time.sleep(delay)
+
+        if failed:
+            context.abort(self.error_status, 'injected error')
+
+    def _get(self, request):
+        user = self.users.get(request.username)
+        if user is None:
+            return pb2.ResponseUserInfo(code=1401, message='user not found')
+
+        return pb2.ResponseUserInfo(code=1200, message='ok', data=user)
+
+    def _password(self, request):
+        # like the real service, plain passwords are hashed here unless the api already did it
+        return request.password if request.hashed else self.context.hash(request.password)
+
+    def _new(self, request):
+        password = self._password(request)
+        with self.lock:
+            if request.username in self.users:
+                return pb2.BaseResponse(code=1403, message='username already exists')
+
+            self._add(request.username, password, request.role, request.phone_number,
+                      request.email if request.HasField('email') else None)
+
+        return pb2.BaseResponse(code=1200, message='ok')
+
+    def _modify(self, username, **fields):
+        with self.lock:
+            user = self.users.get(username)
+            if user is None:
+                return pb2.BaseResponse(code=1401, message='user not found')
+
+            for field, value in fields.items():
+                setattr(user, field, value)
+
+        return pb2.BaseResponse(code=1200, message='ok')
+
+    def _delete(self, request):
+        with self.lock:
+            if self.users.pop(request.username, None) is None:
+                return pb2.BaseResponse(code=1401, message='user not found')
+
+        return pb2.BaseResponse(code=1200, message='ok')
+
+    def GetUser(self, request, context):
+        self._delay(context)
+        return self._get(request)
+
+    def NewUser(self, request, context):
+        self._delay(context)
+        return self._new(request)
+
+    def ModifyUserPassword(self, request, context):
+        self._delay(context)
+        return self._modify(request.username, password= self._password(request))
+
+    def ModifyUserRole(self, request, context):
+        self._delay(context)
+        return self._modify(request.username, role= request.role)
+
+    def ModifyUserInfo(self, request, context):
+        self._delay(context)
+        fields = {field: getattr(request, field) for field in ('name', 'email', 'phone_number') if request.HasField(field)}
+        return self._modify(request.username, **fields)
+
+    def DeleteUser(self, request, context):
+        self._delay(context)
+        return self._delete(request)
+
+    def _batch(self, requests, context, action):
+        self._delay(context)
+
+        results = []
+        for request in requests:
+            user_id = self.users[request.username].user_id if request.username in self.users else None
+            resp = action(request)
+            item = pb2.BatchItemResponse(username= request.username, code= resp.code, message= resp.message)
+            if resp.code == 1200:
+                item.user_id = user_id if user_id is not None else self.users[request.username].user_id
+            results.append(item)
+
+        return pb2.ResponseBatch(code=1200, message='ok', results=results)
+
+    def NewUsers(self, request_iterator, context):
+        return self._batch(request_iterator, context, self._new)
+
+    def ModifyUsersRole(self, request_iterator, context):
+        return self._batch(request_iterator, context, lambda request: self._modify(request.username, role= request.role))
+
+    def DeleteUsers(self, request_iterator, context):
+        return self._batch(request_iterator, context, self._delete)
+
+    def ListUsers(self, request, context):
+        self._delay(context)
+
+        with self.lock:
+            users = sorted(self.users.values(), key=lambda user: user.user_id)
+
+        sent = 0
+        for user in users:
+            if user.user_id <= request.after_user_id:
+                continue
+            if request.HasField('role') and user.role != request.role:
+                continue
+
+            yield user
+            sent += 1
+            if request.limit and sent >= request.limit:
+                return
+
+
+def serve_grpc(port: int, threads: int = 32, **options) -> grpc.Server:
+
+    server = grpc.server(futures.ThreadPoolExecutor(threads))
+    pb2_grpc.add_DataBaseServicer_to_server(FakeDataBase(**options), server)
+    server.add_insecure_port(f'127.0.0.1:{port}')
+    server.start()
+    return server
+
+
+def serve_redis(port: int):
+    """fakeredis speaking the redis protocol on a local port, shared by every api worker"""
+
+    from fakeredis import TcpFakeServer
+
+    server = TcpFakeServer(('127.0.0.1', port), server_type='redis')
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+
+    parser.add_argument('--users', type=int, default=1000, help='seeded users, bench_user_0 ... bench_user_N-1')
+    parser.add_argument('--latency-ms', type=float, default=0, help='mean latency added to every rpc')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='standard deviation of the added latency')
+    parser.add_argument('--error-rate', type=float, default=0, help='share of rpcs failed with --error-status')
+    parser.add_argument('--error-status', default='UNAVAILABLE', help='grpc status of the injected errors')
+    parser.add_argument('--bcrypt-rounds', type=int, default=12, help='cost factor of the seeded password hashes')
+    parser.add_argument('--grpc-threads', type=int, default=32)
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def fake_options(args) -> dict:
+
+    return {
+        'users': args.users,
+        'latency_ms': args.latency_ms,
+        'jitter_ms': args.jitter_ms,
+        'error_rate': args.error_rate,
+        'error_status': args.error_status,
+        'bcrypt_rounds': args.bcrypt_rounds,
+        'seed': args.seed
+    }
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='fake database service')
+    parser.add_argument('--port', type=int, default=3333)
+    parser.add_argument('--redis-port', type=int, help='also serve fakeredis on this port')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = serve_grpc(args.port, args.grpc_threads, **fake_options(args))
+    if args.redis_port:
+        serve_redis(args.redis_port)
+
+    print(f'fake database service listening on 127.0.0.1:{args.port}')
+    server.wait_for_termination()
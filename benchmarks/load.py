@@ -0,0 +1,230 @@
+"""Load driver measuring throughput and latency percentiles of the api.
+
+Starts the fake database service and fakeredis in this process, runs the
+api under uvicorn with every requested worker count and drives each
+scenario at every concurrency level for a fixed duration. Results are
+written as JSON so runs of different commits can be compared with
+`python -m benchmarks.compare`.
+
+    python -m benchmarks.load --workers 1 4 --concurrency 1 16 64 --duration 10
+"""
+from benchmarks.fake_database import serve_grpc, serve_redis, add_arguments, fake_options, username, USER_PASSWORD
+import subprocess
+import tempfile
+import platform
+import argparse
+import asyncio
+import random
+import httpx
+import time
+import json
+import sys
+import os
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def login(client: httpx.AsyncClient, index: int, users: int):
+    return await client.post('/auth/login', data={'username': username(index % users), 'password': USER_PASSWORD, 'scope': 'USER'})
+
+
+async def info(client: httpx.AsyncClient, index: int, users: int, tokens: list):
+    return await client.get('/user/info', headers={'Authorization': f'Bearer {tokens[index % len(tokens)]}'})
+
+
+async def edit(client: httpx.AsyncClient, index: int, users: int, tokens: list):
+    return await client.put('/user/info/edit', json={'new_name': f'name_{index}'},
+                            headers={'Authorization': f'Bearer {tokens[index % len(tokens)]}'})
+
+
+SCENARIOS = {
+    'login': login,
+    'info': info,
+    'edit': edit
+}
+
+
+def percentile(values: list, q: float):
+
+    if not values:
+        return None
+
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+async def run_scenario(base_url: str, name: str, concurrency: int, duration: float, warmup: float, users: int, tokens: list, seed: int) -> dict:
+
+    scenario = SCENARIOS[name]
+    extra = () if name == 'login' else (tokens,)
+    latencies, statuses, errors = [], {}, 0
+    order = random.Random(seed)
+    start = time.perf_counter()
+    measure_from = start + warmup
+    stop_at = measure_from + duration
+
+    async def worker(client):
+        nonlocal errors
+        while True:
+            sent = time.perf_counter()
+            if sent >= stop_at:
+                return
+
+            try:
+                resp = await scenario(client, order.randrange(1 << 30), users, *extra)
+                status = resp.status_code
+
+            except httpx.HTTPError:
+                status = 'error'
+
+            if sent < measure_from:
+                continue
+
+            latencies.append(time.perf_counter() - sent)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            if status == 'error' or status >= 500:
+                errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+
+    return {
+        'scenario': name,
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'throughput_rps': round(len(latencies) / duration, 2),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+        'p90_ms': round(percentile(latencies, 0.90) * 1000, 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        'max_ms': round(max(latencies) * 1000, 3) if latencies else None,
+        'errors': errors,
+        'statuses': statuses
+    }
+
+
+async def fetch_tokens(base_url: str, count: int, users: int) -> list:
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        tokens = []
+        for index in range(count):
+            resp = await login(client, index, users)
+            resp.raise_for_status()
+            tokens.append(resp.json()['access_token'])
+
+    return tokens
+
+
+def start_api(args, workers: int, log_dir: str) -> subprocess.Popen:
+
+    env = {
+        # every request comes from one ip and reuses a few users, the login limiter would reject most of them
+        'LOGIN_USER_PER_MINUTE': '0',
+        'LOGIN_IP_PER_MINUTE': '0',
+        'LOGIN_LOCKOUT_THRESHOLD': '0',
+        **os.environ,
+        'OAUTH2_SECRET_KEY': 'benchmark-secret',
+        'OAUTH2_ALGORITHM': 'HS256',
+        'GRPC_HOST': '127.0.0.1',
+        'GRPC_PORT': str(args.grpc_port),
+        'CACHE_URL': args.redis_url or f'redis://127.0.0.1:{args.redis_port}',
+        'LOG_DIR': log_dir,
+        'LOG_LEVEL': 'WARNING'
+    }
+
+    return subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port', str(args.port),
+         '--workers', str(workers), '--no-access-log'],
+        cwd= ROOT, env= env
+    )
+
+
+def wait_ready(base_url: str, timeout: float = 30):
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f'{base_url}/health/cache').status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+
+    raise RuntimeError('api did not become ready')
+
+
+def git_commit():
+
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='api load benchmark')
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 16, 64])
+    parser.add_argument('--workers', nargs='+', type=int, default=[1])
+    parser.add_argument('--duration', type=float, default=10, help='measured seconds per run')
+    parser.add_argument('--warmup', type=float, default=2, help='unmeasured seconds before each run')
+    parser.add_argument('--tokens', type=int, default=100, help='logged in users reused by the info and edit scenarios')
+    parser.add_argument('--port', type=int, default=8585)
+    parser.add_argument('--grpc-port', type=int, default=3390)
+    parser.add_argument('--redis-port', type=int, default=6390)
+    parser.add_argument('--redis-url', help='use this redis instead of fakeredis')
+    parser.add_argument('--output', help='result file, defaults to benchmarks/results/<time>-<commit>.json')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    grpc_server = serve_grpc(args.grpc_port, args.grpc_threads, **fake_options(args))
+    if not args.redis_url:
+        serve_redis(args.redis_port)
+
+    base_url = f'http://127.0.0.1:{args.port}'
+    runs = []
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        for workers in args.workers:
+            api = start_api(args, workers, log_dir)
+            try:
+                wait_ready(base_url)
+                tokens = asyncio.run(fetch_tokens(base_url, args.tokens, args.users))
+
+                for name in args.scenarios:
+                    for concurrency in args.concurrency:
+                        result = asyncio.run(run_scenario(base_url, name, concurrency, args.duration, args.warmup, args.users, tokens, args.seed))
+                        result['workers'] = workers
+                        runs.append(result)
+                        print(f"workers={workers} {name:<6} c={concurrency:<4} {result['throughput_rps']:>9} rps  "
+                              f"p50={result['p50_ms']}ms p99={result['p99_ms']}ms errors={result['errors']}", flush=True)
+
+            finally:
+                api.terminate()
+                api.wait(30)
+
+    grpc_server.stop(None)
+
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'options': {key: value for key, value in vars(args).items() if key != 'output'},
+        'runs': runs
+    }
+
+    output = args.output or os.path.join(ROOT, 'benchmarks', 'results', f"{time.strftime('%Y%m%d-%H%M%S')}-{commit or 'unknown'}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+
+    print(f'results written to {output}')
+
+
+if __name__ == '__main__':
+    main()
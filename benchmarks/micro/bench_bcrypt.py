@@ -0,0 +1,16 @@
+from auth.auth import verify_password
+from passlib.context import CryptContext
+import pytest
+
+
+PASSWORD = 'benchmark-password'
+
+
+@pytest.mark.parametrize('rounds', [4, 8, 10, 12])
+@pytest.mark.benchmark(group='bcrypt')
+def bench_verify_password(benchmark, rounds):
+    # the cost factor is read from the hash, so one context verifies every rounds value
+    hashed = CryptContext(schemes=['bcrypt'], bcrypt__rounds=rounds).hash(PASSWORD)
+    # 2^rounds iterations, a few rounds are enough for the slow end
+    result = benchmark.pedantic(verify_password, args=(PASSWORD, hashed), rounds=max(3, 2 ** (14 - rounds)), warmup_rounds=1)
+    assert result
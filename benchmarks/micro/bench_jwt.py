@@ -0,0 +1,29 @@
+from auth.auth import create_access_token, signing_keys
+import pytest
+import time
+
+
+def _claims(rng):
+    user_id = rng.randrange(1, 1_000_000)
+    return {
+        'user_id': user_id,
+        'username': f'user_{user_id}',
+        'role': 'USER',
+        'scopes': ['USER'],
+        # fixed expiry keeps the encoded token identical between runs
+        'exp': 4102444800
+    }
+
+
+@pytest.mark.benchmark(group='jwt')
+def bench_create_access_token(benchmark, rng):
+    claims = _claims(rng)
+    benchmark(create_access_token, claims)
+
+
+@pytest.mark.benchmark(group='jwt')
+def bench_jwt_decode(benchmark, rng):
+    # same call as get_current_user on a token cache miss
+    token = create_access_token(_claims(rng))
+    payload = benchmark(signing_keys.decode, token)
+    assert payload['exp'] > time.time()
@@ -0,0 +1,42 @@
+from schemas import PhoneNumberStr, UserRegister, UserInfoResponse, TokenData
+import pytest
+
+
+def _phone(rng):
+    return f'+{rng.randrange(1, 999)}-{rng.randrange(10 ** 9, 10 ** 10)}'
+
+
+def _user(rng):
+    index = rng.randrange(1_000_000)
+    return {
+        'username': f'user_{index}',
+        'password': f'password_{index}',
+        'name': f'name {index}',
+        'email': f'user_{index}@example.com',
+        'phone_number': _phone(rng),
+        'role': rng.choice(['ADMIN', 'USER'])
+    }
+
+
+@pytest.mark.benchmark(group='schemas')
+def bench_phone_number_validate(benchmark, rng):
+    phone = _phone(rng)
+    assert benchmark(PhoneNumberStr.validate, phone, None) == phone
+
+
+@pytest.mark.benchmark(group='schemas')
+def bench_user_register(benchmark, rng):
+    benchmark(lambda data: UserRegister(**data), _user(rng))
+
+
+@pytest.mark.benchmark(group='schemas')
+def bench_user_info_response(benchmark, rng):
+    # same shape as the resp_user dicts returned by database_service get_user
+    data = {'user_id': 1, **_user(rng)}
+    benchmark(lambda data: UserInfoResponse(**data), data)
+
+
+@pytest.mark.benchmark(group='schemas')
+def bench_token_data(benchmark, rng):
+    data = {'user_id': rng.randrange(1, 1_000_000), 'username': 'user', 'role': 'USER', 'scopes': ['USER']}
+    benchmark(lambda data: TokenData(**data), data)
@@ -0,0 +1,40 @@
+import tempfile
+import os
+
+# auth.auth reads its settings at import time
+os.environ.setdefault('OAUTH2_SECRET_KEY', 'benchmark-secret-09d25e094faa6ca2556c818166b7a9563b93f7099f6f0f4c')
+os.environ.setdefault('OAUTH2_ALGORITHM', 'HS256')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+os.environ.setdefault('LOG_DIR', tempfile.gettempdir())
+
+# RS* and ES* runs sign with a key generated for the run unless OAUTH2_KEYS_DIR is given
+if not os.environ['OAUTH2_ALGORITHM'].startswith('HS') and not os.getenv('OAUTH2_KEYS_DIR'):
+    os.environ['OAUTH2_KEYS_DIR'] = tempfile.mkdtemp()
+    with open(os.path.join(os.environ['OAUTH2_KEYS_DIR'], 'bench.pem'), 'wb') as pem:
+        if os.environ['OAUTH2_ALGORITHM'].startswith('ES'):
+            import ecdsa
+            pem.write(ecdsa.SigningKey.generate(curve=ecdsa.NIST256p).to_pem())
+        else:
+            import rsa
+            pem.write(rsa.newkeys(2048)[1].save_pkcs1())
+
+import random
+import pytest
+
+
+SEED = int(os.getenv('BENCHMARK_SEED', 0))
+
+
+@pytest.fixture(autouse=True)
+def fixed_seed():
+    random.seed(SEED)
+
+
+@pytest.fixture
+def rng():
+    return random.Random(SEED)
+
+
+def pytest_benchmark_update_json(config, benchmarks, output_json):
+    output_json['seed'] = SEED
+    output_json['algorithm'] = os.environ['OAUTH2_ALGORITHM']
@@ -0,0 +1,33 @@
+from cache.functions import token_store
+from cache.denylist import token_denylist
+from log_utils.timing import timed
+import redis.asyncio as aioredis
+
+@timed('redis.set_token')
+async def set_token(user_id, token, db: aioredis.Redis):
+    return await token_store.aset(user_id, token, db)
+
+@timed('redis.get_token')
+async def get_token(user_id, db: aioredis.Redis):
+    return await token_store.aget(user_id, db)
+
+@timed('redis.del_token')
+async def del_token(user_id, db: aioredis.Redis):
+    return await token_store.adelete(user_id, db)
+
+@timed('redis.set_tokens')
+async def set_tokens(tokens: dict, db: aioredis.Redis):
+    return await token_store.aset_many(tokens, db)
+
+@timed('redis.get_tokens')
+async def get_tokens(user_ids, db: aioredis.Redis) -> dict:
+    return await token_store.aget_many(user_ids, db)
+
+@timed('redis.del_tokens')
+async def del_tokens(user_ids, db: aioredis.Redis):
+    return await token_store.adelete_many(user_ids, db)
+
+@timed('redis.revoke_tokens')
+async def revoke_tokens(user_ids, db: aioredis.Redis):
+    await token_denylist.arevoke(user_ids, db)
+    return await token_store.adelete_many(user_ids, db)
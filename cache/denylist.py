@@ -0,0 +1,176 @@
+from log_utils.logger import get_logger
+import redis.asyncio as aioredis
+import threading
+import asyncio
+import redis
+import time
+import os
+
+
+TOKEN_DENYLIST_KEY = os.getenv('TOKEN_DENYLIST_KEY', 'auth:revoked')
+TOKEN_DENYLIST_REFRESH_INTERVAL = float(os.getenv('TOKEN_DENYLIST_REFRESH_INTERVAL', 1))
+TOKEN_DENYLIST_RETENTION = int(os.getenv('TOKEN_DENYLIST_RETENTION', 24*60*60*7))
+TOKEN_DENYLIST_MAX_STALENESS = float(os.getenv('TOKEN_DENYLIST_MAX_STALENESS', 30))
+# revocations are scored by the redis clock, a refresh still reads this far
+# behind its cursor in case a failover moved that clock backwards
+TOKEN_DENYLIST_CLOCK_SKEW = 5
+
+# KEYS[1] denylist, ARGV user ids; scored by the redis clock, the same clock
+# that stamps the `iat` of new tokens (`server_time`)
+REVOKE_SCRIPT = """
+local now = redis.call('TIME')
+local score = now[1] + now[2] / 1000000
+for i = 1, #ARGV do
+    redis.call('ZADD', KEYS[1], score, ARGV[i])
+end
+return now
+"""
+
+logger = get_logger('cache_denylist.log')
+
+
+class TokenDenylist:
+    """Users whose tokens issued up to a point in time are revoked.
+
+    Every revocation is a member of a redis sorted set (user id scored by
+    the revocation time) and every worker keeps a copy of it in memory,
+    refreshed incrementally by reading the members scored since its last
+    refresh. Checking a token is then a dict lookup: a token is revoked when
+    its `iat` is not after the revocation time of its user, a token issued
+    by a later login is valid again. Both times come from the redis clock,
+    so the skew between the workers' clocks doesn't matter.
+
+    Until a refresh succeeds, and again once the last one is older than
+    TOKEN_DENYLIST_MAX_STALENESS, the copy is not `fresh` and callers must
+    check the token store instead.
+
+    Revocations made by this worker apply right away, the ones of other
+    workers within TOKEN_DENYLIST_REFRESH_INTERVAL. Entries older than
+    TOKEN_DENYLIST_RETENTION (the token lifetime) can't match a living
+    token and are dropped"""
+
+    def __init__(self, key: str, refresh_interval: float, retention: int):
+        self.key = key
+        self.refresh_interval = refresh_interval
+        self.retention = retention
+        self.refreshes = 0
+        self.errors = 0
+        self.last_refresh_at = None
+        self._refreshed = None
+        self._revoked = {}
+        self._cursor = None
+        self._lock = threading.Lock()
+        self._task = None
+
+    @property
+    def fresh(self) -> bool:
+        return self._refreshed is not None and time.monotonic() - self._refreshed <= TOKEN_DENYLIST_MAX_STALENESS
+
+    def revoked(self, user_id: int, issued_at: float) -> bool:
+
+        revoked_at = self._revoked.get(user_id)
+        return revoked_at is not None and issued_at <= revoked_at
+
+    def _apply(self, revocations: dict):
+        with self._lock:
+            for user_id, revoked_at in revocations.items():
+                if revoked_at > self._revoked.get(user_id, 0):
+                    self._revoked[user_id] = revoked_at
+
+    def _revoked_at(self, user_ids: set, now) -> int:
+        revoked_at = int(now[0]) + int(now[1]) / 1000000
+        self._apply({user_id: revoked_at for user_id in user_ids})
+        return len(user_ids)
+
+    def revoke(self, user_ids, db: redis.Redis) -> int:
+
+        user_ids = {int(user_id) for user_id in user_ids}
+        if not user_ids:
+            return 0
+
+        return self._revoked_at(user_ids, db.eval(REVOKE_SCRIPT, 1, self.key, *user_ids))
+
+    async def arevoke(self, user_ids, db: aioredis.Redis) -> int:
+
+        user_ids = {int(user_id) for user_id in user_ids}
+        if not user_ids:
+            return 0
+
+        return self._revoked_at(user_ids, await db.eval(REVOKE_SCRIPT, 1, self.key, *user_ids))
+
+    async def refresh(self, db: aioredis.Redis) -> int:
+        """Loads the revocations scored since the last refresh, returns their count"""
+
+        oldest = time.time() - self.retention
+        start = oldest if self._cursor is None else max(oldest, self._cursor - TOKEN_DENYLIST_CLOCK_SKEW)
+
+        pipe = db.pipeline(transaction=False)
+        pipe.zremrangebyscore(self.key, '-inf', f'({oldest}')
+        pipe.zrangebyscore(self.key, start, '+inf', withscores=True)
+        _, members = await pipe.execute()
+
+        self._apply({int(user_id): revoked_at for user_id, revoked_at in members})
+        if members:
+            self._cursor = max(self._cursor or 0, members[-1][1])
+        elif self._cursor is None:
+            self._cursor = oldest
+
+        with self._lock:
+            self._revoked = {user_id: revoked_at for user_id, revoked_at in self._revoked.items() if revoked_at >= oldest}
+
+        self.refreshes += 1
+        self.last_refresh_at = time.time()
+        self._refreshed = time.monotonic()
+        return len(members)
+
+    async def _refresh_safely(self, db: aioredis.Redis):
+        try:
+            await self.refresh(db)
+
+        except redis.RedisError as e:
+            self.errors += 1
+            logger.error('[denylist] Refresh failed [key: %s -error: %s]', self.key, e)
+
+    async def _run(self, db: aioredis.Redis):
+
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await self._refresh_safely(db)
+
+    async def start(self, db: aioredis.Redis):
+        """Loads the whole denylist before the first request is served, when
+        that fails the loop retries and the denylist stays not `fresh`"""
+
+        if self._task is None:
+            await self._refresh_safely(db)
+            self._task = asyncio.create_task(self._run(db))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {
+            'key': self.key,
+            'fresh': self.fresh,
+            'entries': len(self._revoked),
+            'refreshes': self.refreshes,
+            'errors': self.errors,
+            'last_refresh_at': self.last_refresh_at,
+            'staleness': round(time.time() - self.last_refresh_at, 3) if self.last_refresh_at else None
+        }
+
+
+async def server_time(db: aioredis.Redis) -> float:
+    """Now by the redis clock, the `iat` of new tokens"""
+
+    seconds, microseconds = await db.time()
+    return seconds + microseconds / 1000000
+
+
+token_denylist = TokenDenylist(TOKEN_DENYLIST_KEY, TOKEN_DENYLIST_REFRESH_INTERVAL, TOKEN_DENYLIST_RETENTION)
@@ -1,10 +1,41 @@
+from cache.tiered import TwoTierCache
+from cache.denylist import token_denylist
+from log_utils.timing import timed
 import redis
+import os
 
+
+TOKEN_LOCAL_SIZE = int(os.getenv('TOKEN_LOCAL_SIZE', 10000))
+TOKEN_LOCAL_TTL = float(os.getenv('TOKEN_LOCAL_TTL', 30))
+
+token_store = TwoTierCache('user:token', 24*60*60*7, TOKEN_LOCAL_SIZE, TOKEN_LOCAL_TTL)
+
+@timed('redis.set_token')
 def set_token(user_id, token, db: redis.Redis):
-    return db.set(f'user:token:{user_id}', token, ex=24*60*60*7)
+    return token_store.set(user_id, token, db)
 
+@timed('redis.get_token')
 def get_token(user_id, db: redis.Redis):
-    return db.get(f'user:token:{user_id}')
+    return token_store.get(user_id, db)
 
+@timed('redis.del_token')
 def del_token(user_id, db: redis.Redis):
-    return db.delete(f'user:token:{user_id}')
\ No newline at end of file
+    return token_store.delete(user_id, db)
+
+@timed('redis.set_tokens')
+def set_tokens(tokens: dict, db: redis.Redis):
+    return token_store.set_many(tokens, db)
+
+@timed('redis.get_tokens')
+def get_tokens(user_ids, db: redis.Redis) -> dict:
+    return token_store.get_many(user_ids, db)
+
+@timed('redis.del_tokens')
+def del_tokens(user_ids, db: redis.Redis):
+    return token_store.delete_many(user_ids, db)
+
+@timed('redis.revoke_tokens')
+def revoke_tokens(user_ids, db: redis.Redis):
+    """Revokes every token issued to `user_ids` so far, returns the number of stored tokens deleted"""
+    token_denylist.revoke(user_ids, db)
+    return token_store.delete_many(user_ids, db)
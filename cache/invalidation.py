@@ -0,0 +1,138 @@
+from cache.session import CACHE_URL, CACHE_SOCKET_CONNECT_TIMEOUT, CACHE_HEALTH_CHECK_INTERVAL
+from cache.local import LocalCache
+import redis.asyncio as aioredis
+import asyncio
+from log_utils.logger import get_logger
+import json
+import uuid
+import os
+
+
+CACHE_INVALIDATION_CHANNEL = os.getenv('CACHE_INVALIDATION_CHANNEL', 'cache:invalidate')
+
+logger = get_logger('cache_invalidation.log')
+
+
+class Invalidator:
+    """Broadcasts L1 invalidations over redis pub/sub and applies the ones
+    published by other workers.
+
+    Local caches are only trusted while the subscription is live, every
+    registered cache is cleared whenever it is (re)established or lost
+    because messages published in between are gone"""
+
+    def __init__(self, url, channel):
+        self.url = url
+        self.channel = channel
+        self.origin = uuid.uuid4().hex
+        self.connected = False
+        self.received = 0
+        self.reconnects = 0
+        self._backoff = 0.1
+        self._caches = {}
+        self._task = None
+
+    def register(self, namespace: str, local: LocalCache):
+        self._caches[namespace] = local
+
+    def message(self, namespace: str, ident) -> str:
+        return json.dumps({'origin': self.origin, 'ns': namespace, 'id': str(ident)})
+
+    def message_many(self, namespace: str, idents) -> str:
+        return json.dumps({'origin': self.origin, 'ns': namespace, 'ids': [str(ident) for ident in idents]})
+
+    def _clear_all(self):
+        for local in self._caches.values():
+            local.clear()
+
+    def _apply(self, data):
+
+        try:
+            message = json.loads(data)
+
+        except ValueError:
+            logger.error('[invalidation] Drop malformed message [data: %s]', data)
+            return
+
+        self.received += 1
+        if message.get('origin') == self.origin:
+            return
+
+        local = self._caches.get(message.get('ns'))
+        if local is None:
+            return
+
+        if 'ids' in message:
+            for ident in message['ids']:
+                local.delete(ident)
+
+        else:
+            local.delete(message.get('id'))
+
+    async def _listen(self):
+
+        client = aioredis.Redis.from_url(
+            self.url,
+            decode_responses=True,
+            socket_connect_timeout=CACHE_SOCKET_CONNECT_TIMEOUT,
+            health_check_interval=CACHE_HEALTH_CHECK_INTERVAL
+        )
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+
+        try:
+            await pubsub.subscribe(self.channel)
+            self._clear_all()
+            self.connected = True
+            self._backoff = 0.1
+
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message is not None:
+                    self._apply(message['data'])
+
+        finally:
+            self.connected = False
+            self._clear_all()
+            await pubsub.aclose()
+            await client.aclose()
+
+    async def _run(self):
+
+        while True:
+            try:
+                await self._listen()
+
+            except asyncio.CancelledError:
+                raise
+
+            except Exception as e:
+                logger.error('[invalidation] Subscription lost [channel: %s -error: %s]', self.channel, e)
+
+            self.reconnects += 1
+            await asyncio.sleep(self._backoff)
+            self._backoff = min(self._backoff * 2, 5)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {
+            'channel': self.channel,
+            'connected': self.connected,
+            'received': self.received,
+            'reconnects': self.reconnects,
+            'namespaces': list(self._caches)
+        }
+
+
+invalidator = Invalidator(CACHE_URL, CACHE_INVALIDATION_CHANNEL)
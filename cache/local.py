@@ -0,0 +1,115 @@
+from collections import OrderedDict
+from log_utils.metrics import CACHE_LOOKUPS
+import threading
+import time
+
+
+class LocalCache:
+    """Process-local LRU cache where every entry also carries its own expiry.
+    Lookups are exported as metrics only when a `name` is given.
+
+    Every delete bumps a counter of its key and every clear a counter of
+    the whole cache. A value read elsewhere is stored with `set_if` and the
+    `version` taken before that read, so an invalidation applied while the
+    read was in flight keeps the stale value out"""
+
+    def __init__(self, max_size: int, ttl: float, name: str = None):
+        self.max_size = max_size
+        self.name = name
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._deletes = {}
+        self._clears = 0
+
+    def get(self, key, default=None):
+
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self._miss()
+                return default
+
+            expire_at, value = item
+            if expire_at <= time.monotonic():
+                del self._data[key]
+                self._miss()
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            if self.name:
+                CACHE_LOOKUPS.labels(self.name, 'hit').inc()
+            return value
+
+    def _miss(self):
+        self.misses += 1
+        if self.name:
+            CACHE_LOOKUPS.labels(self.name, 'miss').inc()
+
+    def _set(self, key, value, ttl: float):
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def set(self, key, value, ttl: float = None):
+
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or self.max_size <= 0:
+            return
+
+        with self._lock:
+            self._set(key, value, ttl)
+
+    def version(self, key) -> tuple:
+        with self._lock:
+            return self._clears, self._deletes.get(key, 0)
+
+    def set_if(self, key, value, version: tuple, ttl: float = None) -> bool:
+        """`set` unless `key` was deleted or the cache cleared since `version`"""
+
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or self.max_size <= 0:
+            return False
+
+        with self._lock:
+            if (self._clears, self._deletes.get(key, 0)) != version:
+                return False
+
+            self._set(key, value, ttl)
+            return True
+
+    def delete(self, key):
+
+        with self._lock:
+            self._data.pop(key, None)
+            self._deletes[key] = self._deletes.get(key, 0) + 1
+            # forgetting the per key counters must still change every version
+            if len(self._deletes) > max(self.max_size, 1):
+                self._deletes.clear()
+                self._clears += 1
+
+    def clear(self):
+
+        with self._lock:
+            self._data.clear()
+            self._clears += 1
+
+    def stats(self):
+
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': round(self.hits / total, 4) if total else None
+        }
@@ -0,0 +1,21 @@
+from cache.tiered import TwoTierCache
+import json
+import os
+
+
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 60))
+USER_CACHE_LOCAL_SIZE = int(os.getenv('USER_CACHE_LOCAL_SIZE', 10000))
+USER_CACHE_LOCAL_TTL = float(os.getenv('USER_CACHE_LOCAL_TTL', 30))
+
+
+# read-through cache of the `resp_user` dicts built by database_service get_user,
+# without the password hash: the login and password routes read it from GetUser
+profile_cache = TwoTierCache(
+    'user:profile',
+    USER_CACHE_TTL,
+    USER_CACHE_LOCAL_SIZE,
+    USER_CACHE_LOCAL_TTL,
+    encode= json.dumps,
+    decode= json.loads,
+    fail_open= True
+)
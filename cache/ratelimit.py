@@ -0,0 +1,156 @@
+from log_utils.logger import get_logger
+from log_utils.metrics import LOGIN_THROTTLED
+import redis.asyncio as aioredis
+import redis
+import os
+
+
+LOGIN_USER_PER_MINUTE = float(os.getenv('LOGIN_USER_PER_MINUTE', 10))
+LOGIN_USER_BURST = int(os.getenv('LOGIN_USER_BURST', 5))
+LOGIN_IP_PER_MINUTE = float(os.getenv('LOGIN_IP_PER_MINUTE', 60))
+LOGIN_IP_BURST = int(os.getenv('LOGIN_IP_BURST', 20))
+LOGIN_LOCKOUT_THRESHOLD = int(os.getenv('LOGIN_LOCKOUT_THRESHOLD', 10))
+LOGIN_LOCKOUT_WINDOW = int(os.getenv('LOGIN_LOCKOUT_WINDOW', 15*60))
+LOGIN_LOCKOUT_SECONDS = int(os.getenv('LOGIN_LOCKOUT_SECONDS', 15*60))
+
+logger = get_logger('cache_ratelimit.log')
+
+
+# KEYS[1] lock key, KEYS[2..n] token buckets
+# ARGV capacity and refill rate (tokens per ms) of every bucket
+# a token is taken from every bucket or from none of them; buckets are
+# refilled by the redis clock, the workers' clocks may disagree
+ACQUIRE_SCRIPT = """
+local clock = redis.call('TIME')
+local now = clock[1] * 1000 + math.floor(clock[2] / 1000)
+local locked = redis.call('PTTL', KEYS[1])
+if locked > 0 then
+    return {0, locked, 1}
+end
+
+local tokens = {}
+local wait = 0
+for i = 2, #KEYS do
+    local capacity = tonumber(ARGV[i * 2 - 3])
+    local rate = tonumber(ARGV[i * 2 - 2])
+    local state = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local available = tonumber(state[1]) or capacity
+    local updated = tonumber(state[2]) or now
+    available = math.min(capacity, available + math.max(0, now - updated) * rate)
+    tokens[i] = available
+    if available < 1 then
+        wait = math.max(wait, math.ceil((1 - available) / rate))
+    end
+end
+
+if wait > 0 then
+    return {0, wait, 0}
+end
+
+for i = 2, #KEYS do
+    local capacity = tonumber(ARGV[i * 2 - 3])
+    local rate = tonumber(ARGV[i * 2 - 2])
+    redis.call('HSET', KEYS[i], 'tokens', tostring(tokens[i] - 1), 'ts', now)
+    redis.call('PEXPIRE', KEYS[i], math.ceil(capacity / rate))
+end
+
+return {1, 0, 0}
+"""
+
+# KEYS[1] failure counter, KEYS[2] lock key
+# ARGV[1] counting window in ms, ARGV[2] threshold, ARGV[3] lockout in ms
+FAILURE_SCRIPT = """
+local failures = redis.call('INCR', KEYS[1])
+if failures == 1 then
+    redis.call('PEXPIRE', KEYS[1], ARGV[1])
+end
+
+if failures >= tonumber(ARGV[2]) then
+    redis.call('SET', KEYS[2], 1, 'PX', ARGV[3])
+    redis.call('DEL', KEYS[1])
+    return 1
+end
+
+return 0
+"""
+
+
+class LoginLimiter:
+    """Token buckets per username and per client ip plus a lockout after
+    repeated wrong passwords, each check a single Lua round trip.
+
+    A limit of 0 disables the matching bucket or the lockout. Redis errors
+    let the login through, the limiter must not take logins down with it"""
+
+    def __init__(self):
+        self.buckets = [
+            ('user', LOGIN_USER_BURST, LOGIN_USER_PER_MINUTE / 60000),
+            ('ip', LOGIN_IP_BURST, LOGIN_IP_PER_MINUTE / 60000)
+        ]
+        self._db = None
+        self._acquire = None
+        self._failure = None
+
+    def _scripts(self, db: aioredis.Redis):
+        # Script objects keep the sha and fall back to EVAL once when redis lost it
+        if self._db is not db:
+            self._acquire = db.register_script(ACQUIRE_SCRIPT)
+            self._failure = db.register_script(FAILURE_SCRIPT)
+            self._db = db
+        return self._acquire, self._failure
+
+    async def acquire(self, username: str, ip: str, db: aioredis.Redis) -> (bool, float, bool):
+        """(allowed, retry after in seconds, locked)"""
+
+        keys, args = [f'login:lock:{username}'], []
+        for name, capacity, rate in self.buckets:
+            if capacity > 0 and rate > 0:
+                keys.append(f'login:bucket:{name}:{username if name == "user" else ip}')
+                args.extend([capacity, rate])
+
+        if len(keys) == 1 and LOGIN_LOCKOUT_THRESHOLD <= 0:
+            return True, 0, False
+
+        acquire, _ = self._scripts(db)
+        try:
+            allowed, wait, locked = await acquire(keys= keys, args= args)
+
+        except redis.RedisError as e:
+            logger.error('[login limiter] acquire failed [username: %s -ip: %s -error: %s]', username, ip, e)
+            return True, 0, False
+
+        if not allowed:
+            LOGIN_THROTTLED.labels('locked' if locked else 'rate_limited').inc()
+
+        return bool(allowed), wait / 1000, bool(locked)
+
+    async def failed(self, username: str, db: aioredis.Redis) -> bool:
+        """Counts a wrong password, true when it locked the username"""
+
+        if LOGIN_LOCKOUT_THRESHOLD <= 0:
+            return False
+
+        _, failure = self._scripts(db)
+        try:
+            return bool(await failure(
+                keys= [f'login:failures:{username}', f'login:lock:{username}'],
+                args= [LOGIN_LOCKOUT_WINDOW * 1000, LOGIN_LOCKOUT_THRESHOLD, LOGIN_LOCKOUT_SECONDS * 1000]
+            ))
+
+        except redis.RedisError as e:
+            logger.error('[login limiter] failure count failed [username: %s -error: %s]', username, e)
+            return False
+
+    async def succeeded(self, username: str, db: aioredis.Redis):
+
+        if LOGIN_LOCKOUT_THRESHOLD <= 0:
+            return
+
+        try:
+            await db.delete(f'login:failures:{username}')
+
+        except redis.RedisError as e:
+            logger.error('[login limiter] failure reset failed [username: %s -error: %s]', username, e)
+
+
+login_limiter = LoginLimiter()
@@ -1,8 +1,52 @@
 import os
+import time
+import asyncio
+from log_utils.logger import get_logger
 import redis
+import redis.asyncio as aioredis
+from starlette.concurrency import run_in_threadpool
 
 
 CACHE_URL = os.getenv('CACHE_URL')
+CACHE_MAX_CONNECTIONS = int(os.getenv('CACHE_MAX_CONNECTIONS', 50))
+CACHE_POOL_TIMEOUT = float(os.getenv('CACHE_POOL_TIMEOUT', 5))
+CACHE_SOCKET_TIMEOUT = float(os.getenv('CACHE_SOCKET_TIMEOUT', 5))
+CACHE_SOCKET_CONNECT_TIMEOUT = float(os.getenv('CACHE_SOCKET_CONNECT_TIMEOUT', 2))
+CACHE_HEALTH_CHECK_INTERVAL = int(os.getenv('CACHE_HEALTH_CHECK_INTERVAL', 30))
+
+logger = get_logger('cache_session.log')
+
+pool_options = {
+    'decode_responses': True,
+    'max_connections': CACHE_MAX_CONNECTIONS,
+    'timeout': CACHE_POOL_TIMEOUT,
+    'socket_timeout': CACHE_SOCKET_TIMEOUT,
+    'socket_connect_timeout': CACHE_SOCKET_CONNECT_TIMEOUT,
+    'health_check_interval': CACHE_HEALTH_CHECK_INTERVAL,
+}
+
+
+def _pool_stats(pool) -> dict:
+
+    if pool is None:
+        return {'open': False}
+
+    if isinstance(pool, redis.BlockingConnectionPool):
+        created = len(pool._connections)
+        idle = sum(1 for connection in list(pool.pool.queue) if connection is not None)
+
+    else:
+        idle = len(pool._available_connections)
+        created = idle + len(pool._in_use_connections)
+
+    return {
+        'open': True,
+        'max_connections': pool.max_connections,
+        'created_connections': created,
+        'idle_connections': idle,
+        'in_use_connections': created - idle
+    }
+
 
 class RedisSingleton:
     _instance = None
@@ -13,21 +57,157 @@ class RedisSingleton:
         return cls._instance
 
     def __init__(self, url):
-        if not hasattr(self, '_redis_db'):
-            self._redis_db = redis.Redis.from_url(url, decode_responses=True)
+        if not hasattr(self, '_url'):
+            self._url = url
+            self._pool = None
+            self._redis_db = None
+
+    def open(self):
+        if self._pool is None:
+            self._pool = redis.BlockingConnectionPool.from_url(self._url, **pool_options)
+            self._redis_db = redis.Redis(connection_pool=self._pool)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.disconnect()
+            self._pool = None
+            self._redis_db = None
 
     @property
     def redis_db(self):
+        # the pool is normally opened at app startup, this only covers scripts
+        # and tools that import the module without running the lifespan
+        if self._redis_db is None:
+            self.open()
         return self._redis_db
 
+    def stats(self):
+        return _pool_stats(self._pool)
+
+
+class AioRedisSingleton:
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self, url):
+        if not hasattr(self, '_url'):
+            self._url = url
+            self._pool = None
+            self._redis_db = None
+
+    def open(self):
+        if self._pool is None:
+            self._pool = aioredis.BlockingConnectionPool.from_url(self._url, **pool_options)
+            self._redis_db = aioredis.Redis(connection_pool=self._pool)
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.disconnect()
+            self._pool = None
+            self._redis_db = None
+
+    @property
+    def redis_db(self):
+        if self._redis_db is None:
+            self.open()
+        return self._redis_db
+
+    def stats(self):
+        return _pool_stats(self._pool)
+
+
+class HealthCheck:
+
+    def __init__(self, interval: int):
+        self.interval = interval
+        self._task = None
+        self.last_check_at = None
+        self.last_latency_ms = None
+        self.healthy = None
+        self.failures = 0
+
+    async def check(self):
+        start = time.perf_counter()
+        try:
+            await aio_session.redis_db.ping()
+            await run_in_threadpool(session.redis_db.ping)
+
+        except Exception as e:
+            self.healthy = False
+            self.failures += 1
+            logger.error('[health check] Redis ping failed [error: %s]', e)
+
+        else:
+            self.healthy = True
+            self.last_latency_ms = round((time.perf_counter() - start) * 1000, 3)
+
+        self.last_check_at = time.time()
+
+    async def _run(self):
+        while True:
+            await self.check()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {
+            'healthy': self.healthy,
+            'last_check_at': self.last_check_at,
+            'last_latency_ms': self.last_latency_ms,
+            'failures': self.failures,
+            'interval': self.interval
+        }
+
 
 session = RedisSingleton(CACHE_URL)
+aio_session = AioRedisSingleton(CACHE_URL)
+health_check = HealthCheck(CACHE_HEALTH_CHECK_INTERVAL)
+
+
+async def startup():
+
+    session.open()
+    aio_session.open()
+    health_check.start()
+
+
+async def shutdown():
+
+    await health_check.stop()
+    await aio_session.close()
+    await run_in_threadpool(session.close)
+
+
+def pool_stats() -> dict:
+
+    return {
+        'sync_pool': session.stats(),
+        'async_pool': aio_session.stats(),
+        'health_check': health_check.stats()
+    }
 
 
 def get_redis_cache():
-    try:
-        yield session.redis_db
 
-    finally:
-        session.redis_db.close()
+    yield session.redis_db
+
+
+async def get_aio_redis_cache():
 
+    yield aio_session.redis_db
@@ -0,0 +1,461 @@
+from cache.invalidation import invalidator, CACHE_INVALIDATION_CHANNEL
+from cache.local import LocalCache
+import redis.asyncio as aioredis
+from log_utils.logger import get_logger
+from log_utils.metrics import REDIS_LATENCY, CACHE_LOOKUPS
+import redis
+import os
+
+
+CACHE_BATCH_CHUNK_SIZE = int(os.getenv('CACHE_BATCH_CHUNK_SIZE', 500))
+# must outlive any read-through lookup, an expired generation reads as never bumped
+CACHE_GENERATION_TTL = 600
+
+logger = get_logger('cache_tiered.log')
+
+
+# KEYS[1] generation keys of the chunk, ARGV[1] their ttl
+BUMP_SCRIPT = """
+for i = 1, #KEYS do
+    redis.call('INCR', KEYS[i])
+    redis.call('EXPIRE', KEYS[i], ARGV[1])
+end
+return #KEYS
+"""
+
+# KEYS[1] value key, KEYS[2] generation key
+# ARGV[1] value, ARGV[2] ttl, ARGV[3] generation seen before the lookup,
+# ARGV[4] invalidation channel, ARGV[5] invalidation message
+FILL_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '') ~= ARGV[3] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+redis.call('PUBLISH', ARGV[4], ARGV[5])
+return 1
+"""
+
+
+def _identity(value):
+    return value
+
+
+class TwoTierCache:
+    """In-process L1 in front of redis (L2).
+
+    Every write or delete on L2 is followed, in the same round trip, by a
+    pub/sub message so the other workers drop their L1 copy. L1 is only
+    used while this worker's invalidation subscription is live.
+
+    The *_many variants send every chunk of at most CACHE_BATCH_CHUNK_SIZE
+    keys in a single pipeline, so they cost one round trip per call.
+
+    Every delete also bumps a per key generation. A read-through lookup
+    reads the generation (`generations`) before asking the backend and
+    stores the answer with `fill`, which only writes while the generation
+    is unchanged; an answer read before a concurrent write and its delete
+    is then never cached. L1 does the same with the version of the key
+    taken before the round trip, so a value read from L2 is not kept in L1
+    when an invalidation lands while the read is in flight.
+
+    With `fail_open` redis errors are counted and treated as a miss, which
+    suits pure caches; without it they propagate to the caller"""
+
+    def __init__(self, namespace: str, ttl: int, local_size: int, local_ttl: float, encode=_identity, decode=_identity, fail_open: bool = False):
+        self.namespace = namespace
+        self.chunk_size = CACHE_BATCH_CHUNK_SIZE
+        self.ttl = ttl
+        self.local = LocalCache(local_size, local_ttl)
+        self.encode = encode
+        self.decode = decode
+        self.fail_open = fail_open
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        invalidator.register(namespace, self.local)
+
+    def key(self, ident) -> str:
+        return f'{self.namespace}:{ident}'
+
+    def generation_key(self, ident) -> str:
+        return f'gen:{self.namespace}:{ident}'
+
+    def _pipe_bump(self, pipe, idents):
+        pipe.eval(BUMP_SCRIPT, len(idents), *[self.generation_key(ident) for ident in idents], CACHE_GENERATION_TTL)
+
+    def _fill_args(self, ident, value, seen: str) -> list:
+        return [
+            FILL_SCRIPT, 2, self.key(ident), self.generation_key(ident),
+            self.encode(value), self.ttl, seen,
+            CACHE_INVALIDATION_CHANNEL, invalidator.message(self.namespace, ident)
+        ]
+
+    def _hit(self, count: int = 1):
+        self.hits += count
+        CACHE_LOOKUPS.labels(self.namespace, 'hit').inc(count)
+
+    def _miss(self, count: int = 1):
+        self.misses += count
+        CACHE_LOOKUPS.labels(self.namespace, 'miss').inc(count)
+
+    def _timer(self, command: str):
+        return REDIS_LATENCY.labels(self.namespace, command).time()
+
+    def _lookup_local(self, ident):
+        if not invalidator.connected:
+            return None
+
+        value = self.local.get(str(ident))
+        if value is not None:
+            self._hit()
+        return value
+
+    def _version(self, ident) -> tuple:
+        return self.local.version(str(ident))
+
+    def _store_local(self, ident, value, version: tuple):
+        if invalidator.connected:
+            self.local.set_if(str(ident), value, version)
+
+    def _loaded(self, ident, raw, version: tuple):
+        if raw is None:
+            self._miss()
+            return None
+
+        self._hit()
+        value = self.decode(raw)
+        self._store_local(ident, value, version)
+        return value
+
+    def _failed(self, action, ident, error):
+        self.errors += 1
+        logger.error('[%s] %s failed [id: %s -error: %s]', self.namespace, action, ident, error)
+        if not self.fail_open:
+            raise error
+
+    def get(self, ident, db: redis.Redis):
+
+        value = self._lookup_local(ident)
+        if value is not None:
+            return value
+
+        version = self._version(ident)
+        try:
+            with self._timer('get'):
+                raw = db.get(self.key(ident))
+
+        except redis.RedisError as e:
+            self._failed('get', ident, e)
+            self._miss()
+            return None
+
+        return self._loaded(ident, raw, version)
+
+    def set(self, ident, value, db: redis.Redis):
+
+        self.local.delete(str(ident))
+        version = self._version(ident)
+        try:
+            pipe = db.pipeline(transaction=False)
+            pipe.set(self.key(ident), self.encode(value), ex=self.ttl)
+            pipe.publish(CACHE_INVALIDATION_CHANNEL, invalidator.message(self.namespace, ident))
+            with self._timer('set'):
+                result = pipe.execute()[0]
+
+        except redis.RedisError as e:
+            self._failed('set', ident, e)
+            return None
+
+        self._store_local(ident, value, version)
+        return result
+
+    def fill(self, ident, value, seen: str, db: redis.Redis) -> bool:
+        """Stores a value read from the backend unless `ident` was deleted
+        since `seen` was read, true when it was stored"""
+
+        if seen is None:
+            return False
+
+        self.local.delete(str(ident))
+        version = self._version(ident)
+        try:
+            with self._timer('fill'):
+                stored = db.eval(*self._fill_args(ident, value, seen))
+
+        except redis.RedisError as e:
+            self._failed('fill', ident, e)
+            return False
+
+        if stored:
+            self._store_local(ident, value, version)
+        return bool(stored)
+
+    def delete(self, ident, db: redis.Redis):
+
+        self.local.delete(str(ident))
+        try:
+            pipe = db.pipeline(transaction=False)
+            pipe.delete(self.key(ident))
+            pipe.publish(CACHE_INVALIDATION_CHANNEL, invalidator.message(self.namespace, ident))
+            self._pipe_bump(pipe, [ident])
+            with self._timer('delete'):
+                return pipe.execute()[0]
+
+        except redis.RedisError as e:
+            self._failed('delete', ident, e)
+            return None
+
+    def _chunks(self, items):
+        items = list(items)
+        for start in range(0, len(items), self.chunk_size):
+            yield items[start:start + self.chunk_size]
+
+    def _pipe_get_many(self, pipe, idents):
+        for chunk in self._chunks(idents):
+            pipe.mget([self.key(ident) for ident in chunk])
+
+    def _got_many(self, found: dict, idents, versions: list, replies) -> dict:
+        raws = [raw for reply in replies for raw in reply]
+        for ident, version, raw in zip(idents, versions, raws):
+            found[ident] = self._loaded(ident, raw, version)
+        return found
+
+    def _pipe_set_many(self, pipe, values: dict):
+        for chunk in self._chunks(values):
+            for ident in chunk:
+                self.local.delete(str(ident))
+                pipe.set(self.key(ident), self.encode(values[ident]), ex=self.ttl)
+            pipe.publish(CACHE_INVALIDATION_CHANNEL, invalidator.message_many(self.namespace, chunk))
+
+    def _pipe_delete_many(self, pipe, idents):
+        for chunk in self._chunks(idents):
+            for ident in chunk:
+                self.local.delete(str(ident))
+            pipe.unlink(*[self.key(ident) for ident in chunk])
+            pipe.publish(CACHE_INVALIDATION_CHANNEL, invalidator.message_many(self.namespace, chunk))
+            self._pipe_bump(pipe, chunk)
+
+    def _split_local(self, idents):
+        found, missing = {}, []
+        for ident in idents:
+            value = self._lookup_local(ident)
+            if value is None:
+                missing.append(ident)
+            else:
+                found[ident] = value
+        return found, missing
+
+    def get_many(self, idents, db: redis.Redis) -> dict:
+
+        found, missing = self._split_local(idents)
+        if not missing:
+            return found
+
+        versions = [self._version(ident) for ident in missing]
+        try:
+            pipe = db.pipeline(transaction=False)
+            self._pipe_get_many(pipe, missing)
+            with self._timer('get_many'):
+                replies = pipe.execute()
+
+        except redis.RedisError as e:
+            self._failed('get many', missing, e)
+            self._miss(len(missing))
+            return {**found, **{ident: None for ident in missing}}
+
+        return self._got_many(found, missing, versions, replies)
+
+    def set_many(self, values: dict, db: redis.Redis):
+
+        if not values:
+            return 0
+
+        try:
+            pipe = db.pipeline(transaction=False)
+            self._pipe_set_many(pipe, values)
+            versions = [self._version(ident) for ident in values]
+            with self._timer('set_many'):
+                pipe.execute()
+
+        except redis.RedisError as e:
+            self._failed('set many', list(values), e)
+            return None
+
+        for version, (ident, value) in zip(versions, values.items()):
+            self._store_local(ident, value, version)
+        return len(values)
+
+    def delete_many(self, idents, db: redis.Redis):
+
+        if not idents:
+            return 0
+
+        try:
+            pipe = db.pipeline(transaction=False)
+            self._pipe_delete_many(pipe, idents)
+            with self._timer('delete_many'):
+                return sum(pipe.execute()[::3])
+
+        except redis.RedisError as e:
+            self._failed('delete many', idents, e)
+            return None
+
+    async def aget(self, ident, db: aioredis.Redis):
+
+        value = self._lookup_local(ident)
+        if value is not None:
+            return value
+
+        version = self._version(ident)
+        try:
+            with self._timer('get'):
+                raw = await db.get(self.key(ident))
+
+        except redis.RedisError as e:
+            self._failed('get', ident, e)
+            self._miss()
+            return None
+
+        return self._loaded(ident, raw, version)
+
+    async def aset(self, ident, value, db: aioredis.Redis):
+
+        self.local.delete(str(ident))
+        version = self._version(ident)
+        try:
+            pipe = db.pipeline(transaction=False)
+            pipe.set(self.key(ident), self.encode(value), ex=self.ttl)
+            pipe.publish(CACHE_INVALIDATION_CHANNEL, invalidator.message(self.namespace, ident))
+            with self._timer('set'):
+                result = (await pipe.execute())[0]
+
+        except redis.RedisError as e:
+            self._failed('set', ident, e)
+            return None
+
+        self._store_local(ident, value, version)
+        return result
+
+    async def afill(self, ident, value, seen: str, db: aioredis.Redis) -> bool:
+
+        if seen is None:
+            return False
+
+        self.local.delete(str(ident))
+        version = self._version(ident)
+        try:
+            with self._timer('fill'):
+                stored = await db.eval(*self._fill_args(ident, value, seen))
+
+        except redis.RedisError as e:
+            self._failed('fill', ident, e)
+            return False
+
+        if stored:
+            self._store_local(ident, value, version)
+        return bool(stored)
+
+    async def adelete(self, ident, db: aioredis.Redis):
+
+        self.local.delete(str(ident))
+        try:
+            pipe = db.pipeline(transaction=False)
+            pipe.delete(self.key(ident))
+            pipe.publish(CACHE_INVALIDATION_CHANNEL, invalidator.message(self.namespace, ident))
+            self._pipe_bump(pipe, [ident])
+            with self._timer('delete'):
+                return (await pipe.execute())[0]
+
+        except redis.RedisError as e:
+            self._failed('delete', ident, e)
+            return None
+
+    async def aget_many(self, idents, db: aioredis.Redis) -> dict:
+
+        found, missing = self._split_local(idents)
+        if not missing:
+            return found
+
+        versions = [self._version(ident) for ident in missing]
+        try:
+            pipe = db.pipeline(transaction=False)
+            self._pipe_get_many(pipe, missing)
+            with self._timer('get_many'):
+                replies = await pipe.execute()
+
+        except redis.RedisError as e:
+            self._failed('get many', missing, e)
+            self._miss(len(missing))
+            return {**found, **{ident: None for ident in missing}}
+
+        return self._got_many(found, missing, versions, replies)
+
+    async def aset_many(self, values: dict, db: aioredis.Redis):
+
+        if not values:
+            return 0
+
+        try:
+            pipe = db.pipeline(transaction=False)
+            self._pipe_set_many(pipe, values)
+            versions = [self._version(ident) for ident in values]
+            with self._timer('set_many'):
+                await pipe.execute()
+
+        except redis.RedisError as e:
+            self._failed('set many', list(values), e)
+            return None
+
+        for version, (ident, value) in zip(versions, values.items()):
+            self._store_local(ident, value, version)
+        return len(values)
+
+    async def adelete_many(self, idents, db: aioredis.Redis):
+
+        if not idents:
+            return 0
+
+        try:
+            pipe = db.pipeline(transaction=False)
+            self._pipe_delete_many(pipe, idents)
+            with self._timer('delete_many'):
+                return sum((await pipe.execute())[::3])
+
+        except redis.RedisError as e:
+            self._failed('delete many', idents, e)
+            return None
+
+    def stats(self):
+
+        total = self.hits + self.misses
+        return {
+            'namespace': self.namespace,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors,
+            'hit_ratio': round(self.hits / total, 4) if total else None,
+            'local': self.local.stats()
+        }
+
+
+def generations(entries, db: redis.Redis) -> list:
+    """Current generation of every (cache, ident) of `entries` in one round
+    trip, for a later `fill`; None when redis can't tell"""
+
+    try:
+        return [seen or '' for seen in db.mget([cache.generation_key(ident) for cache, ident in entries])]
+
+    except redis.RedisError as e:
+        logger.error('[generations] read failed [keys: %s -error: %s]', len(entries), e)
+        return [None] * len(entries)
+
+
+async def agenerations(entries, db: aioredis.Redis) -> list:
+
+    try:
+        return [seen or '' for seen in await db.mget([cache.generation_key(ident) for cache, ident in entries])]
+
+    except redis.RedisError as e:
+        logger.error('[generations] read failed [keys: %s -error: %s]', len(entries), e)
+        return [None] * len(entries)
@@ -0,0 +1,349 @@
+from cache.tiered import TwoTierCache
+from log_utils.logger import get_logger
+from log_utils.metrics import CACHE_LOOKUPS
+from typing import AsyncIterator, Callable
+import redis.asyncio as aioredis
+import hashlib
+import asyncio
+import redis
+import time
+import os
+
+
+USER_MISSING_TTL = int(os.getenv('USER_MISSING_TTL', 30))
+USER_MISSING_LOCAL_SIZE = int(os.getenv('USER_MISSING_LOCAL_SIZE', 10000))
+USER_MISSING_LOCAL_TTL = float(os.getenv('USER_MISSING_LOCAL_TTL', 10))
+USERNAME_BLOOM_BITS = int(os.getenv('USERNAME_BLOOM_BITS', 0))
+USERNAME_BLOOM_HASHES = int(os.getenv('USERNAME_BLOOM_HASHES', 7))
+USERNAME_BLOOM_REBUILD_INTERVAL = int(os.getenv('USERNAME_BLOOM_REBUILD_INTERVAL', 6*60*60))
+USERNAME_BLOOM_CHUNK_SIZE = 1000
+
+logger = get_logger('cache_usernames.log')
+
+
+# usernames the database service answered 1401 for
+missing_cache = TwoTierCache(
+    'user:missing',
+    USER_MISSING_TTL,
+    USER_MISSING_LOCAL_SIZE,
+    USER_MISSING_LOCAL_TTL,
+    fail_open= True
+)
+
+
+# KEYS[1] in-progress bitmap, KEYS[2] live bitmap, ARGV[1] sentinel bit
+# swaps only a bitmap whose rebuild began after the last failed add, a bitmap
+# dropped by `_invalidate` and recreated by later SETBITs lacks the start bit
+SWAP_SCRIPT = """
+if redis.call('GETBIT', KEYS[1], ARGV[1] + 1) == 0 then
+    return 0
+end
+redis.call('SETBIT', KEYS[1], ARGV[1], 1)
+redis.call('RENAME', KEYS[1], KEYS[2])
+redis.call('PERSIST', KEYS[2])
+return 1
+"""
+
+
+class UsernameBloom:
+    """Bloom filter of every existing username, kept as a redis bitmap.
+
+    A lookup that finds one of the username's bits unset proves the user does
+    not exist. The filter is filled from ListUsers by one worker at a time
+    and swapped in with RENAME; new users are added to both the live and the
+    in-progress bitmap so a rebuild can't lose them. Deleted users stay in it
+    until the next rebuild, which only costs a false positive.
+
+    Bit `bits` (one past the hashed range) is only set by a finished
+    rebuild, a bitmap recreated by SETBIT after an eviction is never trusted.
+    A failed add would leave a false negative, so it drops the filter (and a
+    running rebuild) until the next rebuild instead. Only enable it when
+    every user is created through this api, a user created elsewhere can't
+    log in before the next rebuild"""
+
+    def __init__(self, bits: int, hashes: int, rebuild_interval: int):
+        self.bits = bits
+        self.hashes = hashes
+        self.rebuild_interval = rebuild_interval
+        # the size is part of the key so a resized filter is built from scratch
+        self.key = f'user:bloom:{bits}:{hashes}'
+        self.next_key = f'{self.key}:next'
+        self.rebuild_key = f'{self.key}:rebuild'
+        self.absent = 0
+        self.maybe = 0
+        self.errors = 0
+        self.rebuilds = 0
+        self.last_rebuild_at = None
+        self.last_rebuild_size = None
+        self._distrusted_until = 0
+        self._task = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.bits > 0 and self.hashes > 0
+
+    def positions(self, username: str) -> list:
+        # double hashing, k positions out of one 128 bit digest
+        digest = hashlib.blake2b(username.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        step = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * step) % self.bits for i in range(self.hashes)]
+
+    def _pipe_lookup(self, pipe, username: str):
+        pipe.getbit(self.key, self.bits)
+        for position in self.positions(username):
+            pipe.getbit(self.key, position)
+
+    def _looked_up(self, replies) -> bool:
+        if not replies[0] or all(replies[1:]):
+            self.maybe += 1
+            CACHE_LOOKUPS.labels('user:bloom', 'miss').inc()
+            return False
+
+        self.absent += 1
+        CACHE_LOOKUPS.labels('user:bloom', 'hit').inc()
+        return True
+
+    def _pipe_add(self, pipe, usernames):
+        for username in usernames:
+            for position in self.positions(username):
+                pipe.setbit(self.key, position, 1)
+                pipe.setbit(self.next_key, position, 1)
+        # only matters while a rebuild is running, otherwise the copy just expires
+        pipe.expire(self.next_key, self.rebuild_interval)
+
+    def _failed(self, action, error):
+        self.errors += 1
+        logger.error('[username bloom] %s failed [error: %s]', action, error)
+
+    @property
+    def trusted(self) -> bool:
+        return self.enabled and time.monotonic() >= self._distrusted_until
+
+    def _pipe_invalidate(self, pipe):
+        # no sentinel, no filter: lookups answer "maybe" until a rebuild, which
+        # dropping the rebuild marker lets the next worker tick start
+        pipe.delete(self.key, self.next_key, self.rebuild_key)
+
+    def _invalidate_failed(self, error):
+        # redis refused the DEL too, at least this worker stops trusting the filter
+        self._distrusted_until = time.monotonic() + self.rebuild_interval
+        self._failed('invalidate', error)
+
+    def _invalidate(self, db: redis.Redis):
+        try:
+            pipe = db.pipeline(transaction=False)
+            self._pipe_invalidate(pipe)
+            pipe.execute()
+
+        except redis.RedisError as e:
+            self._invalidate_failed(e)
+
+    async def _ainvalidate(self, db: aioredis.Redis):
+        try:
+            pipe = db.pipeline(transaction=False)
+            self._pipe_invalidate(pipe)
+            await pipe.execute()
+
+        except redis.RedisError as e:
+            self._invalidate_failed(e)
+
+    def absent_for_sure(self, username: str, db: redis.Redis) -> bool:
+
+        if not self.trusted:
+            return False
+
+        try:
+            pipe = db.pipeline(transaction=False)
+            self._pipe_lookup(pipe, username)
+            return self._looked_up(pipe.execute())
+
+        except redis.RedisError as e:
+            self._failed('lookup', e)
+            return False
+
+    async def aabsent_for_sure(self, username: str, db: aioredis.Redis) -> bool:
+
+        if not self.trusted:
+            return False
+
+        try:
+            pipe = db.pipeline(transaction=False)
+            self._pipe_lookup(pipe, username)
+            return self._looked_up(await pipe.execute())
+
+        except redis.RedisError as e:
+            self._failed('lookup', e)
+            return False
+
+    def add_many(self, usernames, db: redis.Redis):
+
+        if not self.enabled or not usernames:
+            return
+
+        try:
+            pipe = db.pipeline(transaction=False)
+            self._pipe_add(pipe, usernames)
+            pipe.execute()
+
+        except redis.RedisError as e:
+            self._failed('add', e)
+            self._invalidate(db)
+
+    async def aadd_many(self, usernames, db: aioredis.Redis):
+
+        if not self.enabled or not usernames:
+            return
+
+        try:
+            pipe = db.pipeline(transaction=False)
+            self._pipe_add(pipe, usernames)
+            await pipe.execute()
+
+        except redis.RedisError as e:
+            self._failed('add', e)
+            await self._ainvalidate(db)
+
+    async def rebuild(self, usernames: AsyncIterator[str], db: aioredis.Redis) -> int:
+        """Fills a fresh bitmap from `usernames` and swaps it in, returns the count"""
+
+        pipe = db.pipeline(transaction=True)
+        pipe.delete(self.next_key)
+        pipe.setbit(self.next_key, self.bits + 1, 1)
+        await pipe.execute()
+
+        count, chunk = 0, []
+        async for username in usernames:
+            chunk.append(username)
+            if len(chunk) >= USERNAME_BLOOM_CHUNK_SIZE:
+                count += await self._fill(chunk, db)
+                chunk = []
+        count += await self._fill(chunk, db)
+
+        if not await db.eval(SWAP_SCRIPT, 2, self.next_key, self.key, self.bits):
+            raise RuntimeError('an add failed during the rebuild')
+
+        self._distrusted_until = 0
+        return count
+
+    async def _fill(self, usernames: list, db: aioredis.Redis) -> int:
+        pipe = db.pipeline(transaction=False)
+        for username in usernames:
+            for position in self.positions(username):
+                pipe.setbit(self.next_key, position, 1)
+        await pipe.execute()
+        return len(usernames)
+
+    async def _run(self, load: Callable[[], AsyncIterator[str]], db: aioredis.Redis):
+
+        while True:
+            try:
+                # the marker lives for one interval, so only one worker rebuilds per interval
+                if await db.set(self.rebuild_key, os.getpid(), nx=True, ex=self.rebuild_interval):
+                    try:
+                        self.last_rebuild_size = await self.rebuild(load(), db)
+
+                    except BaseException:
+                        await db.delete(self.rebuild_key)
+                        raise
+
+                    self.rebuilds += 1
+                    self.last_rebuild_at = time.time()
+                    logger.info('[username bloom] Rebuilt [usernames: %s -key: %s]', self.last_rebuild_size, self.key)
+
+            except asyncio.CancelledError:
+                raise
+
+            except Exception as e:
+                self._failed('rebuild', e)
+
+            await asyncio.sleep(min(self.rebuild_interval, 60))
+
+    def start(self, load: Callable[[], AsyncIterator[str]], db: aioredis.Redis):
+        if self._task is None and self.enabled:
+            self._task = asyncio.create_task(self._run(load, db))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+
+        total = self.absent + self.maybe
+        return {
+            'enabled': self.enabled,
+            'key': self.key,
+            'bits': self.bits,
+            'hashes': self.hashes,
+            'absent': self.absent,
+            'maybe': self.maybe,
+            'errors': self.errors,
+            'absent_ratio': round(self.absent / total, 4) if total else None,
+            'rebuilds': self.rebuilds,
+            'last_rebuild_at': self.last_rebuild_at,
+            'last_rebuild_size': self.last_rebuild_size
+        }
+
+
+username_bloom = UsernameBloom(USERNAME_BLOOM_BITS, USERNAME_BLOOM_HASHES, USERNAME_BLOOM_REBUILD_INTERVAL)
+
+
+def known_missing(username: str, db: redis.Redis) -> bool:
+
+    if USER_MISSING_TTL > 0 and missing_cache.get(username, db) is not None:
+        return True
+
+    return username_bloom.absent_for_sure(username, db)
+
+
+async def aknown_missing(username: str, db: aioredis.Redis) -> bool:
+
+    if USER_MISSING_TTL > 0 and await missing_cache.aget(username, db) is not None:
+        return True
+
+    return await username_bloom.aabsent_for_sure(username, db)
+
+
+def set_missing(usernames, db: redis.Redis):
+
+    if USER_MISSING_TTL > 0 and usernames:
+        missing_cache.set_many({username: '1' for username in usernames}, db)
+
+
+async def aset_missing(usernames, db: aioredis.Redis):
+
+    if USER_MISSING_TTL > 0 and usernames:
+        await missing_cache.aset_many({username: '1' for username in usernames}, db)
+
+
+def fill_missing(username: str, seen: str, db: redis.Redis):
+    """Caches a 1401 of GetUser unless the user was created since `seen`,
+    the generation of `missing_cache` read before the call"""
+
+    if USER_MISSING_TTL > 0:
+        missing_cache.fill(username, '1', seen, db)
+
+
+async def afill_missing(username: str, seen: str, db: aioredis.Redis):
+
+    if USER_MISSING_TTL > 0:
+        await missing_cache.afill(username, '1', seen, db)
+
+
+def set_created(usernames, db: redis.Redis):
+
+    if USER_MISSING_TTL > 0 and usernames:
+        missing_cache.delete_many(usernames, db)
+    username_bloom.add_many(usernames, db)
+
+
+async def aset_created(usernames, db: aioredis.Redis):
+
+    if USER_MISSING_TTL > 0 and usernames:
+        await missing_cache.adelete_many(usernames, db)
+    await username_bloom.aadd_many(usernames, db)
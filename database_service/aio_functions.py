@@ -0,0 +1,199 @@
+from grpc_utils.database_pb2_grpc import DataBaseStub
+from database_service.functions import user_to_dict, cached_profile, batch_results, rpc_request, call_error, resp_error
+from database_service.resilience import ahedged
+from database_service.singleflight import user_flight
+from grpc.aio import AioRpcError
+import grpc_utils.database_pb2 as pb2
+from database_service.session import deadline, aio_session
+from cache.profile import profile_cache
+from cache.tiered import agenerations
+from cache.usernames import missing_cache, aknown_missing, aset_missing, afill_missing, aset_created
+from redis.asyncio import Redis
+from typing import Union, List, AsyncIterator, Optional
+from fastapi import (
+    HTTPException,
+    status
+)
+import logging
+
+async def call(method: str, data: Union[dict, List[dict]], stub: DataBaseStub, logger: logging, func: str, caller: str, target, codes: tuple= ()) -> (Union[pb2.BaseResponse, pb2.ResponseBatch, None], Union[HTTPException, None]):
+
+    try:
+
+        resp = await getattr(stub, method)(rpc_request(method, data), timeout= deadline(method))
+
+    except Exception as e:
+        return None, call_error(e, logger, func, caller, target)
+
+    err = resp_error(resp, logger, func, caller, target, codes)
+    return (None, err) if err else (resp, None)
+
+
+async def fetch_user(username: str, stub: DataBaseStub, cache_db: Redis= None) -> pb2.ResponseUserInfo:
+
+    seen, seen_missing = await agenerations([(profile_cache, username), (missing_cache, username)], cache_db) if cache_db is not None else (None, None)
+
+    request = pb2.RequestUserInfo(username= username)
+    resp = await ahedged('GetUser', lambda target: target.GetUser(request, timeout= deadline('GetUser')), stub, lambda: aio_session.stub)
+
+    if cache_db is not None:
+        if resp.code == 1200:
+            await profile_cache.afill(username, cached_profile(user_to_dict(resp.data)), seen, cache_db)
+
+        elif resp.code == 1401:
+            await afill_missing(username, seen_missing, cache_db)
+
+    return resp
+
+
+async def get_user(caller: str, username: str, stub: DataBaseStub, logger: logging, func: str, cache_db: Redis= None, with_password: bool= False) -> (Union[dict ,None], Union[HTTPException, None]):
+
+    if cache_db is not None:
+        resp_user = None if with_password else await profile_cache.aget(username, cache_db)
+        if resp_user is not None:
+            return resp_user, None
+
+        if await aknown_missing(username, cache_db):
+            logger.debug('[%s] Username is known to be missing [caller: %s -target_username: %s]', func, caller, username)
+            return None, HTTPException(status_code= status.HTTP_404_NOT_FOUND, detail={'message': 'Username is not found', 'code': 2401})
+
+    try:
+
+        resp = await user_flight.ado(username, lambda: fetch_user(username, stub, cache_db))
+
+    except Exception as e:
+        return None, call_error(e, logger, func, caller, username)
+
+    err = resp_error(resp, logger, func, caller, username, (1401,))
+    if err:
+        return None, err
+
+    return user_to_dict(resp.data), None
+
+
+async def create_user(caller: str, data_new_user: dict, stub: DataBaseStub, logger: logging, cache_db: Redis= None) -> (Union[dict ,None], Union[HTTPException, None]):
+
+    _, err = await call('NewUser', data_new_user, stub, logger, 'create user', caller, data_new_user['username'], (1403, 1406, 1407))
+    if err:
+        return None, err
+
+    if cache_db is not None:
+        await aset_created([data_new_user['username']], cache_db)
+
+    return {'message': 'user successfully created', 'code': 1200}, None
+
+
+async def edit_user_info(caller: str, new_user_data: dict, stub: DataBaseStub, logger: logging, cache_db: Redis= None) -> (Union[dict ,None], Union[HTTPException, None]):
+
+    _, err = await call('ModifyUserInfo', new_user_data, stub, logger, 'edit info', caller, new_user_data['username'], (1401, 1406, 1407))
+    if err:
+        return None, err
+
+    if cache_db is not None:
+        await profile_cache.adelete(new_user_data['username'], cache_db)
+
+    return {'message': 'user information updated successfully', 'code': 1200}, None
+
+
+async def edit_user_password(caller: str, new_password: dict, stub: DataBaseStub, logger: logging, cache_db: Redis= None) -> (Union[dict ,None], Union[HTTPException, None]):
+
+    _, err = await call('ModifyUserPassword', new_password, stub, logger, 'edit pass', caller, new_password['username'], (1401, 1412))
+    if err:
+        return None, err
+
+    if cache_db is not None:
+        await profile_cache.adelete(new_password['username'], cache_db)
+
+    return {'message': 'password changed successfully', 'code': 1200}, None
+
+
+async def edit_user_role(caller: str, new_role: dict, stub: DataBaseStub, logger: logging, cache_db: Redis= None) -> (Union[dict ,None], Union[HTTPException, None]):
+
+    _, err = await call('ModifyUserRole', new_role, stub, logger, 'edit role', caller, new_role['username'], (1401,))
+    if err:
+        return None, err
+
+    if cache_db is not None:
+        await profile_cache.adelete(new_role['username'], cache_db)
+
+    return {'message': 'role updated successfully', 'code': 1200}, None
+
+
+async def delete_user_target(caller: str, delete_username: dict, stub: DataBaseStub, logger: logging, cache_db: Redis= None) -> (Union[dict ,None], Union[HTTPException, None]):
+
+    _, err = await call('DeleteUser', delete_username, stub, logger, 'delete', caller, delete_username['username'], (1401,))
+    if err:
+        return None, err
+
+    if cache_db is not None:
+        await profile_cache.adelete(delete_username['username'], cache_db)
+        await aset_missing([delete_username['username']], cache_db)
+
+    return {'message': 'user deleted successfully', 'code': 1200}, None
+
+
+async def create_users(caller: str, users: List[dict], stub: DataBaseStub, logger: logging, cache_db: Redis= None) -> (Union[list ,None], Union[HTTPException, None]):
+
+    resp, err = await call('NewUsers', users, stub, logger, 'batch new', caller, '%d users' % len(users))
+    if err:
+        return None, err
+
+    results = batch_results(resp, 'user successfully created')
+
+    if cache_db is not None:
+        await aset_created([result['username'] for result in results if result['code'] == 1200], cache_db)
+
+    return results, None
+
+
+async def edit_users_role(caller: str, new_roles: List[dict], stub: DataBaseStub, logger: logging, cache_db: Redis= None) -> (Union[list ,None], Union[HTTPException, None]):
+
+    resp, err = await call('ModifyUsersRole', new_roles, stub, logger, 'batch role', caller, '%d users' % len(new_roles))
+    if err:
+        return None, err
+
+    results = batch_results(resp, 'role updated successfully')
+
+    if cache_db is not None:
+        await profile_cache.adelete_many([result['username'] for result in results if result['code'] == 1200], cache_db)
+
+    return results, None
+
+
+async def delete_users_target(caller: str, delete_usernames: List[dict], stub: DataBaseStub, logger: logging, cache_db: Redis= None) -> (Union[list ,None], Union[HTTPException, None]):
+
+    resp, err = await call('DeleteUsers', delete_usernames, stub, logger, 'batch delete', caller, '%d users' % len(delete_usernames))
+    if err:
+        return None, err
+
+    results = batch_results(resp, 'user deleted successfully')
+
+    if cache_db is not None:
+        deleted = [result['username'] for result in results if result['code'] == 1200]
+        await profile_cache.adelete_many(deleted, cache_db)
+        await aset_missing(deleted, cache_db)
+
+    return results, None
+
+
+async def list_users(caller: str, list_filter: dict, stub: DataBaseStub, logger: logging, timeout: Optional[float]= deadline('ListUsers')) -> AsyncIterator[dict]:
+    """`timeout` None lets a full listing run as long as it takes"""
+
+    call = stub.ListUsers(pb2.RequestListUsers(**list_filter), timeout= timeout)
+
+    try:
+        async for data in call:
+            yield user_to_dict(data)
+
+    except AioRpcError as rpc_error:
+        logger.error("[list] API-service can't connect to grpc host [caller: %s -filter: %s -error: %s]", caller, list_filter, rpc_error)
+        raise HTTPException(status_code= status.HTTP_500_INTERNAL_SERVER_ERROR, detail={'code': 2002, 'message': "API-service can't connect to grpc host"})
+
+    finally:
+        call.cancel()
+
+
+async def list_usernames(caller: str, stub: DataBaseStub, logger: logging) -> AsyncIterator[str]:
+
+    async for user in list_users(caller, {'after_user_id': 0, 'limit': 0}, stub, logger, timeout= None):
+        yield user['username']
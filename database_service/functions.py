@@ -1,7 +1,12 @@
 from grpc_utils.database_pb2_grpc import DataBaseStub
 from grpc._channel import _InactiveRpcError
+from grpc.aio import AioRpcError
+from grpc import RpcError
 import grpc_utils.database_pb2 as pb2
-from typing import Union
+from database_service.session import deadline, session
+from database_service.resilience import CircuitOpenError, hedged
+from database_service.singleflight import user_flight
+from typing import Union, List, Iterator, Optional
 from fastapi import (
     HTTPException,
     status
@@ -10,191 +15,306 @@ from schemas import (
     UserInfoResponse,
     BaseResponse
 )
+from cache.profile import profile_cache
+from cache.tiered import generations
+from cache.usernames import missing_cache, known_missing, set_missing, fill_missing, set_created
+from redis import Redis
 import logging
+import math
 
 map_enums = {
     0 : 'ADMIN',
     1 : 'USER'
 }
 
-def get_user(caller: str, username: str, stub: DataBaseStub, logger: logging, func: str) -> (Union[dict ,None], Union[HTTPException, None]):
+# request message of every database method the helpers below call
+map_requests = {
+    'NewUser': pb2.RequestNewUser,
+    'NewUsers': pb2.RequestNewUser,
+    'ModifyUserInfo': pb2.RequestModifyUserInfo,
+    'ModifyUserPassword': pb2.RequestModifyUserPassword,
+    'ModifyUserRole': pb2.RequestModifyUserRole,
+    'ModifyUsersRole': pb2.RequestModifyUserRole,
+    'DeleteUser': pb2.RequestDeleteUser,
+    'DeleteUsers': pb2.RequestDeleteUser
+}
+
+map_errors = {
+    1401: (status.HTTP_404_NOT_FOUND, 2401, 'Username is not found'),
+    1403: (status.HTTP_409_CONFLICT, 2403, 'Username already exists'),
+    1406: (status.HTTP_409_CONFLICT, 2406, 'Email already exists'),
+    1407: (status.HTTP_409_CONFLICT, 2407, 'PhoneNumber already exists'),
+    1412: (status.HTTP_409_CONFLICT, 2421, 'The password was changed meanwhile')
+}
+
+map_batch_errors = {
+    1401: (2401, 'Username is not found'),
+    1403: (2403, 'Username already exists'),
+    1406: (2406, 'Email already exists'),
+    1407: (2407, 'PhoneNumber already exists')
+}
 
-    data = {
-        'username': username
+def user_to_dict(data: pb2.UserInfo) -> dict:
+
+    user = {
+        'user_id': data.user_id,
+        'username': data.username,
+        'password': data.password,
+        'name': data.name,
+        'phone_number': data.phone_number, 
+        'role': map_enums[data.role]
     }
 
-    try:
+    if data.email:
+        user.update({'email': data.email})
 
-        resp = stub.GetUser(pb2.RequestUserInfo(**data))
+    return user
 
-    except _InactiveRpcError as InactiveRpcError:
-        logger.error(f"[{func}] API-service can't connect to grpc host [caller: {caller} -target_username: {username} -error: {InactiveRpcError}]")
-        return None, HTTPException(status_code= status.HTTP_500_INTERNAL_SERVER_ERROR, detail={'code': 2002, 'message': "API-service can't connect to grpc host"})
+def cached_profile(user: dict) -> dict:
+    """`user` as stored in the profile cache, password hashes stay out of redis"""
 
-    except Exception as e:
-        logger.error(f'[{func}] Error in grpc connection [caller: {caller} -target_username: {username} -error: {e}]')
-        return None, HTTPException(status_code= status.HTTP_500_INTERNAL_SERVER_ERROR, detail={'code': 2003, 'message': "Error in grpc connection"})
-
-    if resp.code == 1401:
-        logger.debug(f'[{func}] Username is not found [caller: {caller} -target_username: {username}]')
-        return None, HTTPException(status_code= status.HTTP_404_NOT_FOUND, detail={'message': 'Username is not found', 'code': 2401})
-
-    elif resp.code != 1200:
-        logger.debug(f'[{func}] error in database service [caller: {caller} -target_username: {username} -err_msg: {resp.message} -err_code: {resp.code}]')
-        return None, HTTPException(status_code= status.HTTP_500_INTERNAL_SERVER_ERROR, detail={'message': 'Contact to support!', 'code': resp.code})
-
-    resp_user = {
-        'user_id': resp.data.user_id,
-        'username': resp.data.username,
-        'password': resp.data.password,
-        'name': resp.data.name,
-        'phone_number': resp.data.phone_number, 
-        'role': map_enums[resp.data.role]
-    }
+    return {field: value for field, value in user.items() if field != 'password'}
 
-    if resp.data.email:
-        resp_user.update({'email': resp.data.email})
+def batch_results(resp, success_message: str) -> list:
 
-    return resp_user, None
+    results = []
+    for item in resp.results:
 
+        if item.code == 1200:
+            result = {'username': item.username, 'code': 1200, 'message': success_message}
+            if item.HasField('user_id'):
+                result['user_id'] = item.user_id
 
-def create_user(caller: str, data_new_user: dict, stub: DataBaseStub, logger: logging) -> (Union[dict ,None], Union[HTTPException, None]):
-    
-    try:
+        elif item.code in map_batch_errors:
+            code, message = map_batch_errors[item.code]
+            result = {'username': item.username, 'code': code, 'message': message}
 
-        resp = stub.NewUser(pb2.RequestNewUser(**data_new_user)) 
+        else:
+            result = {'username': item.username, 'code': item.code, 'message': 'Contact to support!'}
 
-    except _InactiveRpcError as InactiveRpcError:
-        logger.error(f"[create user] API-service can't connect to grpc host [caller: {caller} -target_username: {data_new_user['username']} -error: {InactiveRpcError}]")
-        return None, HTTPException(status_code= status.HTTP_500_INTERNAL_SERVER_ERROR, detail={'code': 2002, 'message': "API-service can't connect to grpc host"})
+        results.append(result)
 
-    except Exception as e :
-        logger.error(f'[create user] Error in grpc connection [caller: {caller} -target_username: {data_new_user["username"]} -error: {e}]')
-        return None, HTTPException(status_code= status.HTTP_500_INTERNAL_SERVER_ERROR, detail={'code': 2003, 'message': "Error in grpc connection"})
+    return results
 
-    if resp.code == 1403:
-        logger.debug(f'[create user] Username already exists [caller: {caller} -target_username: {data_new_user["username"]}]')
-        return None, HTTPException(status_code= status.HTTP_409_CONFLICT, detail={'message': 'Username already exists', 'code': 2403})
-    
-    if resp.code == 1406:
-        logger.debug(f'[create user] Email already exists [caller: {caller} -target_username: {data_new_user["username"]} -email: {data_new_user["email"]}]')
-        return None, HTTPException(status_code= status.HTTP_409_CONFLICT, detail={'message': 'Email already exists', 'code': 2406})
-    
-    if resp.code == 1407:
-        logger.debug(f'[create user] PhoneNumber already exists [caller: {caller} -target_username: {data_new_user["username"]} -phone_number: {data_new_user["phone_number"]}]')
-        return None, HTTPException(status_code= status.HTTP_409_CONFLICT, detail={'message': 'PhoneNumber already exists', 'code': 2407})
+def unavailable(error: CircuitOpenError) -> HTTPException:
 
-    if resp.code != 1200:
-        logger.debug(f'[create user] error in database service [caller: {caller} -target_username: {data_new_user["username"]} -err_msg: {resp.message} -err_code: {resp.code}]')
-        return None, HTTPException(status_code= status.HTTP_500_INTERNAL_SERVER_ERROR, detail={'message': 'Contact to support!', 'code': resp.code})
+    return HTTPException(
+        status_code= status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail= {'code': 2005, 'message': 'Database service is unavailable, try again later'},
+        headers= {'Retry-After': str(max(1, math.ceil(error.retry_after)))}
+    )
 
-    return {'message': 'user successfully created', 'code': 1200}, None
+def rpc_request(method: str, data: Union[dict, List[dict]]):
+    """The request message of `method`, a generator of them for a list of `data`"""
 
+    request_type = map_requests[method]
+    if isinstance(data, list):
+        return (request_type(**item) for item in data)
 
-def edit_user_info(caller: str, new_user_data: dict, stub: DataBaseStub, logger: logging) -> (Union[dict ,None], Union[HTTPException, None]):
+    return request_type(**data)
 
-    try:
+def call_error(error: Exception, logger: logging, func: str, caller: str, target) -> HTTPException:
 
-        resp = stub.ModifyUserInfo(pb2.RequestModifyUserInfo(**new_user_data))
+    if isinstance(error, CircuitOpenError):
+        logger.warning('[%s] Circuit breaker is open, failing fast [caller: %s -target: %s -method: %s]', func, caller, target, error.method)
+        return unavailable(error)
 
-    except _InactiveRpcError as InactiveRpcError:
-        logger.error(f"[edit info] API-service can't connect to grpc host [caller: {caller} -error: {InactiveRpcError}]")
-        raise HTTPException(status_code= status.HTTP_500_INTERNAL_SERVER_ERROR, detail={'code': 2002, 'message': "API-service can't connect to grpc host"})
+    if isinstance(error, (_InactiveRpcError, AioRpcError)):
+        logger.error("[%s] API-service can't connect to grpc host [caller: %s -target: %s -error: %s]", func, caller, target, error)
+        return HTTPException(status_code= status.HTTP_500_INTERNAL_SERVER_ERROR, detail={'code': 2002, 'message': "API-service can't connect to grpc host"})
 
-    except Exception as e :
-        logger.error(f'[edit info] Error in grpc connection [caller: {caller} -error: {e}]')
-        raise HTTPException(status_code= status.HTTP_500_INTERNAL_SERVER_ERROR, detail={'code': 2003, 'message': "Error in grpc connection"})
-
-    if resp.code == 1401:
-        logger.debug(f'[edit info] Username is not found [caller: {caller}]')
-        raise HTTPException(status_code= status.HTTP_404_NOT_FOUND, detail={'message': 'Username is not found', 'code': 2401})
-    
-    if resp.code == 1406:
-        logger.debug(f'[create user] Email already exists [caller: {caller} -target_username: {new_user_data["username"]} -email: {new_user_data["email"]}]')
-        return None, HTTPException(status_code= status.HTTP_409_CONFLICT, detail={'message': 'Email already exists', 'code': 2406})
-    
-    if resp.code == 1407:
-        logger.debug(f'[create user] PhoneNumber already exists [caller: {caller} -target_username: {new_user_data["username"]} -phone_number: {new_user_data["phone_number"]}]')
-        return None, HTTPException(status_code= status.HTTP_409_CONFLICT, detail={'message': 'PhoneNumber already exists', 'code': 2407})
-
-    if resp.code != 1200:
-        logger.debug(f'[edit info] error in database service [caller: {caller} -err_msg: {resp.message} -err_code: {resp.code}]')
-        raise HTTPException(status_code= status.HTTP_500_INTERNAL_SERVER_ERROR, detail={'message': 'Contact to support!', 'code': resp.code})
+    logger.error('[%s] Error in grpc connection [caller: %s -target: %s -error: %s]', func, caller, target, error)
+    return HTTPException(status_code= status.HTTP_500_INTERNAL_SERVER_ERROR, detail={'code': 2003, 'message': "Error in grpc connection"})
 
-    return {'message': 'user information updated successfully', 'code': 1200}, None
+def resp_error(resp, logger: logging, func: str, caller: str, target, codes: tuple= ()) -> Union[HTTPException, None]:
+    """None for a 1200 response, otherwise the HTTPException of `resp.code`,
+    codes the call doesn't expect are passed through with a 500"""
+
+    if resp.code == 1200:
+        return None
 
+    if resp.code in codes:
+        status_code, code, message = map_errors[resp.code]
+        logger.debug('[%s] %s [caller: %s -target: %s]', func, message, caller, target)
+        return HTTPException(status_code= status_code, detail={'message': message, 'code': code})
 
-def edit_user_password(caller: str, new_password: dict, stub: DataBaseStub, logger: logging) -> (Union[dict ,None], Union[HTTPException, None]):
+    logger.debug('[%s] error in database service [caller: %s -target: %s -err_msg: %s -err_code: %s]', func, caller, target, resp.message, resp.code)
+    return HTTPException(status_code= status.HTTP_500_INTERNAL_SERVER_ERROR, detail={'message': 'Contact to support!', 'code': resp.code})
+
+def call(method: str, data: Union[dict, List[dict]], stub: DataBaseStub, logger: logging, func: str, caller: str, target, codes: tuple= ()) -> (Union[pb2.BaseResponse, pb2.ResponseBatch, None], Union[HTTPException, None]):
 
     try:
 
-        resp = stub.ModifyUserPassword(pb2.RequestModifyUserPassword(**new_password))
+        resp = getattr(stub, method)(rpc_request(method, data), timeout= deadline(method))
 
-    except _InactiveRpcError as InactiveRpcError:
-        logger.error(f"[edit pass] API-service can't connect to grpc host [caller: {caller} -error: {InactiveRpcError}]")
-        raise HTTPException(status_code= status.HTTP_500_INTERNAL_SERVER_ERROR, detail={'code': 2002, 'message': "API-service can't connect to grpc host"})
+    except Exception as e:
+        return None, call_error(e, logger, func, caller, target)
 
-    except Exception as e :
-        logger.error(f'[edit pass] Error in grpc connection [caller: {caller} -error: {e}]')
-        raise HTTPException(status_code= status.HTTP_500_INTERNAL_SERVER_ERROR, detail={'code': 2003, 'message': "Error in grpc connection"})
+    err = resp_error(resp, logger, func, caller, target, codes)
+    return (None, err) if err else (resp, None)
 
-    if resp.code == 1401:
-        logger.debug(f'[edit pass] Username is not found [caller: {caller}]')
-        raise HTTPException(status_code= status.HTTP_404_NOT_FOUND, detail={'message': 'Username is not found', 'code': 2401})
+def fetch_user(username: str, stub: DataBaseStub, cache_db: Redis= None) -> pb2.ResponseUserInfo:
+    """One GetUser call shared by every concurrent lookup of `username`, the
+    caches are written once per call too"""
 
-    if resp.code != 1200:
-        logger.debug(f'[edit pass] error in database service [caller: {caller} -err_msg: {resp.message} -err_code: {resp.code}]')
-        raise HTTPException(status_code= status.HTTP_500_INTERNAL_SERVER_ERROR, detail={'message': 'Contact to support!', 'code': resp.code})
+    # read before the call, a write landing in between keeps the answer out of the cache
+    seen, seen_missing = generations([(profile_cache, username), (missing_cache, username)], cache_db) if cache_db is not None else (None, None)
 
-    return {'message': 'password changed successfully', 'code': 1200}, None
+    request = pb2.RequestUserInfo(username= username)
+    resp = hedged('GetUser', lambda target: target.GetUser(request, timeout= deadline('GetUser')), stub, lambda: session.stub)
 
+    if cache_db is not None:
+        if resp.code == 1200:
+            profile_cache.fill(username, cached_profile(user_to_dict(resp.data)), seen, cache_db)
 
-def edit_user_role(caller: str, new_role: dict, stub: DataBaseStub, logger: logging) -> (Union[dict ,None], Union[HTTPException, None]):
+        elif resp.code == 1401:
+            fill_missing(username, seen_missing, cache_db)
+
+    return resp
+
+def get_user(caller: str, username: str, stub: DataBaseStub, logger: logging, func: str, cache_db: Redis= None, with_password: bool= False) -> (Union[dict ,None], Union[HTTPException, None]):
+    """`with_password` skips the profile cache, which never holds the password hash"""
+
+    if cache_db is not None:
+        resp_user = None if with_password else profile_cache.get(username, cache_db)
+        if resp_user is not None:
+            return resp_user, None
+
+        if known_missing(username, cache_db):
+            logger.debug('[%s] Username is known to be missing [caller: %s -target_username: %s]', func, caller, username)
+            return None, HTTPException(status_code= status.HTTP_404_NOT_FOUND, detail={'message': 'Username is not found', 'code': 2401})
 
     try:
 
-        resp = stub.ModifyUserRole(pb2.RequestModifyUserRole(**new_role))
-    
-    except _InactiveRpcError as InactiveRpcError:
-        logger.error(f"[edit role] API-service can't connect to grpc host [caller: {caller} -target_date: {new_role} -error: {InactiveRpcError}]")
-        raise HTTPException(status_code= status.HTTP_500_INTERNAL_SERVER_ERROR, detail={'code': 2002, 'message': "API-service can't connect to grpc host"})
+        resp = user_flight.do(username, lambda: fetch_user(username, stub, cache_db))
 
-    except Exception as e :
-        logger.error(f'[edit role] Error in grpc connection [caller: {caller} -target_data: {new_role} -error: {e}]')
-        raise HTTPException(status_code= status.HTTP_500_INTERNAL_SERVER_ERROR, detail={'code': 2003, 'message': "Error in grpc connection"})
+    except Exception as e:
+        return None, call_error(e, logger, func, caller, username)
 
-    if resp.code == 1401:
-        logger.debug(f'[edit role] Username is not found [caller: {caller} -target_data: {new_role}]')
-        raise HTTPException(status_code= status.HTTP_404_NOT_FOUND, detail={'message': 'Username is not found', 'code': 2401})
+    err = resp_error(resp, logger, func, caller, username, (1401,))
+    if err:
+        return None, err
 
-    if resp.code != 1200:
-        logger.debug(f'[edit role] error in database service [caller: {caller} -target_data: {new_role} -err_msg: {resp.message} -err_code: {resp.code}]')
-        raise HTTPException(status_code= status.HTTP_500_INTERNAL_SERVER_ERROR, detail={'message': 'Contact to support!', 'code': resp.code})
+    return user_to_dict(resp.data), None
 
-    return {'message': 'role updated successfully', 'code': 1200}, None
 
+def create_user(caller: str, data_new_user: dict, stub: DataBaseStub, logger: logging, cache_db: Redis= None) -> (Union[dict ,None], Union[HTTPException, None]):
 
-def delete_user_target(caller: str, delete_username: dict, stub: DataBaseStub, logger: logging) -> (Union[dict ,None], Union[HTTPException, None]):
+    _, err = call('NewUser', data_new_user, stub, logger, 'create user', caller, data_new_user['username'], (1403, 1406, 1407))
+    if err:
+        return None, err
 
-    try:
+    if cache_db is not None:
+        set_created([data_new_user['username']], cache_db)
+
+    return {'message': 'user successfully created', 'code': 1200}, None
 
-        resp = stub.DeleteUser(pb2.RequestDeleteUser(**delete_username))
 
-    except _InactiveRpcError as InactiveRpcError:
-        logger.error(f"[delete] API-service can't connect to grpc host [caller: {caller} -target_username: {delete_username['username']} -error: {InactiveRpcError}]")
-        raise HTTPException(status_code= status.HTTP_500_INTERNAL_SERVER_ERROR, detail={'code': 2002, 'message': "API-service can't connect to grpc host"})
+def edit_user_info(caller: str, new_user_data: dict, stub: DataBaseStub, logger: logging, cache_db: Redis= None) -> (Union[dict ,None], Union[HTTPException, None]):
+
+    _, err = call('ModifyUserInfo', new_user_data, stub, logger, 'edit info', caller, new_user_data['username'], (1401, 1406, 1407))
+    if err:
+        return None, err
 
-    except Exception as e :
-        logger.error(f'[delete] Error in grpc connection [caller: {caller} -target_username: {delete_username["username"]} -error: {e}]')
-        raise HTTPException(status_code= status.HTTP_500_INTERNAL_SERVER_ERROR, detail={'code': 2003, 'message': "Error in grpc connection"})
+    if cache_db is not None:
+        profile_cache.delete(new_user_data['username'], cache_db)
+
+    return {'message': 'user information updated successfully', 'code': 1200}, None
 
-    if resp.code == 1401:
-        logger.debug(f'[delete] Username is not found [caller: {caller} -target_username: {delete_username["username"]}]')
-        raise HTTPException(status_code= status.HTTP_404_NOT_FOUND, detail={'message': 'Username is not found', 'code': 2401})
 
-    if resp.code != 1200:
-        logger.debug(f'[delete] error in database service [caller: {caller} -target_username: {delete_username["username"]} -err_msg: {resp.message} -err_code: {resp.code}]')
-        raise HTTPException(status_code= status.HTTP_500_INTERNAL_SERVER_ERROR, detail={'message': 'Contact to support!', 'code': resp.code})
+def edit_user_password(caller: str, new_password: dict, stub: DataBaseStub, logger: logging, cache_db: Redis= None) -> (Union[dict ,None], Union[HTTPException, None]):
+
+    _, err = call('ModifyUserPassword', new_password, stub, logger, 'edit pass', caller, new_password['username'], (1401, 1412))
+    if err:
+        return None, err
+
+    if cache_db is not None:
+        profile_cache.delete(new_password['username'], cache_db)
+
+    return {'message': 'password changed successfully', 'code': 1200}, None
+
+
+def edit_user_role(caller: str, new_role: dict, stub: DataBaseStub, logger: logging, cache_db: Redis= None) -> (Union[dict ,None], Union[HTTPException, None]):
+
+    _, err = call('ModifyUserRole', new_role, stub, logger, 'edit role', caller, new_role['username'], (1401,))
+    if err:
+        return None, err
+
+    if cache_db is not None:
+        profile_cache.delete(new_role['username'], cache_db)
+
+    return {'message': 'role updated successfully', 'code': 1200}, None
+
+
+def delete_user_target(caller: str, delete_username: dict, stub: DataBaseStub, logger: logging, cache_db: Redis= None) -> (Union[dict ,None], Union[HTTPException, None]):
+
+    _, err = call('DeleteUser', delete_username, stub, logger, 'delete', caller, delete_username['username'], (1401,))
+    if err:
+        return None, err
+
+    if cache_db is not None:
+        profile_cache.delete(delete_username['username'], cache_db)
+        set_missing([delete_username['username']], cache_db)
 
     return {'message': 'user deleted successfully', 'code': 1200}, None
- 
\ No newline at end of file
+
+
+def create_users(caller: str, users: List[dict], stub: DataBaseStub, logger: logging, cache_db: Redis= None) -> (Union[list ,None], Union[HTTPException, None]):
+
+    resp, err = call('NewUsers', users, stub, logger, 'batch new', caller, '%d users' % len(users))
+    if err:
+        return None, err
+
+    results = batch_results(resp, 'user successfully created')
+
+    if cache_db is not None:
+        set_created([result['username'] for result in results if result['code'] == 1200], cache_db)
+
+    return results, None
+
+
+def edit_users_role(caller: str, new_roles: List[dict], stub: DataBaseStub, logger: logging, cache_db: Redis= None) -> (Union[list ,None], Union[HTTPException, None]):
+
+    resp, err = call('ModifyUsersRole', new_roles, stub, logger, 'batch role', caller, '%d users' % len(new_roles))
+    if err:
+        return None, err
+
+    results = batch_results(resp, 'role updated successfully')
+
+    if cache_db is not None:
+        profile_cache.delete_many([result['username'] for result in results if result['code'] == 1200], cache_db)
+
+    return results, None
+
+
+def delete_users_target(caller: str, delete_usernames: List[dict], stub: DataBaseStub, logger: logging, cache_db: Redis= None) -> (Union[list ,None], Union[HTTPException, None]):
+
+    resp, err = call('DeleteUsers', delete_usernames, stub, logger, 'batch delete', caller, '%d users' % len(delete_usernames))
+    if err:
+        return None, err
+
+    results = batch_results(resp, 'user deleted successfully')
+
+    if cache_db is not None:
+        deleted = [result['username'] for result in results if result['code'] == 1200]
+        profile_cache.delete_many(deleted, cache_db)
+        set_missing(deleted, cache_db)
+
+    return results, None
+
+
+def list_users(caller: str, list_filter: dict, stub: DataBaseStub, logger: logging, timeout: Optional[float]= deadline('ListUsers')) -> Iterator[dict]:
+    """`timeout` None lets a full listing run as long as it takes"""
+
+    call = stub.ListUsers(pb2.RequestListUsers(**list_filter), timeout= timeout)
+
+    try:
+        for data in call:
+            yield user_to_dict(data)
+
+    except RpcError as e:
+        logger.error("[list] API-service can't connect to grpc host [caller: %s -filter: %s -error: %s]", caller, list_filter, e)
+        raise HTTPException(status_code= status.HTTP_500_INTERNAL_SERVER_ERROR, detail={'code': 2002, 'message': "API-service can't connect to grpc host"})
+
+    finally:
+        call.cancel()
@@ -0,0 +1,294 @@
+from log_utils.timing import record_grpc
+from database_service.resilience import AioCircuitOpenError, breaker, retry_budget, should_retry, remaining
+from log_utils.tracing import tracer, inject
+from opentelemetry.trace import SpanKind, Status, StatusCode
+import collections
+import asyncio
+import grpc
+import time
+
+
+def _method_name(details) -> str:
+    method = details.method
+    if isinstance(method, bytes):
+        method = method.decode()
+    return method.rsplit('/', 1)[-1]
+
+
+def _response_code(response):
+    return getattr(response, 'code', None)
+
+
+class TimingInterceptor(grpc.UnaryUnaryClientInterceptor, grpc.StreamUnaryClientInterceptor):
+    """Records latency, grpc status and the `code` field of the response of
+    every unary response call into the current request timings"""
+
+    def _intercept(self, continuation, client_call_details, request):
+
+        start = time.perf_counter()
+        outcome = continuation(client_call_details, request)
+        elapsed = time.perf_counter() - start
+
+        if outcome.exception() is not None:
+            record_grpc(_method_name(client_call_details), elapsed, outcome.code().name, None)
+
+        else:
+            record_grpc(_method_name(client_call_details), elapsed, 'OK', _response_code(outcome.result()))
+
+        return outcome
+
+    def intercept_unary_unary(self, continuation, client_call_details, request):
+        return self._intercept(continuation, client_call_details, request)
+
+    def intercept_stream_unary(self, continuation, client_call_details, request_iterator):
+        return self._intercept(continuation, client_call_details, request_iterator)
+
+
+async def _intercept_aio(continuation, client_call_details, request):
+
+    start = time.perf_counter()
+    call = await continuation(client_call_details, request)
+    try:
+        response = await call
+
+    except grpc.aio.AioRpcError as rpc_error:
+        record_grpc(_method_name(client_call_details), time.perf_counter() - start, rpc_error.code().name, None)
+
+    else:
+        record_grpc(_method_name(client_call_details), time.perf_counter() - start, 'OK', _response_code(response))
+
+    return call
+
+
+# grpc.aio files each interceptor under a single call type, hence one class per type
+class AioUnaryUnaryTimingInterceptor(grpc.aio.UnaryUnaryClientInterceptor):
+
+    async def intercept_unary_unary(self, continuation, client_call_details, request):
+        return await _intercept_aio(continuation, client_call_details, request)
+
+
+class AioStreamUnaryTimingInterceptor(grpc.aio.StreamUnaryClientInterceptor):
+
+    async def intercept_stream_unary(self, continuation, client_call_details, request_iterator):
+        return await _intercept_aio(continuation, client_call_details, request_iterator)
+
+
+def _deadline_at(details):
+    return time.monotonic() + details.timeout if details.timeout is not None else None
+
+
+class ResilienceInterceptor(grpc.UnaryUnaryClientInterceptor, grpc.StreamUnaryClientInterceptor):
+    """Runs every attempt through the circuit breaker of its method and
+    retries the methods of GRPC_RETRY_METHODS with jittered backoff, within
+    the retry budget and the deadline of the original call"""
+
+    def _attempt(self, method, continuation, client_call_details, request):
+
+        found = breaker(method)
+        found.allow()
+        code = grpc.StatusCode.UNKNOWN
+        try:
+            outcome = continuation(client_call_details, request)
+            code = outcome.code() if outcome.exception() is not None else grpc.StatusCode.OK
+            return outcome
+
+        finally:
+            found.record(code)
+
+    def intercept_unary_unary(self, continuation, client_call_details, request):
+
+        method = _method_name(client_call_details)
+        deadline_at = _deadline_at(client_call_details)
+        retry_budget.deposit()
+
+        attempt = 0
+        while True:
+            outcome = self._attempt(method, continuation, client_call_details, request)
+            if outcome.exception() is None:
+                return outcome
+
+            delay = should_retry(method, outcome.code(), attempt, deadline_at)
+            if delay is None:
+                return outcome
+
+            time.sleep(delay)
+            attempt += 1
+            client_call_details = remaining(client_call_details, deadline_at)
+
+    def intercept_stream_unary(self, continuation, client_call_details, request_iterator):
+        # the request iterator is consumed by the first attempt, so no retries here
+        return self._attempt(_method_name(client_call_details), continuation, client_call_details, request_iterator)
+
+
+async def _attempt_aio(method, continuation, client_call_details, request):
+
+    found = breaker(method)
+    found.allow(AioCircuitOpenError)
+    code = grpc.StatusCode.UNKNOWN
+    try:
+        call = await continuation(client_call_details, request)
+        code = await call.code()
+        return call, code
+
+    except asyncio.CancelledError:
+        code = grpc.StatusCode.CANCELLED
+        raise
+
+    finally:
+        found.record(code)
+
+
+class AioUnaryUnaryResilienceInterceptor(grpc.aio.UnaryUnaryClientInterceptor):
+
+    async def intercept_unary_unary(self, continuation, client_call_details, request):
+
+        method = _method_name(client_call_details)
+        deadline_at = _deadline_at(client_call_details)
+        retry_budget.deposit()
+
+        attempt = 0
+        while True:
+            call, code = await _attempt_aio(method, continuation, client_call_details, request)
+            delay = should_retry(method, code, attempt, deadline_at) if code != grpc.StatusCode.OK else None
+            if delay is None:
+                return call
+
+            await asyncio.sleep(delay)
+            attempt += 1
+            client_call_details = remaining(client_call_details, deadline_at)
+
+
+class AioStreamUnaryResilienceInterceptor(grpc.aio.StreamUnaryClientInterceptor):
+
+    async def intercept_stream_unary(self, continuation, client_call_details, request_iterator):
+        call, _ = await _attempt_aio(_method_name(client_call_details), continuation, client_call_details, request_iterator)
+        return call
+
+
+class _CallDetails(
+    collections.namedtuple('_CallDetails', ('method', 'timeout', 'metadata', 'credentials', 'wait_for_ready', 'compression')),
+    grpc.ClientCallDetails
+):
+    pass
+
+
+def _traced_details(details):
+    return _CallDetails(
+        details.method,
+        details.timeout,
+        inject(details.metadata),
+        details.credentials,
+        details.wait_for_ready,
+        details.compression
+    )
+
+
+def _aio_traced_details(details):
+    return grpc.aio.ClientCallDetails(
+        details.method,
+        details.timeout,
+        grpc.aio.Metadata(*inject(details.metadata)),
+        details.credentials,
+        details.wait_for_ready
+    )
+
+
+def _start_span(details):
+    return tracer.start_as_current_span(
+        _method_name(details),
+        kind= SpanKind.CLIENT,
+        attributes= {'rpc.system': 'grpc', 'rpc.service': 'DataBase', 'rpc.method': _method_name(details)}
+    )
+
+
+def _end_span(span, status: str, response=None):
+
+    if not span.is_recording():
+        return
+
+    span.set_attribute('rpc.grpc.status_code', getattr(grpc.StatusCode, status).value[0])
+    if status != 'OK':
+        span.set_status(Status(StatusCode.ERROR, status))
+
+    elif _response_code(response) is not None:
+        span.set_attribute('app.response_code', _response_code(response))
+
+
+class TracingInterceptor(grpc.UnaryUnaryClientInterceptor, grpc.StreamUnaryClientInterceptor, grpc.UnaryStreamClientInterceptor):
+    """Wraps every call in a client span and sends its context in the call
+    metadata. Server-streaming calls only carry the context of the current
+    span, since the stream outlives the interceptor"""
+
+    def _intercept(self, continuation, client_call_details, request):
+
+        with _start_span(client_call_details) as span:
+            outcome = continuation(_traced_details(client_call_details), request)
+
+            if outcome.exception() is not None:
+                _end_span(span, outcome.code().name)
+
+            else:
+                _end_span(span, 'OK', outcome.result())
+
+            return outcome
+
+    def intercept_unary_unary(self, continuation, client_call_details, request):
+        return self._intercept(continuation, client_call_details, request)
+
+    def intercept_stream_unary(self, continuation, client_call_details, request_iterator):
+        return self._intercept(continuation, client_call_details, request_iterator)
+
+    def intercept_unary_stream(self, continuation, client_call_details, request):
+        return continuation(_traced_details(client_call_details), request)
+
+
+async def _trace_aio(continuation, client_call_details, request):
+
+    with _start_span(client_call_details) as span:
+        call = await continuation(_aio_traced_details(client_call_details), request)
+        try:
+            response = await call
+
+        except grpc.aio.AioRpcError as rpc_error:
+            _end_span(span, rpc_error.code().name)
+
+        else:
+            _end_span(span, 'OK', response)
+
+        return call
+
+
+class AioUnaryUnaryTracingInterceptor(grpc.aio.UnaryUnaryClientInterceptor):
+
+    async def intercept_unary_unary(self, continuation, client_call_details, request):
+        return await _trace_aio(continuation, client_call_details, request)
+
+
+class AioStreamUnaryTracingInterceptor(grpc.aio.StreamUnaryClientInterceptor):
+
+    async def intercept_stream_unary(self, continuation, client_call_details, request_iterator):
+        return await _trace_aio(continuation, client_call_details, request_iterator)
+
+
+class AioUnaryStreamTracingInterceptor(grpc.aio.UnaryStreamClientInterceptor):
+
+    async def intercept_unary_stream(self, continuation, client_call_details, request):
+        return await continuation(_aio_traced_details(client_call_details), request)
+
+
+def interceptors() -> list:
+    # the tracing interceptor goes first so the timing one runs inside its span,
+    # retries sit in between so the span covers all attempts and each one is timed
+    return [TracingInterceptor(), ResilienceInterceptor(), TimingInterceptor()]
+
+
+def aio_interceptors() -> list:
+    return [
+        AioUnaryUnaryTracingInterceptor(),
+        AioStreamUnaryTracingInterceptor(),
+        AioUnaryStreamTracingInterceptor(),
+        AioUnaryUnaryResilienceInterceptor(),
+        AioStreamUnaryResilienceInterceptor(),
+        AioUnaryUnaryTimingInterceptor(),
+        AioStreamUnaryTimingInterceptor()
+    ]
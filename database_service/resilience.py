@@ -0,0 +1,312 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from log_utils.logger import get_logger
+from log_utils.metrics import GRPC_BREAKER_TRANSITIONS, GRPC_BREAKER_REJECTED, GRPC_RETRIES
+from typing import Callable
+import contextvars
+import threading
+import asyncio
+import random
+import time
+import grpc
+import os
+
+
+GRPC_BREAKER_FAILURES = int(os.getenv('GRPC_BREAKER_FAILURES', 5))
+GRPC_BREAKER_OPEN_SECONDS = float(os.getenv('GRPC_BREAKER_OPEN_SECONDS', 5))
+GRPC_RETRY_METHODS = os.getenv('GRPC_RETRY_METHODS', 'GetUser')
+GRPC_RETRY_MAX_ATTEMPTS = int(os.getenv('GRPC_RETRY_MAX_ATTEMPTS', 3))
+GRPC_RETRY_BACKOFF_MS = float(os.getenv('GRPC_RETRY_BACKOFF_MS', 25))
+GRPC_RETRY_BACKOFF_MAX_MS = float(os.getenv('GRPC_RETRY_BACKOFF_MAX_MS', 500))
+GRPC_RETRY_BUDGET_RATIO = float(os.getenv('GRPC_RETRY_BUDGET_RATIO', 0.1))
+GRPC_RETRY_BUDGET_MIN_PER_SECOND = float(os.getenv('GRPC_RETRY_BUDGET_MIN_PER_SECOND', 10))
+GRPC_HEDGE_DELAY_MS = float(os.getenv('GRPC_HEDGE_DELAY_MS', 0))
+GRPC_HEDGE_THREADS = int(os.getenv('GRPC_HEDGE_THREADS', 32))
+
+# statuses that say the backend is in trouble, anything else is the caller's problem
+FAILURE_CODES = {
+    grpc.StatusCode.UNAVAILABLE,
+    grpc.StatusCode.DEADLINE_EXCEEDED,
+    grpc.StatusCode.RESOURCE_EXHAUSTED,
+    grpc.StatusCode.INTERNAL,
+    grpc.StatusCode.UNKNOWN
+}
+# only retried when the request never reached the backend or it refused it
+RETRY_CODES = {grpc.StatusCode.UNAVAILABLE}
+
+retry_methods = {method.strip() for method in GRPC_RETRY_METHODS.split(',') if method.strip()}
+
+logger = get_logger('grpc_resilience.log')
+
+
+class CircuitOpenError(Exception):
+
+    def __init__(self, method: str, retry_after: float):
+        super().__init__(f'circuit breaker of {method} is open')
+        self.method = method
+        self.retry_after = retry_after
+
+
+class AioCircuitOpenError(CircuitOpenError, grpc.aio.AioRpcError):
+    """grpc.aio only expects its own errors out of an interceptor, so the
+    async interceptors raise this UNAVAILABLE AioRpcError instead"""
+
+    def __init__(self, method: str, retry_after: float):
+        grpc.aio.AioRpcError.__init__(self, grpc.StatusCode.UNAVAILABLE, grpc.aio.Metadata(), grpc.aio.Metadata(), f'circuit breaker of {method} is open')
+        self.method = method
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Opens after `failures` consecutive failed calls and fails every call
+    fast for `open_seconds`. Then one probe at a time is let through
+    (half open), its success closes the breaker and its failure opens it again"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, method: str, failures: int, open_seconds: float):
+        self.method = method
+        self.failures = failures
+        self.open_seconds = open_seconds
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.rejected = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _move(self, state: str):
+        self.state = state
+        GRPC_BREAKER_TRANSITIONS.labels(self.method, state).inc()
+        logger.warning('[breaker] %s is %s [consecutive_failures: %s]', self.method, state, self.consecutive_failures)
+
+    def allow(self, error=CircuitOpenError):
+        """Raises `error` unless the call may go out, every allowed
+        call must be followed by `record`"""
+
+        if self.failures <= 0:
+            return
+
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+
+            waited = time.monotonic() - self.opened_at
+            if self.state == self.OPEN and waited >= self.open_seconds:
+                self._move(self.HALF_OPEN)
+
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+
+            self.rejected += 1
+
+        GRPC_BREAKER_REJECTED.labels(self.method).inc()
+        raise error(self.method, max(0.0, self.open_seconds - waited))
+
+    def record(self, code: grpc.StatusCode):
+
+        if self.failures <= 0:
+            return
+
+        failed = code in FAILURE_CODES
+        with self._lock:
+            self._probing = False
+
+            # a call cancelled by us (the losing hedge) says nothing about the backend
+            if code == grpc.StatusCode.CANCELLED:
+                return
+
+            if not failed:
+                self.consecutive_failures = 0
+                if self.state != self.CLOSED:
+                    self._move(self.CLOSED)
+                return
+
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.consecutive_failures >= self.failures):
+                self.opened_at = time.monotonic()
+                self._move(self.OPEN)
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'rejected': self.rejected
+        }
+
+
+class RetryBudget:
+    """Token bucket shared by retries and hedges of every method. Each call
+    adds `ratio` of a token and `min_per_second` tokens flow in over time,
+    each retry or hedge takes a whole one. Retries then never add more than
+    `ratio` extra load, which keeps them from finishing off a struggling backend"""
+
+    def __init__(self, ratio: float, min_per_second: float):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = max(1.0, min_per_second * 10)
+        self.denied = 0
+        self._balance = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, amount: float):
+        now = time.monotonic()
+        self._balance = min(self.capacity, self._balance + amount + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def deposit(self):
+        with self._lock:
+            self._refill(self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            self._refill(0)
+            if self._balance >= 1:
+                self._balance -= 1
+                return True
+
+            self.denied += 1
+            return False
+
+    def stats(self):
+        return {'balance': round(self._balance, 2), 'capacity': self.capacity, 'denied': self.denied}
+
+
+breakers = {}
+_breakers_lock = threading.Lock()
+retry_budget = RetryBudget(GRPC_RETRY_BUDGET_RATIO, GRPC_RETRY_BUDGET_MIN_PER_SECOND)
+
+
+def breaker(method: str) -> CircuitBreaker:
+
+    found = breakers.get(method)
+    if found is None:
+        with _breakers_lock:
+            found = breakers.setdefault(method, CircuitBreaker(method, GRPC_BREAKER_FAILURES, GRPC_BREAKER_OPEN_SECONDS))
+    return found
+
+
+def backoff(attempt: int) -> float:
+    """Full jitter: uniform between 0 and the capped exponential step, in seconds"""
+
+    return random.uniform(0, min(GRPC_RETRY_BACKOFF_MAX_MS, GRPC_RETRY_BACKOFF_MS * 2 ** attempt)) / 1000
+
+
+def should_retry(method: str, code: grpc.StatusCode, attempt: int, deadline_at) -> float:
+    """Backoff in seconds before the next attempt, None when there is none"""
+
+    if method not in retry_methods or code not in RETRY_CODES or attempt + 1 >= GRPC_RETRY_MAX_ATTEMPTS:
+        return None
+
+    delay = backoff(attempt)
+    if deadline_at is not None and time.monotonic() + delay >= deadline_at:
+        return None
+
+    if not retry_budget.withdraw():
+        GRPC_RETRIES.labels(method, 'retry', 'denied').inc()
+        return None
+
+    GRPC_RETRIES.labels(method, 'retry', 'sent').inc()
+    return delay
+
+
+def remaining(details, deadline_at):
+    """Call details of a retry, with the time left of the original deadline"""
+
+    if deadline_at is None:
+        return details
+    return details._replace(timeout= max(0.0, deadline_at - time.monotonic()))
+
+
+_hedge_pool = None
+_hedge_pool_lock = threading.Lock()
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _hedge_pool
+
+    if _hedge_pool is None:
+        with _hedge_pool_lock:
+            if _hedge_pool is None:
+                _hedge_pool = ThreadPoolExecutor(max_workers= GRPC_HEDGE_THREADS, thread_name_prefix='grpc-hedge')
+    return _hedge_pool
+
+
+def _hedge_allowed(method: str) -> bool:
+
+    if retry_budget.withdraw():
+        GRPC_RETRIES.labels(method, 'hedge', 'sent').inc()
+        return True
+
+    GRPC_RETRIES.labels(method, 'hedge', 'denied').inc()
+    return False
+
+
+def hedged(method: str, attempt: Callable, stub, next_stub: Callable):
+    """Runs `attempt(stub)` and, when it has not answered within
+    GRPC_HEDGE_DELAY_MS, `attempt` on the next stub of the pool too; the
+    first success wins. The slower call runs on until its own deadline, sync
+    calls can't be cancelled from another thread"""
+
+    if GRPC_HEDGE_DELAY_MS <= 0:
+        return attempt(stub)
+
+    first = _pool().submit(contextvars.copy_context().run, attempt, stub)
+    done, _ = wait([first], timeout= GRPC_HEDGE_DELAY_MS / 1000)
+    if done or not _hedge_allowed(method):
+        return first.result()
+
+    second = _pool().submit(contextvars.copy_context().run, attempt, next_stub())
+    pending = {first, second}
+    while pending:
+        done, pending = wait(pending, return_when= FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+
+    return first.result()
+
+
+async def ahedged(method: str, attempt: Callable, stub, next_stub: Callable):
+    """`hedged` for grpc.aio stubs, `attempt` returns the call and the
+    slower call is cancelled"""
+
+    if GRPC_HEDGE_DELAY_MS <= 0:
+        return await attempt(stub)
+
+    calls = [attempt(stub)]
+    tasks = [asyncio.ensure_future(calls[0])]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout= GRPC_HEDGE_DELAY_MS / 1000)
+        if done or not _hedge_allowed(method):
+            return await tasks[0]
+
+        calls.append(attempt(next_stub()))
+        tasks.append(asyncio.ensure_future(calls[1]))
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when= asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception() is None:
+                    return task.result()
+
+        return await tasks[0]
+
+    finally:
+        for call, task in zip(calls, tasks):
+            if not task.done():
+                call.cancel()
+                task.cancel()
+
+
+def stats() -> dict:
+
+    return {
+        'breakers': {method: found.stats() for method, found in breakers.items()},
+        'retry_budget': retry_budget.stats(),
+        'retry_methods': sorted(retry_methods),
+        'hedge_delay_ms': GRPC_HEDGE_DELAY_MS
+    }
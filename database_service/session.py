@@ -1,11 +1,110 @@
-import grpc 
+import grpc
 import grpc_utils.database_pb2_grpc as pb2_grpc
+from database_service.interceptors import interceptors, aio_interceptors
+import itertools
+import json
 import os
 
 HOST = os.getenv("GRPC_HOST")
 PORT = os.getenv("GRPC_PORT")
+GRPC_TARGETS = os.getenv('GRPC_TARGETS', '')
+GRPC_LB_POLICY = os.getenv('GRPC_LB_POLICY', 'round_robin')
+GRPC_CHANNELS_PER_TARGET = int(os.getenv('GRPC_CHANNELS_PER_TARGET', 1))
+# a default grpc server answers pings sent more often than every 5 minutes, or
+# without calls in flight, with GOAWAY too_many_pings and the channel drops
+GRPC_KEEPALIVE_TIME_MS = int(os.getenv('GRPC_KEEPALIVE_TIME_MS', 300000))
+GRPC_KEEPALIVE_TIMEOUT_MS = int(os.getenv('GRPC_KEEPALIVE_TIMEOUT_MS', 10000))
+GRPC_KEEPALIVE_WITHOUT_CALLS = os.getenv('GRPC_KEEPALIVE_WITHOUT_CALLS', 'false').lower() in ('1', 'true', 'yes')
+GRPC_DEADLINE = float(os.getenv('GRPC_DEADLINE', 5))
+GRPC_DEADLINES = os.getenv('GRPC_DEADLINES', '')
+
+# batch rpcs carry up to BATCH_MAX_ITEMS users and ListUsers up to a role's worth,
+# the export and the bloom rebuild pass their own (none) to list_users
+DEFAULT_DEADLINES = {
+    'GetUser': 2,
+    'NewUsers': 30,
+    'ModifyUsersRole': 30,
+    'DeleteUsers': 30,
+    'ListUsers': 30
+}
+
+
+def _parse_deadlines(value: str) -> dict:
+    """`GRPC_DEADLINES` looks like `GetUser=1,NewUsers=60`, 0 means no deadline"""
+
+    deadlines = {}
+    for item in value.split(','):
+        if '=' in item:
+            method, seconds = item.split('=', 1)
+            deadlines[method.strip()] = float(seconds)
+
+    return deadlines
+
+
+deadlines = {**DEFAULT_DEADLINES, **_parse_deadlines(GRPC_DEADLINES)}
+
+
+def deadline(method: str):
+    """Timeout in seconds for a call to `method`, None when it has none"""
+
+    seconds = deadlines.get(method, GRPC_DEADLINE)
+    return seconds if seconds > 0 else None
+
+
+def targets() -> list:
+    """`GRPC_TARGETS` is a comma separated list of grpc targets, e.g.
+    `db-1:3333,db-2:3333` or `dns:///grpc_service:3333`; without it the
+    single GRPC_HOST:GRPC_PORT is resolved through dns"""
+
+    listed = [target.strip() for target in GRPC_TARGETS.split(',') if target.strip()]
+    return listed or [f'dns:///{HOST}:{PORT}']
+
+
+def channel_options() -> list:
+
+    return [
+        # round_robin spreads calls over every address a target resolves to
+        ('grpc.service_config', json.dumps({'loadBalancingConfig': [{GRPC_LB_POLICY: {}}]})),
+        ('grpc.keepalive_time_ms', GRPC_KEEPALIVE_TIME_MS),
+        ('grpc.keepalive_timeout_ms', GRPC_KEEPALIVE_TIMEOUT_MS),
+        ('grpc.keepalive_permit_without_calls', int(GRPC_KEEPALIVE_WITHOUT_CALLS)),
+        # unlimited pings between calls only when idle connections are pinged at all
+        ('grpc.http2.max_pings_without_data', 0 if GRPC_KEEPALIVE_WITHOUT_CALLS else 2),
+        # channels with the same target otherwise share their connections
+        ('grpc.use_local_subchannel_pool', 1)
+    ]
+
 
 class GrpcSingleton:
+    """GRPC_CHANNELS_PER_TARGET channels to every target, each request gets
+    the stub of the next one. Several channels per target spread the calls
+    over more http/2 connections than the server's stream limit allows on one"""
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self, targets: list):
+        if not hasattr(self, '_stubs'):
+            self._targets = targets
+            self._chanels = [
+                grpc.intercept_channel(grpc.insecure_channel(target, options=channel_options()), *interceptors())
+                for target in targets for _ in range(max(1, GRPC_CHANNELS_PER_TARGET))
+            ]
+            self._stubs = [pb2_grpc.DataBaseStub(chanel) for chanel in self._chanels]
+            self._next = itertools.cycle(self._stubs)
+
+    @property
+    def stub(self):
+        return next(self._next)
+
+    def stats(self):
+        return {'targets': self._targets, 'channels': len(self._chanels)}
+
+
+class AioGrpcSingleton:
     _instance = None
 
     def __new__(cls, *args, **kwargs):
@@ -13,18 +112,58 @@ class GrpcSingleton:
             cls._instance = super().__new__(cls)
         return cls._instance
 
-    def __init__(self, host, port):
-        if not hasattr(self, '_stub'):
-            _chanel = grpc.insecure_channel(f'{host}:{port}')
-            self._stub = pb2_grpc.DataBaseStub(_chanel)
+    def __init__(self, targets: list):
+        if not hasattr(self, '_targets'):
+            self._targets = targets
+            self._chanels = []
+            self._stubs = []
+            self._next = None
 
     @property
     def stub(self):
-        return self._stub
+        # grpc.aio channels bind to the running event loop, so the channels are
+        # created lazily on first use instead of at import time
+        if not self._stubs:
+            self._chanels = [
+                grpc.aio.insecure_channel(target, options=channel_options(), interceptors=aio_interceptors())
+                for target in self._targets for _ in range(max(1, GRPC_CHANNELS_PER_TARGET))
+            ]
+            self._stubs = [pb2_grpc.DataBaseStub(chanel) for chanel in self._chanels]
+            self._next = itertools.cycle(self._stubs)
+        return next(self._next)
+
+    async def close(self):
+        for chanel in self._chanels:
+            await chanel.close()
+        self._chanels = []
+        self._stubs = []
+        self._next = None
+
+    def stats(self):
+        return {
+            'targets': self._targets,
+            'channels': len(self._chanels),
+            'states': [chanel.get_state().name for chanel in self._chanels]
+        }
 
-session = GrpcSingleton(HOST, PORT)
+
+session = GrpcSingleton(targets())
+aio_session = AioGrpcSingleton(targets())
 
 def get_grpc():
-    
+
     yield session.stub
 
+async def get_aio_grpc():
+
+    yield aio_session.stub
+
+
+def pool_stats() -> dict:
+
+    return {
+        'sync_pool': session.stats(),
+        'async_pool': aio_session.stats(),
+        'lb_policy': GRPC_LB_POLICY,
+        'deadlines': {**deadlines, 'default': GRPC_DEADLINE}
+    }
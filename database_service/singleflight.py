@@ -0,0 +1,98 @@
+from log_utils.metrics import GRPC_COALESCED
+from typing import Callable
+import threading
+import asyncio
+
+
+class _Flight:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share one execution and its
+    result or error, the first caller runs it and the others wait.
+
+    Sync callers (threadpool routes) and async callers (event loop routes)
+    are tracked apart, a thread can't await the loop's future and the loop
+    must not block on a thread"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.coalesced = 0
+        self._flights = {}
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def _joined(self):
+        self.coalesced += 1
+        GRPC_COALESCED.labels(self.name).inc()
+
+    def do(self, key, fn: Callable):
+
+        with self._lock:
+            self.calls += 1
+            flight = self._flights.get(key)
+            if flight is not None:
+                self._joined()
+                leader = False
+
+            else:
+                flight = self._flights[key] = _Flight()
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+            return flight.result
+
+        except Exception as e:
+            flight.error = e
+            raise
+
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    async def ado(self, key, fn: Callable):
+        """`fn` returns an awaitable. It runs as its own task so a cancelled
+        caller doesn't cancel it for the others"""
+
+        with self._lock:
+            self.calls += 1
+            task = self._tasks.get(key)
+            if task is not None:
+                self._joined()
+
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda done: self._landed(key, done))
+
+        return await asyncio.shield(task)
+
+    def _landed(self, key, task: asyncio.Future):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        # every waiter may be gone, read the error so asyncio doesn't log it as unhandled
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'coalesced': self.coalesced,
+            'in_flight': len(self._flights) + len(self._tasks)
+        }
+
+
+user_flight = SingleFlight('GetUser')
@@ -14,33 +14,39 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0e\x64\x61tabase.proto\"\x8f\x01\n\x0eRequestNewUser\x12\x17\n\x04role\x18\x05 \x01(\x0e\x32\t.UserRole\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\x10\n\x08username\x18\x02 \x01(\t\x12\x10\n\x08password\x18\x03 \x01(\t\x12\x14\n\x0cphone_number\x18\x04 \x01(\t\x12\x12\n\x05\x65mail\x18\x06 \x01(\tH\x00\x88\x01\x01\x42\x08\n\x06_email\"?\n\x19RequestModifyUserPassword\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x10\n\x08password\x18\x02 \x01(\t\"B\n\x15RequestModifyUserRole\x12\x17\n\x04role\x18\x02 \x01(\x0e\x32\t.UserRole\x12\x10\n\x08username\x18\x01 \x01(\t\"\x8f\x01\n\x15RequestModifyUserInfo\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x11\n\x04name\x18\x02 \x01(\tH\x00\x88\x01\x01\x12\x12\n\x05\x65mail\x18\x03 \x01(\tH\x01\x88\x01\x01\x12\x19\n\x0cphone_number\x18\x04 \x01(\tH\x02\x88\x01\x01\x42\x07\n\x05_nameB\x08\n\x06_emailB\x0f\n\r_phone_number\"%\n\x11RequestDeleteUser\x12\x10\n\x08username\x18\x01 \x01(\t\"#\n\x0fRequestUserInfo\x12\x10\n\x08username\x18\x01 \x01(\t\"-\n\x0c\x42\x61seResponse\x12\x0f\n\x07message\x18\x01 \x01(\t\x12\x0c\n\x04\x63ode\x18\x02 \x01(\x05\"\x9a\x01\n\x08UserInfo\x12\x17\n\x04role\x18\x07 \x01(\x0e\x32\t.UserRole\x12\x0f\n\x07user_id\x18\x01 \x01(\x05\x12\x10\n\x08username\x18\x02 \x01(\t\x12\x0c\n\x04name\x18\x03 \x01(\t\x12\x10\n\x08password\x18\x04 \x01(\t\x12\x12\n\x05\x65mail\x18\x05 \x01(\tH\x00\x88\x01\x01\x12\x14\n\x0cphone_number\x18\x06 \x01(\tB\x08\n\x06_email\"X\n\x10ResponseUserInfo\x12\x0f\n\x07message\x18\x01 \x01(\t\x12\x0c\n\x04\x63ode\x18\x02 \x01(\x05\x12\x1c\n\x04\x64\x61ta\x18\x03 \x01(\x0b\x32\t.UserInfoH\x00\x88\x01\x01\x42\x07\n\x05_data*\x1f\n\x08UserRole\x12\t\n\x05\x41\x44MIN\x10\x00\x12\x08\n\x04USER\x10\x01\x32\xd5\x02\n\x08\x44\x61taBase\x12\x30\n\x07GetUser\x12\x10.RequestUserInfo\x1a\x11.ResponseUserInfo\"\x00\x12+\n\x07NewUser\x12\x0f.RequestNewUser\x1a\r.BaseResponse\"\x00\x12\x41\n\x12ModifyUserPassword\x12\x1a.RequestModifyUserPassword\x1a\r.BaseResponse\"\x00\x12\x39\n\x0eModifyUserRole\x12\x16.RequestModifyUserRole\x1a\r.BaseResponse\"\x00\x12\x39\n\x0eModifyUserInfo\x12\x16.RequestModifyUserInfo\x1a\r.BaseResponse\"\x00\x12\x31\n\nDeleteUser\x12\x12.RequestDeleteUser\x1a\r.BaseResponse\"\x00\x62\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0e\x64\x61tabase.proto\"\x9f\x01\n\x0eRequestNewUser\x12\x17\n\x04role\x18\x05 \x01(\x0e\x32\t.UserRole\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\x10\n\x08username\x18\x02 \x01(\t\x12\x10\n\x08password\x18\x03 \x01(\t\x12\x14\n\x0cphone_number\x18\x04 \x01(\t\x12\x12\n\x05\x65mail\x18\x06 \x01(\tH\x00\x88\x01\x01\x12\x0e\n\x06hashed\x18\x07 \x01(\x08\x42\x08\n\x06_email\"j\n\x19RequestModifyUserPassword\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x10\n\x08password\x18\x02 \x01(\t\x12\x0e\n\x06hashed\x18\x03 \x01(\x08\x12\x19\n\x11\x65xpected_password\x18\x04 \x01(\t\"B\n\x15RequestModifyUserRole\x12\x17\n\x04role\x18\x02 \x01(\x0e\x32\t.UserRole\x12\x10\n\x08username\x18\x01 \x01(\t\"\x8f\x01\n\x15RequestModifyUserInfo\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x11\n\x04name\x18\x02 \x01(\tH\x00\x88\x01\x01\x12\x12\n\x05\x65mail\x18\x03 \x01(\tH\x01\x88\x01\x01\x12\x19\n\x0cphone_number\x18\x04 \x01(\tH\x02\x88\x01\x01\x42\x07\n\x05_nameB\x08\n\x06_emailB\x0f\n\r_phone_number\"%\n\x11RequestDeleteUser\x12\x10\n\x08username\x18\x01 \x01(\t\"#\n\x0fRequestUserInfo\x12\x10\n\x08username\x18\x01 \x01(\t\"_\n\x10RequestListUsers\x12\x15\n\rafter_user_id\x18\x01 \x01(\x05\x12\r\n\x05limit\x18\x02 \x01(\x05\x12\x1c\n\x04role\x18\x03 \x01(\x0e\x32\t.UserRoleH\x00\x88\x01\x01\x42\x07\n\x05_role\"-\n\x0c\x42\x61seResponse\x12\x0f\n\x07message\x18\x01 \x01(\t\x12\x0c\n\x04\x63ode\x18\x02 \x01(\x05\"\x9a\x01\n\x08UserInfo\x12\x17\n\x04role\x18\x07 \x01(\x0e\x32\t.UserRole\x12\x0f\n\x07user_id\x18\x01 \x01(\x05\x12\x10\n\x08username\x18\x02 \x01(\t\x12\x0c\n\x04name\x18\x03 \x01(\t\x12\x10\n\x08password\x18\x04 \x01(\t\x12\x12\n\x05\x65mail\x18\x05 \x01(\tH\x00\x88\x01\x01\x12\x14\n\x0cphone_number\x18\x06 \x01(\tB\x08\n\x06_email\"X\n\x10ResponseUserInfo\x12\x0f\n\x07message\x18\x01 \x01(\t\x12\x0c\n\x04\x63ode\x18\x02 \x01(\x05\x12\x1c\n\x04\x64\x61ta\x18\x03 \x01(\x0b\x32\t.UserInfoH\x00\x88\x01\x01\x42\x07\n\x05_data\"f\n\x11\x42\x61tchItemResponse\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x0c\n\x04\x63ode\x18\x02 \x01(\x05\x12\x0f\n\x07message\x18\x03 \x01(\t\x12\x14\n\x07user_id\x18\x04 \x01(\x05H\x00\x88\x01\x01\x42\n\n\x08_user_id\"S\n\rResponseBatch\x12\x0f\n\x07message\x18\x01 \x01(\t\x12\x0c\n\x04\x63ode\x18\x02 \x01(\x05\x12#\n\x07results\x18\x03 \x03(\x0b\x32\x12.BatchItemResponse*\x1f\n\x08UserRole\x12\t\n\x05\x41\x44MIN\x10\x00\x12\x08\n\x04USER\x10\x01\x32\xab\x04\n\x08\x44\x61taBase\x12\x30\n\x07GetUser\x12\x10.RequestUserInfo\x1a\x11.ResponseUserInfo\"\x00\x12+\n\x07NewUser\x12\x0f.RequestNewUser\x1a\r.BaseResponse\"\x00\x12\x41\n\x12ModifyUserPassword\x12\x1a.RequestModifyUserPassword\x1a\r.BaseResponse\"\x00\x12\x39\n\x0eModifyUserRole\x12\x16.RequestModifyUserRole\x1a\r.BaseResponse\"\x00\x12\x39\n\x0eModifyUserInfo\x12\x16.RequestModifyUserInfo\x1a\r.BaseResponse\"\x00\x12\x31\n\nDeleteUser\x12\x12.RequestDeleteUser\x1a\r.BaseResponse\"\x00\x12/\n\x08NewUsers\x12\x0f.RequestNewUser\x1a\x0e.ResponseBatch\"\x00(\x01\x12=\n\x0fModifyUsersRole\x12\x16.RequestModifyUserRole\x1a\x0e.ResponseBatch\"\x00(\x01\x12\x35\n\x0b\x44\x65leteUsers\x12\x12.RequestDeleteUser\x1a\x0e.ResponseBatch\"\x00(\x01\x12-\n\tListUsers\x12\x11.RequestListUsers\x1a\t.UserInfo\"\x00\x30\x01\x62\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'database_pb2', _globals)
 if _descriptor._USE_C_DESCRIPTORS == False:
   DESCRIPTOR._options = None
-  _globals['_USERROLE']._serialized_start=813
-  _globals['_USERROLE']._serialized_end=844
+  _globals['_USERROLE']._serialized_start=1158
+  _globals['_USERROLE']._serialized_end=1189
   _globals['_REQUESTNEWUSER']._serialized_start=19
-  _globals['_REQUESTNEWUSER']._serialized_end=162
-  _globals['_REQUESTMODIFYUSERPASSWORD']._serialized_start=164
-  _globals['_REQUESTMODIFYUSERPASSWORD']._serialized_end=227
-  _globals['_REQUESTMODIFYUSERROLE']._serialized_start=229
-  _globals['_REQUESTMODIFYUSERROLE']._serialized_end=295
-  _globals['_REQUESTMODIFYUSERINFO']._serialized_start=298
-  _globals['_REQUESTMODIFYUSERINFO']._serialized_end=441
-  _globals['_REQUESTDELETEUSER']._serialized_start=443
-  _globals['_REQUESTDELETEUSER']._serialized_end=480
-  _globals['_REQUESTUSERINFO']._serialized_start=482
-  _globals['_REQUESTUSERINFO']._serialized_end=517
-  _globals['_BASERESPONSE']._serialized_start=519
-  _globals['_BASERESPONSE']._serialized_end=564
-  _globals['_USERINFO']._serialized_start=567
-  _globals['_USERINFO']._serialized_end=721
-  _globals['_RESPONSEUSERINFO']._serialized_start=723
-  _globals['_RESPONSEUSERINFO']._serialized_end=811
-  _globals['_DATABASE']._serialized_start=847
-  _globals['_DATABASE']._serialized_end=1188
+  _globals['_REQUESTNEWUSER']._serialized_end=178
+  _globals['_REQUESTMODIFYUSERPASSWORD']._serialized_start=180
+  _globals['_REQUESTMODIFYUSERPASSWORD']._serialized_end=286
+  _globals['_REQUESTMODIFYUSERROLE']._serialized_start=288
+  _globals['_REQUESTMODIFYUSERROLE']._serialized_end=354
+  _globals['_REQUESTMODIFYUSERINFO']._serialized_start=357
+  _globals['_REQUESTMODIFYUSERINFO']._serialized_end=500
+  _globals['_REQUESTDELETEUSER']._serialized_start=502
+  _globals['_REQUESTDELETEUSER']._serialized_end=539
+  _globals['_REQUESTUSERINFO']._serialized_start=541
+  _globals['_REQUESTUSERINFO']._serialized_end=576
+  _globals['_REQUESTLISTUSERS']._serialized_start=578
+  _globals['_REQUESTLISTUSERS']._serialized_end=673
+  _globals['_BASERESPONSE']._serialized_start=675
+  _globals['_BASERESPONSE']._serialized_end=720
+  _globals['_USERINFO']._serialized_start=723
+  _globals['_USERINFO']._serialized_end=877
+  _globals['_RESPONSEUSERINFO']._serialized_start=879
+  _globals['_RESPONSEUSERINFO']._serialized_end=967
+  _globals['_BATCHITEMRESPONSE']._serialized_start=969
+  _globals['_BATCHITEMRESPONSE']._serialized_end=1071
+  _globals['_RESPONSEBATCH']._serialized_start=1073
+  _globals['_RESPONSEBATCH']._serialized_end=1156
+  _globals['_DATABASE']._serialized_start=1192
+  _globals['_DATABASE']._serialized_end=1747
 # @@protoc_insertion_point(module_scope)
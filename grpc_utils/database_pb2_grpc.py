@@ -44,6 +44,26 @@ class DataBaseStub(object):
                 request_serializer=database__pb2.RequestDeleteUser.SerializeToString,
                 response_deserializer=database__pb2.BaseResponse.FromString,
                 )
+        self.NewUsers = channel.stream_unary(
+                '/DataBase/NewUsers',
+                request_serializer=database__pb2.RequestNewUser.SerializeToString,
+                response_deserializer=database__pb2.ResponseBatch.FromString,
+                )
+        self.ModifyUsersRole = channel.stream_unary(
+                '/DataBase/ModifyUsersRole',
+                request_serializer=database__pb2.RequestModifyUserRole.SerializeToString,
+                response_deserializer=database__pb2.ResponseBatch.FromString,
+                )
+        self.DeleteUsers = channel.stream_unary(
+                '/DataBase/DeleteUsers',
+                request_serializer=database__pb2.RequestDeleteUser.SerializeToString,
+                response_deserializer=database__pb2.ResponseBatch.FromString,
+                )
+        self.ListUsers = channel.unary_stream(
+                '/DataBase/ListUsers',
+                request_serializer=database__pb2.RequestListUsers.SerializeToString,
+                response_deserializer=database__pb2.UserInfo.FromString,
+                )
 
 
 class DataBaseServicer(object):
@@ -85,6 +105,30 @@ class DataBaseServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def NewUsers(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def ModifyUsersRole(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def DeleteUsers(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def ListUsers(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_DataBaseServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -118,6 +162,26 @@ def add_DataBaseServicer_to_server(servicer, server):
                     request_deserializer=database__pb2.RequestDeleteUser.FromString,
                     response_serializer=database__pb2.BaseResponse.SerializeToString,
             ),
+            'NewUsers': grpc.stream_unary_rpc_method_handler(
+                    servicer.NewUsers,
+                    request_deserializer=database__pb2.RequestNewUser.FromString,
+                    response_serializer=database__pb2.ResponseBatch.SerializeToString,
+            ),
+            'ModifyUsersRole': grpc.stream_unary_rpc_method_handler(
+                    servicer.ModifyUsersRole,
+                    request_deserializer=database__pb2.RequestModifyUserRole.FromString,
+                    response_serializer=database__pb2.ResponseBatch.SerializeToString,
+            ),
+            'DeleteUsers': grpc.stream_unary_rpc_method_handler(
+                    servicer.DeleteUsers,
+                    request_deserializer=database__pb2.RequestDeleteUser.FromString,
+                    response_serializer=database__pb2.ResponseBatch.SerializeToString,
+            ),
+            'ListUsers': grpc.unary_stream_rpc_method_handler(
+                    servicer.ListUsers,
+                    request_deserializer=database__pb2.RequestListUsers.FromString,
+                    response_serializer=database__pb2.UserInfo.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'DataBase', rpc_method_handlers)
@@ -229,3 +293,71 @@ class DataBase(object):
             database__pb2.BaseResponse.FromString,
             options, channel_credentials,
             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def NewUsers(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_unary(request_iterator, target, '/DataBase/NewUsers',
+            database__pb2.RequestNewUser.SerializeToString,
+            database__pb2.ResponseBatch.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def ModifyUsersRole(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_unary(request_iterator, target, '/DataBase/ModifyUsersRole',
+            database__pb2.RequestModifyUserRole.SerializeToString,
+            database__pb2.ResponseBatch.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def DeleteUsers(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_unary(request_iterator, target, '/DataBase/DeleteUsers',
+            database__pb2.RequestDeleteUser.SerializeToString,
+            database__pb2.ResponseBatch.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def ListUsers(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(request, target, '/DataBase/ListUsers',
+            database__pb2.RequestListUsers.SerializeToString,
+            database__pb2.UserInfo.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
@@ -0,0 +1,170 @@
+from logging.handlers import QueueHandler, QueueListener
+import threading
+import logging
+import atexit
+import random
+import queue
+import os
+
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'DEBUG').upper()
+LOG_LEVELS = os.getenv('LOG_LEVELS', '')
+LOG_DIR = os.getenv('LOG_DIR', '.')
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', 1))
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s | %(message)s'
+
+
+def _parse_levels(value: str) -> dict:
+    """`LOG_LEVELS` looks like `user_router.log=DEBUG,cache_tiered.log=WARNING`"""
+
+    levels = {}
+    for item in value.split(','):
+        if '=' in item:
+            name, level = item.split('=', 1)
+            levels[name.strip()] = level.strip().upper()
+
+    return levels
+
+
+class DebugSampler(logging.Filter):
+    """Lets through only a random `rate` share of DEBUG records"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno != logging.DEBUG or self.rate >= 1 or random.random() < self.rate
+
+
+class NameFilter(logging.Filter):
+    """Exact logger name match, unlike logging.Filter which also matches children"""
+
+    def filter(self, record):
+        return record.name == self.name
+
+
+class ExcludeFilter(logging.Filter):
+    """Drops records of the loggers kept off a handler"""
+
+    def __init__(self):
+        super().__init__()
+        self.names = set()
+
+    def filter(self, record):
+        return record.name not in self.names
+
+
+# args the listener thread can merge later, they can't change meanwhile
+IMMUTABLE_ARGS = (str, int, float, bool, bytes, type(None))
+
+
+class DeferredQueueHandler(QueueHandler):
+    """Enqueues records without formatting them, the listener thread does
+    the `%` merge and the I/O. A record with a mutable arg is merged right
+    away instead, so it logs the state at call time. Records are dropped
+    instead of blocking the caller when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        if record.args and not all(isinstance(arg, IMMUTABLE_ARGS) for arg in (
+                record.args.values() if isinstance(record.args, dict) else record.args)):
+            record.msg = record.getMessage()
+            record.args = None
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogSystem:
+
+    def __init__(self):
+        self.queue = queue.Queue(LOG_QUEUE_SIZE)
+        self.handler = DeferredQueueHandler(self.queue)
+        self.handler.addFilter(DebugSampler(LOG_DEBUG_SAMPLE_RATE))
+        self.levels = _parse_levels(LOG_LEVELS)
+        self.formatter = logging.Formatter(LOG_FORMAT)
+        self._lock = threading.Lock()
+        self._files = {}
+
+        self.console_filter = ExcludeFilter()
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(self.formatter)
+        console_handler.addFilter(self.console_filter)
+        self.listener = QueueListener(self.queue, console_handler, respect_handler_level=True)
+        self._started = False
+
+    def level_for(self, name: str) -> int:
+        return logging.getLevelName(self.levels.get(name, LOG_LEVEL))
+
+    def add_file(self, name: str, filename: str, fmt: str = None):
+
+        with self._lock:
+            if name in self._files:
+                return
+
+            file_handler = logging.FileHandler(os.path.join(LOG_DIR, filename))
+            file_handler.setFormatter(logging.Formatter(fmt) if fmt else self.formatter)
+            file_handler.addFilter(NameFilter(name))
+            self._files[name] = file_handler
+            # the listener thread reads this tuple on every record, swapping it is safe
+            self.listener.handlers = self.listener.handlers + (file_handler,)
+
+    def start(self):
+        with self._lock:
+            if not self._started:
+                self.listener.start()
+                self._started = True
+                atexit.register(self.stop)
+
+    def stop(self):
+        with self._lock:
+            if self._started:
+                self.listener.stop()
+                self._started = False
+
+    def stats(self):
+        return {
+            'queued': self.queue.qsize(),
+            'queue_size': LOG_QUEUE_SIZE,
+            'dropped': self.handler.dropped,
+            'debug_sample_rate': LOG_DEBUG_SAMPLE_RATE
+        }
+
+
+log_system = LogSystem()
+
+
+def get_logger(name: str, filename: str = None, fmt: str = None, console: bool = True) -> logging.Logger:
+    """Logger whose records are written by a background thread, to the
+    console unless `console` is false and optionally to `filename` under
+    LOG_DIR with its own `fmt`"""
+
+    logger = logging.getLogger(name)
+    logger.setLevel(log_system.level_for(name))
+    logger.propagate = False
+
+    if log_system.handler not in logger.handlers:
+        logger.addHandler(log_system.handler)
+
+    if not console:
+        log_system.console_filter.names.add(name)
+
+    if filename:
+        log_system.add_file(name, filename, fmt)
+
+    log_system.start()
+    return logger
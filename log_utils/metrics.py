@@ -0,0 +1,80 @@
+from prometheus_client import (
+    CollectorRegistry,
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess
+)
+import os
+
+
+# read by prometheus_client itself at import time, every uvicorn worker then
+# writes its samples to files in this directory and /metrics merges them
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+FAST_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5)
+STAGE_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5)
+
+HTTP_REQUESTS = Counter(
+    'http_requests_total', 'HTTP requests', ['method', 'route', 'status']
+)
+HTTP_LATENCY = Histogram(
+    'http_request_duration_seconds', 'HTTP request latency', ['method', 'route']
+)
+GRPC_LATENCY = Histogram(
+    'grpc_client_duration_seconds', 'gRPC call latency to the database service',
+    ['method', 'status', 'code'], buckets= FAST_BUCKETS
+)
+REDIS_LATENCY = Histogram(
+    'redis_command_duration_seconds', 'Redis round trip latency of cache operations',
+    ['namespace', 'command'], buckets= FAST_BUCKETS
+)
+STAGE_LATENCY = Histogram(
+    'request_stage_duration_seconds', 'Latency of the timed request stages (bcrypt.verify, jwt_decode, redis.*, ...)',
+    ['stage'], buckets= STAGE_BUCKETS
+)
+GRPC_BREAKER_TRANSITIONS = Counter(
+    'grpc_breaker_transitions_total', 'Circuit breaker state changes per gRPC method', ['method', 'state']
+)
+GRPC_BREAKER_REJECTED = Counter(
+    'grpc_breaker_rejected_total', 'gRPC calls failed fast by an open circuit breaker', ['method']
+)
+GRPC_RETRIES = Counter(
+    'grpc_client_retries_total', 'gRPC retries and hedges, sent or denied by the retry budget',
+    ['method', 'kind', 'result']
+)
+GRPC_COALESCED = Counter(
+    'grpc_client_coalesced_total', 'gRPC calls answered by an identical call already in flight', ['method']
+)
+LOGIN_THROTTLED = Counter(
+    'login_throttled_total', 'Logins rejected before the password check', ['reason']
+)
+PASSWORD_REHASHES = Counter(
+    'password_rehashes_total', 'Background rehashes of passwords stored with an outdated bcrypt cost',
+    ['result']
+)
+CACHE_LOOKUPS = Counter(
+    'cache_lookups_total', 'Cache lookups by result, hit ratio = hit / (hit + miss)',
+    ['cache', 'result']
+)
+
+
+def render() -> tuple:
+    """Exposition payload and its content type, merged across workers in multiprocess mode"""
+
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+
+    else:
+        registry = REGISTRY
+
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def shutdown():
+
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
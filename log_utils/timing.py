@@ -0,0 +1,131 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from log_utils.logger import get_logger
+from log_utils.metrics import HTTP_REQUESTS, HTTP_LATENCY, GRPC_LATENCY, STAGE_LATENCY
+from log_utils.tracing import tracer
+from typing import Optional
+import functools
+import asyncio
+import time
+import json
+import os
+
+
+ACCESS_LOG_ENABLED = os.getenv('ACCESS_LOG_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+access_logger = get_logger('access.log', 'access.log', fmt='%(message)s', console=False)
+
+
+class RequestTimings:
+    """Per request accumulator of stage durations (ms) and gRPC outcomes"""
+
+    def __init__(self):
+        self.stages = {}
+        self.grpc = []
+
+    def add(self, name: str, elapsed: float):
+        self.stages[name] = round(self.stages.get(name, 0) + elapsed * 1000, 3)
+
+
+_timings: ContextVar[Optional[RequestTimings]] = ContextVar('request_timings', default=None)
+
+
+@contextmanager
+def stage(name: str):
+
+    start = time.perf_counter()
+    try:
+        with tracer.start_as_current_span(name):
+            yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY.labels(name).observe(elapsed)
+
+        timings = _timings.get()
+        if timings is not None:
+            timings.add(name, elapsed)
+
+
+def timed(name: str):
+    """Decorator form of `stage` for sync and async functions"""
+
+    def decorator(func):
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def record_grpc(method: str, elapsed: float, status: str, code: Optional[int]):
+
+    GRPC_LATENCY.labels(method, status, str(code) if code is not None else '').observe(elapsed)
+
+    timings = _timings.get()
+    if timings is None:
+        return
+
+    timings.add(f'grpc.{method}', elapsed)
+    timings.grpc.append({'method': method, 'status': status, 'code': code, 'ms': round(elapsed * 1000, 3)})
+
+
+class RequestTimingMiddleware:
+    """Records the HTTP metrics of every request and, unless disabled, emits
+    one JSON access log line with the per-stage breakdown collected through
+    `stage`, `timed` and `record_grpc`"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        timings = RequestTimings()
+        token = _timings.set(timings)
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+
+        finally:
+            duration = (time.perf_counter() - start) * 1000
+            _timings.reset(token)
+            # the route template keeps the label set bounded, unlike the raw path
+            route = getattr(scope.get('route'), 'path', None)
+
+            HTTP_REQUESTS.labels(scope['method'], route or 'unmatched', str(status_code)).inc()
+            HTTP_LATENCY.labels(scope['method'], route or 'unmatched').observe(duration / 1000)
+
+            if ACCESS_LOG_ENABLED:
+                access_logger.info('%s', json.dumps({
+                    'ts': round(time.time(), 3),
+                    'method': scope['method'],
+                    'path': scope['path'],
+                    'route': route,
+                    'status': status_code,
+                    'duration_ms': round(duration, 3),
+                    'stages': timings.stages,
+                    'unaccounted_ms': round(duration - sum(timings.stages.values()), 3),
+                    'grpc': timings.grpc
+                }))
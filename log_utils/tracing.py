@@ -0,0 +1,155 @@
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter, SpanExporter, SpanExportResult
+from opentelemetry.sdk.trace.sampling import Sampler, ParentBased, TraceIdRatioBased
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.trace import SpanKind, Status, StatusCode
+from opentelemetry import trace, propagate
+from log_utils.logger import LOG_DIR
+import threading
+import os
+
+
+OTEL_TRACES_EXPORTER = os.getenv('OTEL_TRACES_EXPORTER', 'none').lower()
+OTEL_SERVICE_NAME = os.getenv('OTEL_SERVICE_NAME', 'api-user-management')
+TRACE_FILE = os.getenv('TRACE_FILE', 'traces.jsonl')
+TRACE_SAMPLE_RATIO = float(os.getenv('TRACE_SAMPLE_RATIO', 1))
+TRACE_SAMPLE_RATIOS = os.getenv('TRACE_SAMPLE_RATIOS', '')
+
+# resolves to the no-op tracer until `startup` installs the sdk provider
+tracer = trace.get_tracer('user-management')
+
+
+def _parse_ratios(value: str) -> dict:
+    """`TRACE_SAMPLE_RATIOS` looks like `/user/info=0.01,/auth/login=0.5`"""
+
+    ratios = {}
+    for item in value.split(','):
+        if '=' in item:
+            path, ratio = item.split('=', 1)
+            ratios[path.strip()] = float(ratio)
+
+    return ratios
+
+
+class RouteSampler(Sampler):
+    """Trace id ratio sampling of root spans with a ratio per request path"""
+
+    def __init__(self, default: float, ratios: dict):
+        self._default = TraceIdRatioBased(default)
+        self._routes = {path: TraceIdRatioBased(ratio) for path, ratio in ratios.items()}
+
+    def should_sample(self, parent_context, trace_id, name, kind=None, attributes=None, links=None, trace_state=None):
+
+        sampler = self._routes.get((attributes or {}).get('url.path'), self._default)
+        return sampler.should_sample(parent_context, trace_id, name, kind, attributes, links, trace_state)
+
+    def get_description(self):
+        return f'RouteSampler{{default={self._default.rate}, routes={len(self._routes)}}}'
+
+
+class FileSpanExporter(SpanExporter):
+    """Appends every finished span as one JSON line"""
+
+    def __init__(self, filename: str):
+        self._file = open(filename, 'a')
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        with self._lock:
+            for span in spans:
+                self._file.write(span.to_json(indent=None) + '\n')
+            self._file.flush()
+
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self):
+        with self._lock:
+            self._file.close()
+
+
+def _exporter():
+
+    if OTEL_TRACES_EXPORTER == 'otlp':
+        # endpoint, headers and timeout come from the standard OTEL_EXPORTER_OTLP_* variables
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        return OTLPSpanExporter()
+
+    if OTEL_TRACES_EXPORTER == 'file':
+        return FileSpanExporter(os.path.join(LOG_DIR, TRACE_FILE))
+
+    if OTEL_TRACES_EXPORTER == 'console':
+        return ConsoleSpanExporter()
+
+    return None
+
+
+_provider = None
+
+
+def startup():
+
+    global _provider
+
+    exporter = _exporter()
+    if exporter is None or _provider is not None:
+        return
+
+    _provider = TracerProvider(
+        resource= Resource.create({'service.name': OTEL_SERVICE_NAME}),
+        sampler= ParentBased(RouteSampler(TRACE_SAMPLE_RATIO, _parse_ratios(TRACE_SAMPLE_RATIOS)))
+    )
+    _provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(_provider)
+
+
+def shutdown():
+
+    if _provider is not None:
+        _provider.shutdown()
+
+
+def inject(metadata) -> list:
+    """`metadata` pairs extended with the trace context of the current span"""
+
+    carrier = {}
+    propagate.inject(carrier)
+    return [*(metadata or ()), *carrier.items()]
+
+
+class TracingMiddleware:
+    """Opens the server span of every HTTP request, continuing the trace of
+    an incoming `traceparent` header"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        carrier = {key.decode('latin-1'): value.decode('latin-1') for key, value in scope['headers']}
+        attributes = {'http.request.method': scope['method'], 'url.path': scope['path']}
+
+        with tracer.start_as_current_span(
+            f"{scope['method']} {scope['path']}",
+            context= propagate.extract(carrier),
+            kind= SpanKind.SERVER,
+            attributes= attributes
+        ) as span:
+
+            async def send_wrapper(message):
+                if message['type'] == 'http.response.start' and span.is_recording():
+                    span.set_attribute('http.response.status_code', message['status'])
+                    if message['status'] >= 500:
+                        span.set_status(Status(StatusCode.ERROR))
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+
+            finally:
+                route = getattr(scope.get('route'), 'path', None)
+                if route and span.is_recording():
+                    span.set_attribute('http.route', route)
+                    span.update_name(f"{scope['method']} {route}")
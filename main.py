@@ -2,10 +2,25 @@
 
 # load_dotenv()
 
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from database_service import session as grpc_session
+from cache import session as cache_session
+from cache.invalidation import invalidator
+from cache.usernames import username_bloom
+from cache.denylist import token_denylist
+from database_service.aio_functions import list_usernames
+from log_utils.logger import get_logger
+from auth.auth import hash_pool, configure_bcrypt
+from log_utils.timing import RequestTimingMiddleware
+from log_utils import metrics, tracing
+from log_utils.tracing import TracingMiddleware
 from router import (
     auth,
-    user
+    user,
+    health,
+    jwks,
+    metrics as metrics_router
 )
 
 
@@ -19,6 +34,31 @@ This is a simple service for managing users that connects to the database servic
 * Edit information 
 """
 
+logger = get_logger('main.log')
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+
+    tracing.startup()
+    await cache_session.startup()
+    await configure_bcrypt(cache_session.aio_session.redis_db)
+    invalidator.start()
+    await token_denylist.start(cache_session.aio_session.redis_db)
+    username_bloom.start(lambda: list_usernames('username bloom', grpc_session.aio_session.stub, logger), cache_session.aio_session.redis_db)
+
+    yield
+
+    await username_bloom.stop()
+    await token_denylist.stop()
+    await invalidator.stop()
+    await grpc_session.aio_session.close()
+    await cache_session.shutdown()
+    hash_pool.shutdown()
+    metrics.shutdown()
+    tracing.shutdown()
+
+
 app = FastAPI(    
     title="User-Management",
     description=description,
@@ -29,7 +69,14 @@ app = FastAPI(
     },
     license_info={
         "name": "MIT"
-    },) 
+    },
+    lifespan=lifespan) 
+
+app.add_middleware(RequestTimingMiddleware)
+app.add_middleware(TracingMiddleware)
 
 app.include_router(user.router)
 app.include_router(auth.router)
+app.include_router(health.router)
+app.include_router(jwks.router)
+app.include_router(metrics_router.router)
@@ -1,41 +1,88 @@
-from fastapi import Depends, HTTPException, status, APIRouter
-from auth.auth import verify_password, create_access_token
+from fastapi import Depends, HTTPException, status, APIRouter, BackgroundTasks, Request
+from auth.auth import verify_password_async, hash_password_async, password_needs_update, create_access_token
 from fastapi.security import OAuth2PasswordRequestForm
 from grpc_utils.database_pb2_grpc import DataBaseStub
-from database_service.functions import get_user
-from database_service.session import get_grpc
-from grpc._channel import _InactiveRpcError
-from cache.session import get_redis_cache
+from database_service.aio_functions import get_user, edit_user_password
+from database_service.session import get_aio_grpc
+from cache.session import get_aio_redis_cache
 import grpc_utils.database_pb2 as pb2
-from cache.functions import set_token
+from cache.aio_functions import set_token
+from cache.ratelimit import login_limiter
+from cache.denylist import server_time
 from schemas import Token, HTTPError
 from datetime import datetime, timedelta
 from typing import Annotated
-from redis import Redis
-import logging
+from redis.asyncio import Redis
+from log_utils.logger import get_logger
+from log_utils.metrics import PASSWORD_REHASHES
+import math
+import os
 
-# Create a file handler to save logs to a file
-logger = logging.getLogger('auth_router.log') 
-logger.setLevel(logging.DEBUG)
+LOGIN_CLIENT_IP_HEADER = os.getenv('LOGIN_CLIENT_IP_HEADER')
 
-file_handler = logging.FileHandler('auth_router.log') 
-file_handler.setLevel(logging.DEBUG) 
-formatter = logging.Formatter('%(asctime)s - %(levelname)s | %(message)s') 
-file_handler.setFormatter(formatter) 
-logger.addHandler(file_handler) 
-
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s - %(levelname)s | %(message)s')
-console_handler.setFormatter(formatter)
-logger.addHandler(console_handler)
+logger = get_logger('auth_router.log', 'auth_router.log')
 
 router = APIRouter(prefix='/auth', tags=['Auth'])
 
-@router.post("/login", response_model=Token, responses= {401:{'model':HTTPError}, 500:{'model':HTTPError}})
-async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], stub: DataBaseStub= Depends(get_grpc), cache_db: Redis= Depends(get_redis_cache)):
+def client_ip(request: Request) -> str:
+
+    if LOGIN_CLIENT_IP_HEADER:
+        forwarded = request.headers.get(LOGIN_CLIENT_IP_HEADER)
+        if forwarded:
+            # the last hop is the one added by our own proxy, earlier ones are client controlled
+            return forwarded.split(',')[-1].strip()
+
+    return request.client.host if request.client else 'unknown'
+
+
+# usernames with a rehash in flight in this worker, so a burst of logins sends one update
+_rehashing = set()
+
+
+async def rehash_password(username: str, plain_password: str, verified_hash: str, stub: DataBaseStub, cache_db: Redis):
+    """Replaces `verified_hash` only, a password changed since the login
+    verified it must not be overwritten with the old one"""
+
+    if username in _rehashing:
+        return
+
+    _rehashing.add(username)
+    try:
+        resp_user, err = await get_user(username, username, stub, logger, 'rehash', cache_db, with_password= True)
+        if err:
+            raise err
+
+        if resp_user['password'] != verified_hash:
+            PASSWORD_REHASHES.labels('skipped').inc()
+            logger.info('[login] Rehash skipped, the password changed since the login [username: %s]', username)
+            return
+
+        new_password = {
+            'username': username,
+            'password': await hash_password_async(plain_password),
+            'hashed': True,
+            # the database service refuses the update if it changed since the read above
+            'expected_password': verified_hash
+        }
+        _, err = await edit_user_password(username, new_password, stub, logger, cache_db)
+        if err:
+            raise err
+
+    except HTTPException as e:
+        PASSWORD_REHASHES.labels('failed').inc()
+        logger.warning('[login] Rehash failed [username: %s -detail: %s]', username, e.detail)
+
+    else:
+        PASSWORD_REHASHES.labels('done').inc()
+        logger.info('[login] Password rehashed [username: %s]', username)
+
+    finally:
+        _rehashing.discard(username)
+
+@router.post("/login", response_model=Token, responses= {401:{'model':HTTPError}, 429:{'model':HTTPError}, 500:{'model':HTTPError}, 503:{'model':HTTPError}})
+async def login_for_access_token(request: Request, form_data: Annotated[OAuth2PasswordRequestForm, Depends()], background_tasks: BackgroundTasks, stub: DataBaseStub= Depends(get_aio_grpc), cache_db: Redis= Depends(get_aio_redis_cache)):
     
-    logger.debug(f'[login] Receive a login request [username: {form_data.username} -scopes: {form_data.scopes}]')
+    logger.debug('[login] Receive a login request [username: %s -scopes: %s]', form_data.username, form_data.scopes)
     
     if form_data.scopes and 'ADMIN' in form_data.scopes :
         scopes = ['ADMIN', 'USER']
@@ -45,24 +92,36 @@ async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm,
 
     else : 
 
-        logger.debug(f'[login] Reject request due a Unkown Scopes [username: {form_data.username} -scopes: {form_data.scopes}]')
+        logger.debug('[login] Reject request due a Unkown Scopes [username: %s -scopes: %s]', form_data.username, form_data.scopes)
         raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail= {'code': 2001, 'message': "Unkown Scopes"},
         )
 
-    resp_user, err = get_user(form_data.username, form_data.username, stub, logger, 'login')
+    # checked before anything costly, a throttled attempt never reaches grpc or bcrypt
+    allowed, retry_after, locked = await login_limiter.acquire(form_data.username, client_ip(request), cache_db)
+    if not allowed:
+        logger.debug('[login] Throttled [username: %s -locked: %s -retry_after: %s]', form_data.username, locked, retry_after)
+        raise HTTPException(
+            status_code= status.HTTP_429_TOO_MANY_REQUESTS,
+            detail= {'code': 2420, 'message': 'Account is temporarily locked'} if locked else {'code': 2419, 'message': 'Too many login attempts'},
+            headers= {'Retry-After': str(max(1, math.ceil(retry_after)))}
+        )
+
+    resp_user, err = await get_user(form_data.username, form_data.username, stub, logger, 'login', cache_db, with_password= True)
     if err:
         raise err
     
     if resp_user['role'] not in scopes:
-        logger.debug(f'[login] Not enough permissions [username: {form_data.username}]')
+        logger.debug('[login] Not enough permissions [username: %s]', form_data.username)
         raise HTTPException(status_code= status.HTTP_401_UNAUTHORIZED, detail= {'code': 2409, 'message': 'Not enough permissions'})
 
-    check_password = verify_password(form_data.password, resp_user['password'] )
+    check_password = await verify_password_async(form_data.password, resp_user['password'] )
 
     if not check_password:
-        logger.debug(f'[login] Incorrect username or password [username: {form_data.username}]')
+        logger.debug('[login] Incorrect username or password [username: %s]', form_data.username)
+        if await login_limiter.failed(form_data.username, cache_db):
+            logger.warning('[login] Username locked after repeated wrong passwords [username: %s]', form_data.username)
         raise HTTPException(status_code= status.HTTP_401_UNAUTHORIZED, detail= {'code': 2408, 'message': "Incorrect username or password"})
     
     access_token = create_access_token(
@@ -71,11 +130,19 @@ async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm,
             'username': resp_user['username'],
             'role': resp_user['role'],
             'exp': datetime.utcnow() + timedelta(days=7),
+            # checked against the denylist, a revocation only hits tokens issued before it;
+            # both are stamped by the redis clock
+            'iat': await server_time(cache_db),
             "scopes": scopes
             }
     )
 
-    set_token(resp_user['user_id'], access_token, cache_db)
+    await set_token(resp_user['user_id'], access_token, cache_db)
+    await login_limiter.succeeded(form_data.username, cache_db)
+
+    # runs after the response is sent, the plain password is only available here
+    if password_needs_update(resp_user['password']):
+        background_tasks.add_task(rehash_password, resp_user['username'], form_data.password, resp_user['password'], stub, cache_db)
     
     return {"access_token": access_token, "token_type": "bearer"}
 
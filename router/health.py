@@ -0,0 +1,50 @@
+from fastapi import APIRouter
+from cache import session as cache_session
+from database_service import session as grpc_session, resilience
+from database_service.singleflight import user_flight
+from auth import auth as auth_module
+from auth.auth import hash_pool, token_cache, signing_keys
+from cache.profile import profile_cache
+from cache.usernames import missing_cache, username_bloom
+from cache.functions import token_store
+from cache.denylist import token_denylist
+from cache.invalidation import invalidator
+from log_utils.logger import log_system
+
+
+router = APIRouter(prefix='/health', tags=['Health'])
+
+@router.get('/cache')
+def get_cache_stats():
+
+    return {**cache_session.pool_stats(), 'invalidation': invalidator.stats()}
+
+
+@router.get('/grpc')
+def get_grpc_stats():
+
+    return {**grpc_session.pool_stats(), **resilience.stats(), 'coalescing': {'GetUser': user_flight.stats()}}
+
+
+@router.get('/hash-pool')
+def get_hash_pool_stats():
+
+    return {**hash_pool.stats(), 'bcrypt_rounds': auth_module.bcrypt_rounds}
+
+
+@router.get('/token-cache')
+def get_token_cache_stats():
+
+    return {'jwt': token_cache.stats(), 'store': token_store.stats(), 'denylist': token_denylist.stats(), 'keys': signing_keys.stats()}
+
+
+@router.get('/user-cache')
+def get_user_cache_stats():
+
+    return {**profile_cache.stats(), 'missing': missing_cache.stats(), 'bloom': username_bloom.stats()}
+
+
+@router.get('/logging')
+def get_logging_stats():
+
+    return log_system.stats()
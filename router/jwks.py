@@ -0,0 +1,19 @@
+from fastapi import APIRouter, Request, Response
+from auth.auth import signing_keys
+import os
+
+
+OAUTH2_JWKS_MAX_AGE = int(os.getenv('OAUTH2_JWKS_MAX_AGE', 300))
+
+
+router = APIRouter(tags=['Auth'])
+
+@router.get('/.well-known/jwks.json')
+def get_jwks(request: Request):
+
+    headers = {'ETag': signing_keys.etag, 'Cache-Control': f'public, max-age={OAUTH2_JWKS_MAX_AGE}'}
+
+    if signing_keys.etag in [tag.strip() for tag in request.headers.get('if-none-match', '').split(',')]:
+        return Response(status_code= 304, headers= headers)
+
+    return Response(content= signing_keys.jwks, media_type= 'application/json', headers= headers)
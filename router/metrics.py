@@ -0,0 +1,11 @@
+from fastapi import APIRouter, Response
+from log_utils import metrics
+
+
+router = APIRouter(tags=['Metrics'])
+
+@router.get('/metrics', include_in_schema= False)
+def get_metrics():
+
+    content, content_type = metrics.render()
+    return Response(content= content, headers= {'Content-Type': content_type})
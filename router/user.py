@@ -1,9 +1,10 @@
 from grpc_utils.database_pb2_grpc import DataBaseStub
 from auth.auth import get_normal_user, get_admin_user
-from database_service.session import get_grpc
-from auth.auth import verify_password
-from cache.functions import del_token
-from cache.session import get_redis_cache
+from database_service.session import get_grpc, get_aio_grpc
+from auth.auth import verify_password_pooled, password_fields, passwords_fields
+from cache.functions import revoke_tokens
+from cache.aio_functions import revoke_tokens as arevoke_tokens
+from cache.session import get_redis_cache, get_aio_redis_cache
 from database_service.functions import (
     get_user,
     create_user,
@@ -12,12 +13,22 @@ from database_service.functions import (
     delete_user_target,
     edit_user_role
 )
+from database_service.aio_functions import (
+    get_user as aget_user,
+    create_users,
+    edit_users_role,
+    delete_users_target,
+    list_users
+)
 from fastapi import (
     APIRouter,
     Depends,
     HTTPException,
+    Request,
+    Query,
     status
 )
+from fastapi.responses import StreamingResponse
 from schemas import (
     BaseResponse,
     UserRegister,
@@ -27,75 +38,79 @@ from schemas import (
     UserInfoResponse,
     UserUpdateRole,
     UserDelete,
-    TokenUser
+    TokenUser,
+    BatchItemResult,
+    BatchResponse,
+    UserListResponse,
+    UserRole,
+    TokenRevoke
 )
-import logging
-
+from typing import Optional, Union
+from pydantic import ValidationError
+from redis import Redis
+import redis.asyncio as aioredis
+from log_utils.logger import get_logger
+from log_utils.timing import stage
+import asyncio
+import json
+import os
 
-# Create a file handler to save logs to a file
-logger = logging.getLogger('user_router.log') 
-logger.setLevel(logging.DEBUG)
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', 1000))
+LIST_MAX_LIMIT = int(os.getenv('LIST_MAX_LIMIT', 500))
+BATCH_LOOKUP_CONCURRENCY = int(os.getenv('BATCH_LOOKUP_CONCURRENCY', 50))
 
-file_handler = logging.FileHandler('user_router.log') 
-file_handler.setLevel(logging.DEBUG) 
-formatter = logging.Formatter('%(asctime)s - %(levelname)s | %(message)s') 
-file_handler.setFormatter(formatter) 
-logger.addHandler(file_handler) 
 
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s - %(levelname)s | %(message)s')
-console_handler.setFormatter(formatter)
-logger.addHandler(console_handler)
+logger = get_logger('user_router.log', 'user_router.log')
 
 
 router = APIRouter(prefix='/user', tags=['User'])
 
 @router.get('/info', response_model= UserInfoResponse, responses= {404:{'model':HTTPError}, 500:{'model':HTTPError}} )
-def get_user_information(current_user: TokenUser= Depends(get_normal_user), stub: DataBaseStub = Depends(get_grpc)):
+def get_user_information(current_user: TokenUser= Depends(get_normal_user), stub: DataBaseStub = Depends(get_grpc), cache_db: Redis= Depends(get_redis_cache)):
 
-    logger.debug(f'[info] Receive a get_user_informaion request [username: {current_user.username}]')
+    logger.debug('[info] Receive a get_user_informaion request [username: %s]', current_user.username)
 
-    resp ,err = get_user(current_user.username, current_user.username, stub, logger, 'info')
+    resp ,err = get_user(current_user.username, current_user.username, stub, logger, 'info', cache_db)
     if err:
         raise err
     
-    return UserInfoResponse(**resp)
+    with stage('serialize'):
+        return UserInfoResponse(**resp)
 
 
-@router.post('/new', response_model= BaseResponse, responses= {500:{'model':HTTPError}, 409:{'model':HTTPError}} )
-def create_new_user(request: UserRegister, current_user: TokenUser= Depends(get_admin_user), stub: DataBaseStub = Depends(get_grpc)):
+@router.post('/new', response_model= BaseResponse, responses= {500:{'model':HTTPError}, 409:{'model':HTTPError}, 503:{'model':HTTPError}} )
+def create_new_user(request: UserRegister, current_user: TokenUser= Depends(get_admin_user), stub: DataBaseStub = Depends(get_grpc), cache_db: Redis= Depends(get_redis_cache)):
 
-    logger.debug(f'[new] Receive a create_new_user request [caller: {current_user.username} -new_username: {request.username}]')
+    logger.debug('[new] Receive a create_new_user request [caller: %s -new_username: %s]', current_user.username, request.username)
 
-    resp, _ = get_user(current_user.username, request.username, stub, logger, 'new')
+    resp, _ = get_user(current_user.username, request.username, stub, logger, 'new', cache_db)
     if resp:
         raise HTTPException(status_code= status.HTTP_409_CONFLICT, detail={'message': 'Username already exists', 'code': 2403})
 
     user_data = {
         'username': request.username,
-        'password': request.password,
         'name': request.name,
         'email': request.email,
         'phone_number': request.phone_number,
-        'role': request.role
+        'role': request.role,
+        **password_fields(request.password)
     }
 
-    resp ,err = create_user(current_user.username, user_data, stub, logger)
+    resp ,err = create_user(current_user.username, user_data, stub, logger, cache_db)
     if err:
         raise err
 
-    logger.info(f'[new] create new user was successfully [username: {current_user.username}]')
+    logger.info('[new] create new user was successfully [username: %s]', current_user.username)
 
     return BaseResponse(**resp)
 
 
 @router.put('/info/edit', response_model= BaseResponse, responses= {500:{'model':HTTPError}, 404:{'model':HTTPError}} )
-def edit_user_information(request: UserUpdateInfo, current_user: TokenUser= Depends(get_normal_user), stub: DataBaseStub = Depends(get_grpc)):
+def edit_user_information(request: UserUpdateInfo, current_user: TokenUser= Depends(get_normal_user), stub: DataBaseStub = Depends(get_grpc), cache_db: Redis= Depends(get_redis_cache)):
 
-    logger.debug(f'[edit info] Receive a edit_user_information request [username: {current_user.username}]')
+    logger.debug('[edit info] Receive a edit_user_information request [username: %s]', current_user.username)
 
-    resp_user, err = get_user(current_user.username, current_user.username, stub, logger, 'edit info')
+    resp_user, err = get_user(current_user.username, current_user.username, stub, logger, 'edit info', cache_db)
     if err:
         raise err
 
@@ -116,46 +131,46 @@ def edit_user_information(request: UserUpdateInfo, current_user: TokenUser= Depe
         'phone_number': request.new_phone_number
     }
 
-    resp, err = edit_user_info(current_user.username, new_user_data, stub, logger)
+    resp, err = edit_user_info(current_user.username, new_user_data, stub, logger, cache_db)
     if err:
         raise err
 
-    logger.info(f'[edit info] edit user information was successfully [username: {current_user.username}]')
+    logger.info('[edit info] edit user information was successfully [username: %s]', current_user.username)
 
     return BaseResponse(**resp)
 
 
-@router.put('/pass/edit', response_model= BaseResponse, responses= {500:{'model':HTTPError}, 404:{'model':HTTPError}, 409:{'model':HTTPError}} )
-def change_user_password(request: UserUpdatePassword, current_user: TokenUser= Depends(get_normal_user), stub: DataBaseStub = Depends(get_grpc)):
+@router.put('/pass/edit', response_model= BaseResponse, responses= {500:{'model':HTTPError}, 404:{'model':HTTPError}, 409:{'model':HTTPError}, 503:{'model':HTTPError}} )
+def change_user_password(request: UserUpdatePassword, current_user: TokenUser= Depends(get_normal_user), stub: DataBaseStub = Depends(get_grpc), cache_db: Redis= Depends(get_redis_cache)):
 
-    logger.debug(f'[edit pass] Receive a edit_user_password request [username: {current_user.username}]')
+    logger.debug('[edit pass] Receive a edit_user_password request [username: %s]', current_user.username)
 
-    resp_user, err = get_user(current_user.username, current_user.username, stub, logger, 'edit password')
+    resp_user, err = get_user(current_user.username, current_user.username, stub, logger, 'edit password', cache_db, with_password= True)
     if err:
         raise err
 
-    if verify_password(request.new_password, resp_user['password']) :
+    if verify_password_pooled(request.new_password, resp_user['password']) :
         raise HTTPException(status_code= status.HTTP_409_CONFLICT, detail={'code': 2412, 'message': "The new password is the same as the old password"})
 
     new_password = {
         'username': current_user.username,
-        'password': request.new_password
+        **password_fields(request.new_password)
     }
     
-    resp, err = edit_user_password(current_user.username, new_password, stub, logger)
+    resp, err = edit_user_password(current_user.username, new_password, stub, logger, cache_db)
     if err:
         raise err
     
-    logger.info(f'[edit pass] edit user password was successfully [username: {current_user.username}]')
+    logger.info('[edit pass] edit user password was successfully [username: %s]', current_user.username)
 
     return BaseResponse(**resp)
 
 @router.put('/role/edit', response_model= BaseResponse, responses= {500:{'model':HTTPError}, 404:{'model':HTTPError}, 409:{'model':HTTPError}} )
-def change_user_role(request: UserUpdateRole, current_user: TokenUser= Depends(get_admin_user), stub: DataBaseStub = Depends(get_grpc)):
+def change_user_role(request: UserUpdateRole, current_user: TokenUser= Depends(get_admin_user), stub: DataBaseStub = Depends(get_grpc), cache_db: Redis= Depends(get_redis_cache)):
 
-    logger.debug(f'[edit role] Receive a change_user_role request [caller: {current_user.username} -edit_username: {request.username} ]')
+    logger.debug('[edit role] Receive a change_user_role request [caller: %s -edit_username: %s ]', current_user.username, request.username)
 
-    resp_user, err = get_user(current_user.username, request.username, stub, logger, 'edit role')
+    resp_user, err = get_user(current_user.username, request.username, stub, logger, 'edit role', cache_db)
     if err:
         raise err
     
@@ -167,23 +182,23 @@ def change_user_role(request: UserUpdateRole, current_user: TokenUser= Depends(g
         'role': request.new_role
     }
 
-    resp, err = edit_user_role(current_user.username, new_role_data, stub, logger)
+    resp, err = edit_user_role(current_user.username, new_role_data, stub, logger, cache_db)
     if err:
         raise err
     
-    del_token(resp_user['user_id'], get_redis_cache().__next__())
-    logger.info(f'[edit role] edit user role was successfully  [caller: {current_user.username}]')
+    revoke_tokens([resp_user['user_id']], cache_db)
+    logger.info('[edit role] edit user role was successfully  [caller: %s]', current_user.username)
     
     return BaseResponse(**resp)
 
 
 
 @router.delete('/delete', response_model= BaseResponse, responses= {500:{'model':HTTPError}, 404:{'model':HTTPError}} )
-def delete_user(request: UserDelete, current_user: TokenUser= Depends(get_admin_user), stub: DataBaseStub = Depends(get_grpc)):
+def delete_user(request: UserDelete, current_user: TokenUser= Depends(get_admin_user), stub: DataBaseStub = Depends(get_grpc), cache_db: Redis= Depends(get_redis_cache)):
     
-    logger.debug(f'[delete] Receive a delete_user request [caller: {current_user.username} -delete_username: {request.username} ]')
+    logger.debug('[delete] Receive a delete_user request [caller: %s -delete_username: %s ]', current_user.username, request.username)
 
-    resp_user, err = get_user(current_user.username, request.username, stub, logger, 'delete')
+    resp_user, err = get_user(current_user.username, request.username, stub, logger, 'delete', cache_db)
     if err:
         raise err
     
@@ -191,12 +206,238 @@ def delete_user(request: UserDelete, current_user: TokenUser= Depends(get_admin_
         'username': request.username
     }
 
-    resp, err = delete_user_target(current_user.username, user_data, stub, logger)
+    resp, err = delete_user_target(current_user.username, user_data, stub, logger, cache_db)
     if err:
         raise err
     
-    del_token(resp_user['user_id'], get_redis_cache().__next__())
-    logger.info(f'[delete] delete user token [caller: {current_user.username}]')
+    revoke_tokens([resp_user['user_id']], cache_db)
+    logger.info('[delete] delete user token [caller: %s]', current_user.username)
 
     return BaseResponse(**resp)
 
+
+async def read_batch(request: Request, model) -> list:
+    """Parse a batch body sent either as a JSON array or as NDJSON"""
+
+    invalid_payload = HTTPException(status_code= status.HTTP_422_UNPROCESSABLE_ENTITY, detail={'code': 2416, 'message': 'Invalid batch payload'})
+    body = await request.body()
+
+    if request.headers.get('content-type', '').startswith(('application/x-ndjson', 'application/jsonl')):
+        items = [line for line in body.splitlines() if line.strip()]
+
+    else:
+        try:
+            items = json.loads(body)
+        except ValueError:
+            raise invalid_payload
+
+        if not isinstance(items, list):
+            raise invalid_payload
+
+    if not items:
+        raise invalid_payload
+
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code= status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail={'code': 2417, 'message': f'Batch is larger than {BATCH_MAX_ITEMS} items'})
+
+    try:
+        return [model.model_validate_json(item) if isinstance(item, bytes) else model.model_validate(item) for item in items]
+
+    except ValidationError:
+        raise invalid_payload
+
+
+async def resolve_user_ids(caller: str, usernames: list, stub: DataBaseStub, cache_db: aioredis.Redis, func: str) -> (dict, Union[HTTPException, None]):
+    """user_id of every username through the profile cache and GetUser, at
+    most BATCH_LOOKUP_CONCURRENCY at a time. Unknown usernames are left out,
+    the first other lookup error is returned with the ids found"""
+
+    user_ids, error = {}, None
+    for start in range(0, len(usernames), BATCH_LOOKUP_CONCURRENCY):
+        chunk = usernames[start:start + BATCH_LOOKUP_CONCURRENCY]
+        found = await asyncio.gather(*(aget_user(caller, username, stub, logger, func, cache_db) for username in chunk))
+
+        for username, (user, err) in zip(chunk, found):
+            if user is not None:
+                user_ids[username] = user['user_id']
+            elif err.status_code != status.HTTP_404_NOT_FOUND and error is None:
+                error = err
+
+    return user_ids, error
+
+
+async def revoke_batch_tokens(caller: str, results: list, user_ids: dict, cache_db: aioredis.Redis, func: str):
+    """Revokes the tokens of every user the batch changed, by the user_id
+    the database service returned or else the one resolved in `user_ids`.
+    Raises a 500 once the others are revoked when a user_id is unknown,
+    a changed user must never keep a valid token silently"""
+
+    revoked, unresolved = [], []
+    for result in results:
+        if result['code'] != 1200:
+            continue
+
+        user_id = result.get('user_id', user_ids.get(result['username']))
+        if user_id is None:
+            unresolved.append(result['username'])
+        else:
+            revoked.append(user_id)
+
+    await arevoke_tokens(revoked, cache_db)
+
+    if unresolved:
+        logger.error('[%s] Tokens were not revoked, user_id is unknown [caller: %s -usernames: %s]', func, caller, unresolved)
+        raise HTTPException(status_code= status.HTTP_500_INTERNAL_SERVER_ERROR, detail={'code': 2422, 'message': 'Tokens of some changed users could not be revoked'})
+
+
+def batch_response(results: list) -> BatchResponse:
+
+    succeeded = sum(1 for result in results if result['code'] == 1200)
+    return BatchResponse(
+        message= f'{succeeded} of {len(results)} items succeeded',
+        code= 1200,
+        results= [BatchItemResult(**result) for result in results]
+    )
+
+
+@router.post('/batch/new', response_model= BatchResponse, responses= {500:{'model':HTTPError}, 413:{'model':HTTPError}, 422:{'model':HTTPError}, 503:{'model':HTTPError}} )
+async def create_new_users(request: Request, current_user: TokenUser= Depends(get_admin_user), stub: DataBaseStub = Depends(get_aio_grpc), cache_db: aioredis.Redis= Depends(get_aio_redis_cache)):
+
+    users = await read_batch(request, UserRegister)
+    logger.debug('[batch new] Receive a create_new_users request [caller: %s -count: %s]', current_user.username, len(users))
+
+    passwords = await passwords_fields([user.password for user in users])
+    users_data = [
+        {
+            'username': user.username,
+            'name': user.name,
+            'email': user.email,
+            'phone_number': user.phone_number,
+            'role': user.role,
+            **password
+        }
+        for user, password in zip(users, passwords)
+    ]
+
+    results, err = await create_users(current_user.username, users_data, stub, logger, cache_db)
+    if err:
+        raise err
+
+    logger.info('[batch new] create new users was successfully [caller: %s -count: %s]', current_user.username, len(results))
+
+    return batch_response(results)
+
+
+@router.put('/batch/role/edit', response_model= BatchResponse, responses= {500:{'model':HTTPError}, 413:{'model':HTTPError}, 422:{'model':HTTPError}, 503:{'model':HTTPError}} )
+async def change_users_role(request: Request, current_user: TokenUser= Depends(get_admin_user), stub: DataBaseStub = Depends(get_aio_grpc), cache_db: aioredis.Redis= Depends(get_aio_redis_cache)):
+
+    new_roles = await read_batch(request, UserUpdateRole)
+    logger.debug('[batch role] Receive a change_users_role request [caller: %s -count: %s]', current_user.username, len(new_roles))
+
+    new_roles_data = [{'username': new_role.username, 'role': new_role.new_role} for new_role in new_roles]
+
+    results, err = await edit_users_role(current_user.username, new_roles_data, stub, logger, cache_db)
+    if err:
+        raise err
+
+    # the users still exist, only the ids the database service left out are looked up
+    unknown = [result['username'] for result in results if result['code'] == 1200 and 'user_id' not in result]
+    user_ids, _ = await resolve_user_ids(current_user.username, unknown, stub, cache_db, 'batch role')
+    await revoke_batch_tokens(current_user.username, results, user_ids, cache_db, 'batch role')
+    logger.info('[batch role] edit users role was successfully [caller: %s -count: %s]', current_user.username, len(results))
+
+    return batch_response(results)
+
+
+@router.delete('/batch/delete', response_model= BatchResponse, responses= {500:{'model':HTTPError}, 413:{'model':HTTPError}, 422:{'model':HTTPError}, 503:{'model':HTTPError}} )
+async def delete_users(request: Request, current_user: TokenUser= Depends(get_admin_user), stub: DataBaseStub = Depends(get_aio_grpc), cache_db: aioredis.Redis= Depends(get_aio_redis_cache)):
+
+    delete_usernames = await read_batch(request, UserDelete)
+    logger.debug('[batch delete] Receive a delete_users request [caller: %s -count: %s]', current_user.username, len(delete_usernames))
+
+    users_data = [{'username': user.username} for user in delete_usernames]
+
+    # a deleted user can't be looked up afterwards, so resolve first and fail before deleting anything
+    user_ids, err = await resolve_user_ids(current_user.username, [user.username for user in delete_usernames], stub, cache_db, 'batch delete')
+    if err:
+        raise err
+
+    results, err = await delete_users_target(current_user.username, users_data, stub, logger, cache_db)
+    if err:
+        raise err
+
+    await revoke_batch_tokens(current_user.username, results, user_ids, cache_db, 'batch delete')
+    logger.info('[batch delete] delete users token [caller: %s -count: %s]', current_user.username, len(results))
+
+    return batch_response(results)
+
+
+@router.get('/list', response_model= UserListResponse, responses= {500:{'model':HTTPError}} )
+async def list_users_information(cursor: int = Query(default=0, ge=0), limit: int = Query(default=50, ge=1, le=LIST_MAX_LIMIT), role: Optional[UserRole] = None, current_user: TokenUser= Depends(get_admin_user), stub: DataBaseStub = Depends(get_aio_grpc)):
+
+    logger.debug('[list] Receive a list_users_information request [caller: %s -cursor: %s -limit: %s -role: %s]', current_user.username, cursor, limit, role)
+
+    # one extra row tells whether there is a next page
+    list_filter = {'after_user_id': cursor, 'limit': limit + 1, 'role': role}
+    users = [user async for user in list_users(current_user.username, list_filter, stub, logger)]
+
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        next_cursor = users[-1]['user_id']
+
+    return UserListResponse(users= [UserInfoResponse(**user) for user in users], next_cursor= next_cursor)
+
+
+@router.get('/export', response_class= StreamingResponse, responses= {200:{'content': {'application/x-ndjson': {}}}, 500:{'model':HTTPError}} )
+async def export_users_information(role: Optional[UserRole] = None, current_user: TokenUser= Depends(get_admin_user), stub: DataBaseStub = Depends(get_aio_grpc)):
+
+    logger.debug('[export] Receive a export_users_information request [caller: %s -role: %s]', current_user.username, role)
+
+    # the export streams every user, a deadline would cut it off on a large table
+    users = list_users(current_user.username, {'after_user_id': 0, 'limit': 0, 'role': role}, stub, logger, timeout= None)
+
+    # pull the first row before answering so connection errors still get a proper status code
+    try:
+        first_user = await users.__anext__()
+    except StopAsyncIteration:
+        first_user = None
+
+    async def lines():
+        try:
+            if first_user is None:
+                return
+
+            yield UserInfoResponse(**first_user).model_dump_json() + '\n'
+            async for user in users:
+                yield UserInfoResponse(**user).model_dump_json() + '\n'
+
+        except HTTPException:
+            # the status is already sent, raising aborts the chunked body so the
+            # client sees a broken transfer instead of a short but complete export
+            logger.error('[export] Export stopped by a grpc error [caller: %s]', current_user.username)
+            raise
+
+        finally:
+            await users.aclose()
+
+    return StreamingResponse(lines(), media_type= 'application/x-ndjson')
+
+
+@router.post('/tokens/revoke', response_model= BaseResponse, responses= {500:{'model':HTTPError}, 422:{'model':HTTPError}} )
+async def revoke_users_token(request: TokenRevoke, current_user: TokenUser= Depends(get_admin_user), stub: DataBaseStub = Depends(get_aio_grpc), cache_db: aioredis.Redis= Depends(get_aio_redis_cache)):
+
+    logger.debug('[revoke] Receive a revoke_users_token request [caller: %s -count: %s -role: %s]', current_user.username, len(request.user_ids or []), request.role)
+
+    if not request.user_ids and request.role is None:
+        raise HTTPException(status_code= status.HTTP_422_UNPROCESSABLE_ENTITY, detail={'code': 2418, 'message': 'Either user_ids or role is required'})
+
+    user_ids = set(request.user_ids or [])
+    if request.role is not None:
+        list_filter = {'after_user_id': 0, 'limit': 0, 'role': request.role}
+        user_ids.update([user['user_id'] async for user in list_users(current_user.username, list_filter, stub, logger)])
+
+    revoked = await arevoke_tokens(sorted(user_ids), cache_db)
+    logger.info('[revoke] revoke users token was successfully [caller: %s -revoked: %s]', current_user.username, revoked)
+
+    return BaseResponse(message= f'{revoked} tokens revoked', code= 1200)
@@ -56,6 +56,11 @@ class UserInfoResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class UserListResponse(BaseModel):
+
+    users: List[UserInfoResponse]
+    next_cursor: Optional[int] = Field(default=None)
+
 class UserRegister(BaseModel):
 
     username : str
@@ -87,6 +92,25 @@ class UserDelete(BaseModel):
     username : str
 
 
+class TokenRevoke(BaseModel):
+
+    user_ids: Optional[List[int]] = Field(default=None)
+    role: Optional[UserRole] = Field(default=None)
+
+
+class BatchItemResult(BaseModel):
+
+    username: str
+    message: str
+    code: int
+
+class BatchResponse(BaseModel):
+
+    message: str
+    code: int
+    results: List[BatchItemResult]
+
+
 # ========== Auth ========== 
 
 
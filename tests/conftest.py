@@ -0,0 +1,36 @@
+import tempfile
+import os
+
+# modules read their settings at import time
+os.environ.setdefault('OAUTH2_SECRET_KEY', 'test-secret')
+os.environ.setdefault('OAUTH2_ALGORITHM', 'HS256')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+os.environ.setdefault('LOG_DIR', tempfile.gettempdir())
+
+import fakeredis
+import asyncio
+import pytest
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def db(server):
+    return fakeredis.FakeRedis(server=server, decode_responses=True)
+
+
+@pytest.fixture
+def aio_db(server):
+    return fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
+
+
+@pytest.fixture
+def run():
+    """Runs coroutines on one loop per test, the async fakes bind to the first loop they see"""
+
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.close()
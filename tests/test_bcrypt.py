@@ -0,0 +1,40 @@
+import auth.auth as auth_module
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def restore_context():
+    context, rounds = auth_module.pwd_context.copy(), auth_module.bcrypt_rounds
+    yield
+    auth_module.pwd_context.load(context.to_dict())
+    auth_module.bcrypt_rounds = rounds
+
+
+def test_only_cheaper_hashes_need_update():
+    cheaper, same, costlier = (auth_module.hash_password('secret', rounds) for rounds in (4, 5, 6))
+    auth_module.set_bcrypt_rounds(5)
+
+    assert auth_module.password_needs_update(cheaper) is True
+    assert auth_module.password_needs_update(same) is False
+    # a worker calibrated to a higher cost doesn't make this one rehash its hashes down
+    assert auth_module.password_needs_update(costlier) is False
+
+
+def test_calibrated_rounds_are_shared_without_expiry(run, aio_db, monkeypatch):
+    monkeypatch.setattr(auth_module, 'BCRYPT_ROUNDS', None)
+    monkeypatch.setattr(auth_module, 'BCRYPT_TARGET_MS', 50)
+    monkeypatch.setattr(auth_module, 'calibrate_bcrypt_rounds', lambda *args: 5)
+
+    run(auth_module.configure_bcrypt(aio_db))
+    assert auth_module.bcrypt_rounds == 5
+    assert run(aio_db.ttl(auth_module.BCRYPT_ROUNDS_KEY)) == -1
+
+    # a later worker measuring differently still uses the shared cost
+    monkeypatch.setattr(auth_module, 'calibrate_bcrypt_rounds', lambda *args: 6)
+    run(auth_module.configure_bcrypt(aio_db))
+    assert auth_module.bcrypt_rounds == 5
+
+    monkeypatch.setattr(auth_module, 'BCRYPT_RECALIBRATE', True)
+    run(auth_module.configure_bcrypt(aio_db))
+    assert auth_module.bcrypt_rounds == 6
+    assert run(aio_db.get(auth_module.BCRYPT_ROUNDS_KEY)) == '6'
@@ -0,0 +1,49 @@
+from cache.denylist import TokenDenylist, server_time
+import redis
+
+
+def denylist():
+    return TokenDenylist('test:revoked', 1, 7*24*60*60)
+
+
+def test_revocation_hits_only_older_tokens(run, db, aio_db):
+    tokens = denylist()
+
+    issued_before = run(server_time(aio_db))
+    assert tokens.revoke([7], db) == 1
+    issued_after = run(server_time(aio_db))
+
+    assert tokens.revoked(7, issued_before) is True
+    assert tokens.revoked(7, issued_after) is False
+    assert tokens.revoked(8, issued_before) is False
+
+
+def test_other_worker_sees_revocation_after_refresh(run, db, aio_db):
+    revoking, other = denylist(), denylist()
+    run(other.refresh(aio_db))
+
+    issued = run(server_time(aio_db))
+    run(revoking.arevoke([7, 8], aio_db))
+    assert other.revoked(7, issued) is False
+
+    assert run(other.refresh(aio_db)) == 2
+    assert other.revoked(7, issued) is True
+    assert other.revoked(8, issued) is True
+
+
+def test_not_fresh_until_refreshed(run, aio_db, monkeypatch):
+    tokens = denylist()
+    assert tokens.fresh is False
+
+    async def broken(*args, **kwargs):
+        raise redis.ConnectionError('connection lost')
+
+    monkeypatch.setattr(tokens, 'refresh', broken)
+    run(tokens.start(aio_db))
+    run(tokens.stop())
+    assert tokens.fresh is False
+    assert tokens.errors == 1
+
+    monkeypatch.undo()
+    run(tokens.refresh(aio_db))
+    assert tokens.fresh is True
@@ -0,0 +1,114 @@
+from database_service import functions, aio_functions
+from database_service.session import deadline
+import grpc_utils.database_pb2 as pb2
+import logging
+import pytest
+
+
+logger = logging.getLogger('test_functions')
+
+
+class Stub:
+    """Answers every method with `code`"""
+
+    def __init__(self, code: int):
+        self.code = code
+        self.requests = []
+
+    def __getattr__(self, method):
+
+        def call(request, timeout= None):
+            self.requests.append(request)
+            return pb2.BaseResponse(code= self.code)
+
+        return call
+
+
+class AioStub(Stub):
+
+    def __getattr__(self, method):
+        call = super().__getattr__(method)
+
+        async def acall(request, timeout= None):
+            return call(request, timeout)
+
+        return acall
+
+
+user_data = {'username': 'alice', 'name': 'Alice', 'email': 'alice@example.com', 'phone_number': '0912'}
+
+
+@pytest.mark.parametrize('code, status_code, error_code', [
+    (1401, 404, 2401),
+    (1406, 409, 2406),
+    (1407, 409, 2407),
+    (1403, 500, 1403)
+])
+def test_edit_info_errors_are_returned(run, code, status_code, error_code):
+
+    for result in (
+        functions.edit_user_info('alice', user_data, Stub(code), logger),
+        run(aio_functions.edit_user_info('alice', user_data, AioStub(code), logger))
+    ):
+        resp, err = result
+        assert resp is None
+        assert err.status_code == status_code
+        assert err.detail['code'] == error_code
+
+
+def test_success_builds_the_request(run):
+    stub = Stub(1200)
+    resp, err = functions.edit_user_info('alice', user_data, stub, logger)
+
+    assert err is None and resp['code'] == 1200
+    assert isinstance(stub.requests[0], pb2.RequestModifyUserInfo)
+    assert stub.requests[0].email == 'alice@example.com'
+
+    resp, err = run(aio_functions.edit_user_info('alice', user_data, AioStub(1200), logger))
+    assert err is None and resp['code'] == 1200
+
+
+def test_connection_error_is_returned():
+
+    class Broken:
+        def DeleteUser(self, request, timeout= None):
+            raise ValueError('boom')
+
+    resp, err = functions.delete_user_target('admin', {'username': 'alice'}, Broken(), logger)
+    assert resp is None
+    assert err.status_code == 500 and err.detail['code'] == 2003
+
+
+class ListCall:
+
+    def __init__(self, users):
+        self.users = iter(users)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self.users)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    def cancel(self):
+        pass
+
+
+def test_list_users_has_a_deadline_unless_told_otherwise(run):
+    timeouts = []
+
+    class ListStub:
+        def ListUsers(self, request, timeout= None):
+            timeouts.append(timeout)
+            return ListCall([pb2.UserInfo(user_id= 1, username= 'alice')])
+
+    async def listed(**kwargs):
+        return [user['username'] async for user in aio_functions.list_users('admin', {'limit': 2}, ListStub(), logger, **kwargs)]
+
+    assert run(listed()) == ['alice']
+    assert run(listed(timeout= None)) == ['alice']
+    assert timeouts == [deadline('ListUsers'), None]
+    assert deadline('ListUsers') is not None
@@ -0,0 +1,67 @@
+from auth.keys import KeySet
+from jose import jwt, JWTError
+import ecdsa
+import pytest
+import time
+
+
+SECRET = 'test-secret'
+
+
+@pytest.fixture
+def keys_dir(tmp_path):
+    for kid in ('2026-04', '2026-10'):
+        (tmp_path / f'{kid}.pem').write_bytes(ecdsa.SigningKey.generate(curve= ecdsa.NIST256p).to_pem())
+    return str(tmp_path)
+
+
+def legacy_token(expires_in: float, **claims) -> str:
+    return jwt.encode({'user_id': 1, 'scopes': ['ADMIN', 'USER'], 'exp': int(time.time() + expires_in), **claims}, SECRET, algorithm= 'HS256')
+
+
+def rejected(keys: KeySet, token: str) -> bool:
+    try:
+        keys.decode(token)
+        return False
+
+    except JWTError:
+        return True
+
+
+def test_signs_with_the_active_kid(keys_dir):
+    keys = KeySet('ES256', None, keys_dir, '')
+
+    token = keys.encode({'user_id': 1})
+    assert jwt.get_unverified_header(token)['kid'] == '2026-10'
+    assert keys.decode(token)['user_id'] == 1
+    assert rejected(keys, jwt.encode({'user_id': 1}, SECRET, algorithm= 'HS256', headers= {'kid': 'unknown'}))
+
+
+def test_hmac_token_naming_a_public_kid_is_rejected(keys_dir):
+    keys = KeySet('ES256', SECRET, keys_dir, '', time.time() + 3600)
+
+    forged = jwt.encode({'user_id': 1}, SECRET, algorithm= 'HS256', headers= {'kid': '2026-10'})
+    assert rejected(keys, forged)
+
+
+def test_tokens_without_kid_are_rejected_without_cutoff(keys_dir):
+    keys = KeySet('ES256', SECRET, keys_dir, '')
+
+    assert rejected(keys, legacy_token(60))
+    assert keys.stats()['legacy_secret'] is False
+
+
+def test_tokens_without_kid_must_expire_by_the_cutoff(keys_dir):
+    keys = KeySet('ES256', SECRET, keys_dir, '', time.time() + 3600)
+
+    assert keys.decode(legacy_token(60))['user_id'] == 1
+    # minted with the secret to outlive the cutoff
+    assert rejected(keys, legacy_token(2 * 3600))
+    assert rejected(keys, jwt.encode({'user_id': 1}, SECRET, algorithm= 'HS256'))
+
+
+def test_cutoff_is_ignored_with_hmac_signing():
+    keys = KeySet('HS256', SECRET, '', '', time.time() + 3600)
+
+    token = keys.encode({'user_id': 1, 'exp': int(time.time() + 7 * 24 * 3600)})
+    assert keys.decode(token)['user_id'] == 1
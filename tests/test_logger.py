@@ -0,0 +1,33 @@
+from log_utils.logger import DeferredQueueHandler
+import logging
+import queue
+
+
+def record(msg, *args):
+    return logging.LogRecord('test.log', logging.INFO, __file__, 1, msg, args, None)
+
+
+def test_scalar_args_are_merged_by_the_listener():
+    handler = DeferredQueueHandler(queue.Queue())
+    prepared = handler.prepare(record('[user] %s -%d', 'alice', 3))
+
+    assert prepared.args == ('alice', 3)
+    assert prepared.getMessage() == '[user] alice -3'
+
+
+def test_mutable_args_are_merged_at_call_time():
+    handler = DeferredQueueHandler(queue.Queue())
+    roles = ['admin']
+    prepared = handler.prepare(record('[user] roles %s', roles))
+    roles.append('agent')
+
+    assert prepared.args is None
+    assert prepared.getMessage() == "[user] roles ['admin']"
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = DeferredQueueHandler(queue.Queue(1))
+    handler.enqueue(record('first'))
+    handler.enqueue(record('second'))
+
+    assert handler.dropped == 1
@@ -0,0 +1,86 @@
+from cache.ratelimit import LoginLimiter
+import cache.ratelimit as ratelimit
+import redis
+
+
+def test_user_bucket_allows_its_burst(run, aio_db):
+    limiter = LoginLimiter()
+
+    for _ in range(ratelimit.LOGIN_USER_BURST):
+        assert run(limiter.acquire('alice', '10.0.0.1', aio_db)) == (True, 0, False)
+
+    allowed, retry_after, locked = run(limiter.acquire('alice', '10.0.0.1', aio_db))
+    assert (allowed, locked) == (False, False)
+    # one token every 60 / LOGIN_USER_PER_MINUTE seconds
+    assert 0 < retry_after <= 60 / ratelimit.LOGIN_USER_PER_MINUTE
+
+    # other usernames still have their own bucket
+    assert run(limiter.acquire('bob', '10.0.0.1', aio_db))[0] is True
+
+
+def test_token_is_taken_from_every_bucket_or_none(run, aio_db):
+    limiter = LoginLimiter()
+    limiter.buckets = [('user', 5, 1 / 60000), ('ip', 2, 1 / 60000)]
+
+    assert run(limiter.acquire('alice', '10.0.0.2', aio_db))[0] is True
+    assert run(limiter.acquire('bob', '10.0.0.2', aio_db))[0] is True
+
+    # the ip bucket is empty, carol's own bucket must not pay for the refusal
+    assert run(limiter.acquire('carol', '10.0.0.2', aio_db))[0] is False
+    assert run(aio_db.exists('login:bucket:user:carol')) == 0
+    assert run(limiter.acquire('carol', '10.0.0.3', aio_db))[0] is True
+    assert float(run(aio_db.hget('login:bucket:user:carol', 'tokens'))) == 4
+
+
+def test_buckets_follow_the_redis_clock(run, aio_db):
+    limiter = LoginLimiter()
+    run(limiter.acquire('alice', '10.0.0.4', aio_db))
+
+    seconds, microseconds = run(aio_db.time())
+    stamped = int(run(aio_db.hget('login:bucket:user:alice', 'ts')))
+    assert abs(seconds * 1000 + microseconds // 1000 - stamped) < 1000
+
+
+def test_lockout_after_threshold_until_it_expires(run, aio_db):
+    limiter = LoginLimiter()
+
+    for _ in range(ratelimit.LOGIN_LOCKOUT_THRESHOLD - 1):
+        assert run(limiter.failed('dave', aio_db)) is False
+    assert run(limiter.failed('dave', aio_db)) is True
+
+    allowed, retry_after, locked = run(limiter.acquire('dave', '10.0.0.5', aio_db))
+    assert (allowed, locked) == (False, True)
+    assert 0 < retry_after <= ratelimit.LOGIN_LOCKOUT_SECONDS
+    assert run(aio_db.exists('login:failures:dave')) == 0
+
+    # the lock is a key with a ttl, once it is gone logins go through again
+    run(aio_db.delete('login:lock:dave'))
+    assert run(limiter.acquire('dave', '10.0.0.5', aio_db))[0] is True
+
+
+def test_success_resets_the_failure_count(run, aio_db):
+    limiter = LoginLimiter()
+
+    for _ in range(ratelimit.LOGIN_LOCKOUT_THRESHOLD - 1):
+        run(limiter.failed('erin', aio_db))
+    run(limiter.succeeded('erin', aio_db))
+
+    assert run(limiter.failed('erin', aio_db)) is False
+
+
+def test_redis_errors_let_logins_through(run, aio_db, monkeypatch):
+    limiter = LoginLimiter()
+    for _ in range(ratelimit.LOGIN_USER_BURST):
+        run(limiter.acquire('frank', '10.0.0.6', aio_db))
+    for _ in range(ratelimit.LOGIN_LOCKOUT_THRESHOLD - 1):
+        run(limiter.failed('frank', aio_db))
+
+    async def broken(*args, **kwargs):
+        raise redis.ConnectionError('connection lost')
+
+    monkeypatch.setattr(aio_db, 'evalsha', broken)
+    monkeypatch.setattr(aio_db, 'eval', broken)
+
+    # the bucket is empty and the next failure would lock, neither is enforced
+    assert run(limiter.acquire('frank', '10.0.0.6', aio_db)) == (True, 0, False)
+    assert run(limiter.failed('frank', aio_db)) is False
@@ -0,0 +1,100 @@
+from database_service.resilience import CircuitBreaker, CircuitOpenError
+import grpc
+
+
+def open_breaker():
+    breaker = CircuitBreaker('GetUser', 3, 5)
+    for _ in range(3):
+        breaker.allow()
+        breaker.record(grpc.StatusCode.UNAVAILABLE)
+    return breaker
+
+
+def expire(breaker):
+    breaker.opened_at -= breaker.open_seconds
+
+
+def rejected(breaker) -> bool:
+    try:
+        breaker.allow()
+        return False
+
+    except CircuitOpenError:
+        return True
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker('GetUser', 3, 5)
+
+    for _ in range(2):
+        breaker.record(grpc.StatusCode.UNAVAILABLE)
+    breaker.record(grpc.StatusCode.OK)
+    for _ in range(2):
+        breaker.record(grpc.StatusCode.DEADLINE_EXCEEDED)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.record(grpc.StatusCode.UNAVAILABLE)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert rejected(breaker)
+    assert breaker.rejected == 1
+
+
+def test_caller_errors_are_not_failures():
+    breaker = CircuitBreaker('GetUser', 1, 5)
+
+    breaker.record(grpc.StatusCode.NOT_FOUND)
+    breaker.record(grpc.StatusCode.INVALID_ARGUMENT)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_lets_one_probe_through():
+    breaker = open_breaker()
+    expire(breaker)
+
+    breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert rejected(breaker)
+
+
+def test_probe_success_closes():
+    breaker = open_breaker()
+    expire(breaker)
+
+    breaker.allow()
+    breaker.record(grpc.StatusCode.OK)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert not rejected(breaker)
+
+
+def test_probe_failure_reopens():
+    breaker = open_breaker()
+    expire(breaker)
+
+    breaker.allow()
+    breaker.record(grpc.StatusCode.UNAVAILABLE)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert rejected(breaker)
+
+
+def test_cancelled_probe_frees_the_slot():
+    breaker = open_breaker()
+    expire(breaker)
+
+    breaker.allow()
+    breaker.record(grpc.StatusCode.CANCELLED)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.consecutive_failures == 3
+
+    # the next call probes again
+    breaker.allow()
+    breaker.record(grpc.StatusCode.OK)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_disabled_breaker_never_opens():
+    breaker = CircuitBreaker('GetUser', 0, 5)
+
+    for _ in range(10):
+        breaker.allow()
+        breaker.record(grpc.StatusCode.UNAVAILABLE)
+    assert breaker.state == CircuitBreaker.CLOSED
@@ -0,0 +1,86 @@
+from database_service.singleflight import SingleFlight
+import threading
+import asyncio
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight('test')
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'alice'
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('alice', fn)))
+    leader.start()
+    started.wait(5)
+
+    followers = [threading.Thread(target=lambda: results.append(flight.do('alice', fn))) for _ in range(3)]
+    for follower in followers:
+        follower.start()
+    # the followers are waiting on the leader's flight
+    while flight.coalesced < 3:
+        threading.Event().wait(0.001)
+    release.set()
+
+    for thread in [leader] + followers:
+        thread.join(5)
+
+    assert results == ['alice'] * 4
+    assert len(calls) == 1
+    assert flight.stats() == {'calls': 4, 'coalesced': 3, 'in_flight': 0}
+
+
+def test_error_reaches_every_caller_and_is_not_kept():
+    flight = SingleFlight('test')
+
+    def fail():
+        raise ValueError('boom')
+
+    try:
+        flight.do('bob', fail)
+        raise AssertionError('error was swallowed')
+
+    except ValueError:
+        pass
+
+    assert flight.do('bob', lambda: 'bob') == 'bob'
+
+
+def test_async_calls_share_one_task(run):
+    flight = SingleFlight('test')
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'carol'
+
+    async def callers():
+        return await asyncio.gather(*(flight.ado('carol', fn) for _ in range(4)))
+
+    assert run(callers()) == ['carol'] * 4
+    assert len(calls) == 1
+    assert flight.stats()['in_flight'] == 0
+
+
+def test_cancelled_caller_leaves_the_call_running(run):
+    flight = SingleFlight('test')
+
+    async def fn():
+        await asyncio.sleep(0.01)
+        return 'dave'
+
+    async def callers():
+        first = asyncio.ensure_future(flight.ado('dave', fn))
+        second = asyncio.ensure_future(flight.ado('dave', fn))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert run(callers()) == 'dave'
@@ -0,0 +1,145 @@
+from cache.tiered import TwoTierCache, generations, agenerations
+from cache.invalidation import invalidator
+from cache.local import LocalCache
+import json
+
+
+def cache():
+    return TwoTierCache('test:profile', 60, 100, 30, encode= json.dumps, decode= json.loads, fail_open= True)
+
+
+def test_fill_stores_without_write(db):
+    profiles = cache()
+
+    seen, = generations([(profiles, 'alice')], db)
+    assert profiles.fill('alice', {'role': 'USER'}, seen, db) is True
+    assert profiles.get('alice', db) == {'role': 'USER'}
+
+
+def test_fill_refused_after_concurrent_delete(db):
+    profiles = cache()
+    profiles.set('alice', {'role': 'ADMIN'}, db)
+
+    # the lookup read the old row, then a writer changed it and dropped the entry
+    seen, = generations([(profiles, 'alice')], db)
+    profiles.delete('alice', db)
+
+    assert profiles.fill('alice', {'role': 'ADMIN'}, seen, db) is False
+    assert profiles.get('alice', db) is None
+
+    # the next lookup starts after the write and may cache again
+    seen, = generations([(profiles, 'alice')], db)
+    assert profiles.fill('alice', {'role': 'USER'}, seen, db) is True
+
+
+def test_fill_refused_after_delete_many(db):
+    profiles = cache()
+    profiles.set_many({'alice': {'role': 'USER'}, 'bob': {'role': 'USER'}}, db)
+
+    seen = generations([(profiles, 'alice'), (profiles, 'bob')], db)
+    assert profiles.delete_many(['alice', 'bob', 'carol'], db) == 2
+
+    assert profiles.fill('alice', {'role': 'USER'}, seen[0], db) is False
+    assert profiles.fill('bob', {'role': 'USER'}, seen[1], db) is False
+
+
+def test_fill_skipped_without_generation(db):
+    profiles = cache()
+
+    assert profiles.fill('alice', {'role': 'USER'}, None, db) is False
+    assert profiles.get('alice', db) is None
+
+
+def test_async_fill_refused_after_concurrent_delete(run, aio_db):
+    profiles = cache()
+
+    seen, = run(agenerations([(profiles, 'alice')], aio_db))
+    run(profiles.adelete('alice', aio_db))
+
+    assert run(profiles.afill('alice', {'role': 'ADMIN'}, seen, aio_db)) is False
+    assert run(profiles.aget('alice', aio_db)) is None
+
+
+def other_worker_deletes(profiles, ident, db):
+    """What a delete on another worker does to this one: the L2 entry goes
+    and its pub/sub message reaches this worker's invalidator"""
+
+    db.delete(profiles.key(ident))
+    invalidator._apply(json.dumps({'origin': 'other', 'ns': profiles.namespace, 'id': ident}))
+
+
+def test_local_set_if_refused_after_delete():
+    local = LocalCache(10, 30)
+
+    version = local.version('alice')
+    local.delete('alice')
+    assert local.set_if('alice', 'ADMIN', version) is False
+
+    version = local.version('alice')
+    local.clear()
+    assert local.set_if('alice', 'ADMIN', version) is False
+
+    version = local.version('alice')
+    assert local.set_if('alice', 'USER', version) is True
+    assert local.get('alice') == 'USER'
+
+
+def test_local_versions_survive_forgetting_counters():
+    local = LocalCache(2, 30)
+
+    version = local.version('alice')
+    for name in ('bob', 'carol', 'dave'):
+        local.delete(name)
+    assert local.set_if('alice', 'ADMIN', version) is False
+
+
+def test_invalidation_during_l2_read_keeps_l1_empty(db, monkeypatch):
+    profiles = cache()
+    monkeypatch.setattr(invalidator, 'connected', True)
+    profiles.set('alice', {'role': 'ADMIN'}, db)
+    profiles.local.clear()
+
+    # the invalidation lands after the L2 reply, before it is stored in L1
+    get = db.get
+
+    def racing_get(key):
+        raw = get(key)
+        other_worker_deletes(profiles, 'alice', db)
+        return raw
+
+    monkeypatch.setattr(db, 'get', racing_get)
+    assert profiles.get('alice', db) == {'role': 'ADMIN'}
+    monkeypatch.setattr(db, 'get', get)
+
+    assert profiles.get('alice', db) is None
+
+
+def test_invalidation_during_async_l2_read_keeps_l1_empty(run, db, aio_db, monkeypatch):
+    profiles = cache()
+    monkeypatch.setattr(invalidator, 'connected', True)
+    run(profiles.aset('alice', {'role': 'ADMIN'}, aio_db))
+    profiles.local.clear()
+
+    get = aio_db.get
+
+    async def racing_get(key):
+        raw = await get(key)
+        other_worker_deletes(profiles, 'alice', db)
+        return raw
+
+    monkeypatch.setattr(aio_db, 'get', racing_get)
+    assert run(profiles.aget('alice', aio_db)) == {'role': 'ADMIN'}
+    monkeypatch.setattr(aio_db, 'get', get)
+
+    assert run(profiles.aget('alice', aio_db)) is None
+
+
+def test_l2_read_without_invalidation_fills_l1(db, monkeypatch):
+    profiles = cache()
+    monkeypatch.setattr(invalidator, 'connected', True)
+    profiles.set('alice', {'role': 'USER'}, db)
+    profiles.local.clear()
+
+    assert profiles.get_many(['alice'], db) == {'alice': {'role': 'USER'}}
+    db.delete(profiles.key('alice'))
+    assert profiles.get('alice', db) == {'role': 'USER'}
@@ -0,0 +1,127 @@
+from cache.usernames import UsernameBloom, missing_cache, fill_missing, set_created, known_missing
+from cache.tiered import generations
+import redis
+
+
+def bloom():
+    return UsernameBloom(1024, 7, 60)
+
+
+def break_pipelines(db, monkeypatch, count=1):
+    """The next `count` pipelines of `db` fail on execute"""
+
+    pipeline = db.pipeline
+    left = [count]
+
+    def broken(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        if left[0] > 0:
+            left[0] -= 1
+
+            def execute(*args, **kwargs):
+                raise redis.ConnectionError('connection lost')
+
+            pipe.execute = execute
+        return pipe
+
+    monkeypatch.setattr(db, 'pipeline', broken)
+
+
+async def rebuild(filter, usernames, db):
+
+    async def load():
+        for username in usernames:
+            yield username
+
+    return await filter.rebuild(load(), db)
+
+
+def test_lookup_needs_finished_rebuild(run, db, aio_db):
+    filter = bloom()
+
+    # bits set by SETBIT alone (e.g. after an eviction) are never trusted
+    filter.add_many(['alice'], db)
+    assert filter.absent_for_sure('bob', db) is False
+
+    assert run(rebuild(filter, ['alice'], aio_db)) == 1
+    assert filter.absent_for_sure('alice', db) is False
+    assert filter.absent_for_sure('bob', db) is True
+
+
+def test_added_user_is_maybe(run, db, aio_db):
+    filter = bloom()
+    run(rebuild(filter, [], aio_db))
+
+    assert filter.absent_for_sure('carol', db) is True
+    filter.add_many(['carol'], db)
+    assert filter.absent_for_sure('carol', db) is False
+
+
+def test_failed_add_drops_filter(run, db, aio_db, monkeypatch):
+    filter = bloom()
+    run(rebuild(filter, [], aio_db))
+
+    break_pipelines(db, monkeypatch)
+    filter.add_many(['carol'], db)
+
+    assert filter.absent_for_sure('carol', db) is False
+    assert filter.absent_for_sure('dave', db) is False
+    assert not db.exists(filter.key)
+
+
+def test_failed_invalidation_distrusts_locally(run, db, aio_db, monkeypatch):
+    filter = bloom()
+    run(rebuild(filter, [], aio_db))
+
+    break_pipelines(db, monkeypatch, count=2)
+    filter.add_many(['carol'], db)
+
+    assert db.exists(filter.key)
+    assert filter.absent_for_sure('carol', db) is False
+
+    run(rebuild(filter, ['carol'], aio_db))
+    assert filter.absent_for_sure('dave', db) is True
+
+
+def test_failed_add_during_rebuild_refuses_swap(run, db, aio_db, monkeypatch):
+    filter = bloom()
+    run(rebuild(filter, [], aio_db))
+
+    async def load():
+        yield 'alice'
+        # a create fails to reach the bitmaps while the rebuild is running
+        break_pipelines(db, monkeypatch)
+        filter.add_many(['carol'], db)
+        yield 'bob'
+
+    try:
+        run(filter.rebuild(load(), aio_db))
+        raise AssertionError('swap was not refused')
+
+    except RuntimeError:
+        pass
+
+    assert filter.absent_for_sure('carol', db) is False
+
+
+def test_failed_async_add_drops_filter(run, db, aio_db, monkeypatch):
+    filter = bloom()
+    run(rebuild(filter, [], aio_db))
+
+    break_pipelines(aio_db, monkeypatch)
+    run(filter.aadd_many(['carol'], aio_db))
+
+    assert run(filter.aabsent_for_sure('carol', aio_db)) is False
+
+
+def test_missing_write_back_refused_after_create(db):
+    # GetUser answered 1401, then the user was created before the write-back
+    seen, = generations([(missing_cache, 'erin')], db)
+    set_created(['erin'], db)
+    fill_missing('erin', seen, db)
+
+    assert known_missing('erin', db) is False
+
+    seen, = generations([(missing_cache, 'frank')], db)
+    fill_missing('frank', seen, db)
+    assert known_missing('frank', db) is True